@@ -0,0 +1,83 @@
+import asyncio
+import concurrent.futures
+import os
+import threading
+
+
+class AsyncRunner(object):
+    """
+    进程内共享的后台事件循环
+
+    Flask 请求线程是同步的，通过 run()/run_all() 把协程提交到这个循环上执行；
+    所有异步模型调用共享同一个并发信号量，单个进程即可同时挂起数十个慢请求，
+    而不必为每个请求占用一个工作线程。
+    """
+
+    def __init__(self, max_concurrency=32):
+        self.max_concurrency = max_concurrency
+        self._loop = None
+        self._semaphore = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _ensure_loop(self):
+        # fork 之后（如 gunicorn 预加载）子进程中需要重新创建事件循环线程
+        with self._lock:
+            if self._loop is None or self._pid != os.getpid():
+                loop = asyncio.new_event_loop()
+                ready = threading.Event()
+
+                def run():
+                    asyncio.set_event_loop(loop)
+                    self._semaphore = asyncio.Semaphore(self.max_concurrency)
+                    ready.set()
+                    loop.run_forever()
+
+                thread = threading.Thread(target=run, name='llm-async-loop', daemon=True)
+                thread.start()
+                ready.wait()
+                self._loop = loop
+                self._pid = os.getpid()
+        return self._loop
+
+    def limit(self):
+        """
+        进程级并发信号量，只能在后台事件循环内的协程中使用：
+
+            async with runner.limit():
+                ...
+        """
+        self._ensure_loop()
+        return self._semaphore
+
+    def run(self, coro, timeout=None):
+        """
+        在后台事件循环中执行协程，并阻塞等待结果
+
+        参数:
+            coro: 协程对象
+            timeout: 最长等待秒数（可选）
+
+        返回:
+            协程的返回值（协程抛出的异常会原样抛出）
+        """
+        loop = self._ensure_loop()
+        future = asyncio.run_coroutine_threadsafe(coro, loop)
+        try:
+            return future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            # 超时后取消协程，释放其占用的并发信号量
+            future.cancel()
+            raise
+
+    def run_all(self, coros, timeout=None):
+        """
+        并发执行多个协程，按传入顺序返回结果
+
+        返回:
+            结果列表；某个协程失败时对应位置为该异常对象
+        """
+        async def gather():
+            return await asyncio.gather(*coros, return_exceptions=True)
+
+        return self.run(gather(), timeout)
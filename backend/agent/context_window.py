@@ -0,0 +1,82 @@
+import functools
+import os
+import re
+
+# 中日韩字符大约 1 个字符 1 个 token，其余文本大约 4 个字符 1 个 token
+_CJK_PATTERN = re.compile(r'[\u2e80-\u9fff\uac00-\ud7af\uf900-\ufaff\uff00-\uffef]')
+
+# 每条消息在 role 等格式上的固定开销
+MESSAGE_OVERHEAD_TOKENS = 4
+
+DEFAULT_CONTEXT_TOKENS = int(os.environ.get('CHAT_CONTEXT_TOKENS', 8000))
+DEFAULT_RESERVED_OUTPUT_TOKENS = 1024
+
+
+@functools.lru_cache(maxsize=8192)
+def estimate_tokens(text):
+    """
+    快速估算文本的 token 数（不依赖分词器，结果按文本缓存）
+    """
+    if not text:
+        return 0
+    cjk = len(_CJK_PATTERN.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def message_tokens(message):
+    return estimate_tokens(message.get('content') or '') + MESSAGE_OVERHEAD_TOKENS
+
+
+class ContextWindow(object):
+    """
+    按 token 预算组装发送给模型的上下文
+
+    系统提示词和本轮问题始终保留，历史消息从最新的一条往前放入，超出预算的更早消息被丢弃。
+    预算在 model_list.json 的模型配置中设置：
+        "context_tokens": 上下文总预算（缺省时使用环境变量 CHAT_CONTEXT_TOKENS，默认 8000）
+        "max_output_tokens": 为模型回答预留的 token 数（默认 1024）
+    """
+
+    def __init__(self, max_tokens=DEFAULT_CONTEXT_TOKENS, reserved_output_tokens=DEFAULT_RESERVED_OUTPUT_TOKENS):
+        self.max_tokens = max_tokens
+        self.reserved_output_tokens = reserved_output_tokens
+
+    @classmethod
+    def from_model_config(cls, model_config):
+        return cls(
+            max_tokens=int(model_config.get('context_tokens') or DEFAULT_CONTEXT_TOKENS),
+            reserved_output_tokens=int(model_config.get('max_output_tokens') or DEFAULT_RESERVED_OUTPUT_TOKENS)
+        )
+
+    def fit(self, head_messages, history_newest_first, tail_messages):
+        """
+        组装上下文
+
+        参数:
+            head_messages: 必须保留的开头消息（系统提示词等）
+            history_newest_first: 历史消息，按从新到旧的顺序迭代（可以是逐批查询数据库的生成器）
+            tail_messages: 必须保留的结尾消息（本轮问题）
+
+        返回:
+            (消息列表, 是否丢弃了更早的历史)
+        """
+        budget = self.max_tokens - self.reserved_output_tokens
+        budget -= sum(message_tokens(m) for m in head_messages)
+        budget -= sum(message_tokens(m) for m in tail_messages)
+
+        kept = []
+        truncated = False
+        for message in history_newest_first:
+            cost = message_tokens(message)
+            if cost > budget:
+                truncated = True
+                break
+            kept.append(message)
+            budget -= cost
+        kept.reverse()
+
+        # 截断后不以孤立的模型回答开头
+        if truncated:
+            while kept and kept[0]['role'] == 'assistant':
+                kept.pop(0)
+        return list(head_messages) + kept + list(tail_messages), truncated
@@ -0,0 +1,184 @@
+import json
+import re
+
+# ```json ... ``` 代码块
+_CODE_FENCE_PATTERN = re.compile(r'```[a-zA-Z]*\s*\n?(.*?)```', re.S)
+
+# 字符串外出现的 Python 风格字面量
+_LITERALS = {'True': 'true', 'False': 'false', 'None': 'null'}
+
+
+def strip_code_fences(text):
+    """
+    去掉 Markdown 代码块标记，只保留第一个代码块中的内容（没有代码块时原样返回）
+    """
+    match = _CODE_FENCE_PATTERN.search(text)
+    if match:
+        return match.group(1)
+    # 只有开头的代码块标记（回答被截断）
+    return re.sub(r'^\s*```[a-zA-Z]*\s*\n?', '', text)
+
+
+def _next_significant(text, index):
+    """
+    index 之后第一个非空白字符（没有时返回空字符串）
+    """
+    while index < len(text) and text[index] in ' \t\r\n':
+        index += 1
+    return text[index] if index < len(text) else ''
+
+
+def _find_start(text):
+    """
+    JSON 的起始位置：优先取对象数组（'[' 之后第一个非空白字符为 '{'，说明文字中的 "[3]" 之类的方括号不算），
+    没有时取第一个对象；都没有时返回 -1
+    """
+    i = text.find('[')
+    while i >= 0:
+        if _next_significant(text, i + 1) == '{':
+            return i
+        i = text.find('[', i + 1)
+    return text.find('{')
+
+
+def is_object_items(value):
+    """
+    是否为生成结果需要的结构：由对象组成的非空数组，或对象（如结构化输出的 {"items": [...]}）
+    """
+    if isinstance(value, dict):
+        return True
+    return isinstance(value, list) and bool(value) and all(isinstance(item, dict) for item in value)
+
+
+def _drop_trailing_comma(out):
+    while out and out[-1] in ' \t\r\n':
+        out.pop()
+    if out and out[-1] == ',':
+        out.pop()
+
+
+def repair_json_text(text):
+    """
+    将模型输出的“近似 JSON”修正为合法的 JSON 文本
+
+    可以处理：
+        - Markdown 代码块和 JSON 前后的说明文字
+        - 对象和数组末尾多余的逗号（如 `},]`）
+        - 单引号字符串、没有引号的键名、Python 风格的 True / False / None
+        - 字符串中未转义的双引号和换行
+        - 输出被截断：丢弃最外层数组中不完整的最后一项，并补全缺失的括号
+
+    返回:
+        修正后的 JSON 文本；找不到 JSON 起始位置时返回 None
+    """
+    text = strip_code_fences(text)
+    i = _find_start(text)
+    if i < 0:
+        return None
+
+    out = []
+    stack = []
+    # 最外层为数组时，最近一个完整元素结束后的输出位置（用于截断时回退）
+    last_complete = None
+    quote = None
+    while i < len(text):
+        ch = text[i]
+
+        if quote is not None:
+            if ch == '\\' and i + 1 < len(text):
+                out.append(text[i:i + 2])
+                i += 2
+                continue
+            if ch == quote:
+                # 引号后面紧跟结构字符时才视为字符串结束，否则是内容中未转义的引号
+                following = _next_significant(text, i + 1)
+                if following in (',', ':', '}', ']', ''):
+                    out.append('"')
+                    quote = None
+                else:
+                    out.append('\\"' if quote == '"' else "'")
+                i += 1
+                continue
+            if ch == '"':
+                # 单引号字符串中的双引号
+                out.append('\\"')
+            elif ch == '\n':
+                out.append('\\n')
+            elif ch == '\r':
+                pass
+            elif ch == '\t':
+                out.append('\\t')
+            else:
+                out.append(ch)
+            i += 1
+            continue
+
+        if ch in '"\'':
+            quote = ch
+            out.append('"')
+        elif ch in '[{':
+            stack.append(ch)
+            out.append(ch)
+        elif ch in ']}':
+            if not stack:
+                break
+            _drop_trailing_comma(out)
+            # 以实际打开的括号为准，避免括号类型不匹配
+            opener = stack.pop()
+            out.append(']' if opener == '[' else '}')
+            if not stack:
+                return ''.join(out)
+            if len(stack) == 1 and stack[0] == '[':
+                last_complete = len(out)
+        elif ch == ',' and len(stack) == 1 and stack[0] == '[':
+            out.append(ch)
+            last_complete = len(out) - 1
+        elif ch.isalpha():
+            match = re.match(r'[A-Za-z_]+', text[i:])
+            word = match.group(0)
+            if word in _LITERALS:
+                out.append(_LITERALS[word])
+            elif _next_significant(text, i + len(word)) == ':':
+                # 没有引号的键名
+                out.append(f'"{word}"')
+            else:
+                out.append(word)
+            i += len(word)
+            continue
+        else:
+            out.append(ch)
+        i += 1
+
+    # 输出被截断：最外层为数组时回退到最后一个完整元素，再补全括号
+    if stack and stack[0] == '[':
+        if last_complete is not None:
+            out = out[:last_complete]
+            stack = ['[']
+        else:
+            out = ['[']
+            stack = ['[']
+    elif quote is not None:
+        out.append('"')
+    _drop_trailing_comma(out)
+    if out and out[-1] == ':':
+        out.append('null')
+    for opener in reversed(stack):
+        _drop_trailing_comma(out)
+        out.append(']' if opener == '[' else '}')
+    return ''.join(out)
+
+
+def repair_json(text):
+    """
+    尝试在本地修正并解析模型输出的 JSON
+
+    返回:
+        解析后的对象；无法修正时返回 None
+    """
+    repaired = repair_json_text(text or '')
+    if repaired is None:
+        return None
+    try:
+        return json.loads(repaired)
+    except ValueError:
+        return None
@@ -1,6 +1,7 @@
-from openai import OpenAI
 from datetime import datetime
 import json
+import os
+import threading
 # from module import db, History, ChatHistory
 from flask import Flask
 # from flask_cors import CORS
@@ -8,6 +9,17 @@ from copy import (
     deepcopy,
 )
 from agent.prompt import PROMPT # 只导入 PROMPT 字典
+from agent.async_runner import AsyncRunner
+from agent.context_window import ContextWindow
+from agent.response_cache import response_cache
+from agent.json_repair import repair_json, is_object_items
+from agent.stream_json import JsonArrayStream
+from agent.resilience import ModelUnavailableError
+from agent.router import ModelRouter
+from agent.rate_limit import rate_limiter
+from agent.schemas import STRUCTURED_OUTPUT_INSTRUCTION, response_format_for, validate_items
+from utils.metrics import metrics
+from utils.singleflight import single_flight
 
 # app = Flask(__name__, template_folder='template')
 # CORS(app)
@@ -20,22 +32,43 @@ from agent.prompt import PROMPT # 只导入 PROMPT 字典
 # db.init_app(app)
 
 from sql.chat_db import Chat
+from sql.chat_message_db import ChatMessage
+from sql.chat_summary_db import ChatSummary
+from utils.job_queue import job_queue
 from agent.prompt import *
 
 
 with open('./agent/model_list.json', 'r', encoding='utf-8') as f:
     model_list = json.load(f)
 
-chat_model = model_list['chat_model']["doubao1.6"]
-pic_model = model_list['pic_model']['dall-e-3']
+# 按任务类型选择模型（见 model_list.json 中的 routes）
+model_router = ModelRouter(model_list)
+
+# 本地修正失败后，最多让模型修正 JSON 格式的次数
+JSON_FIX_ATTEMPTS = int(os.environ.get('LLM_JSON_FIX_ATTEMPTS', 1))
 
 class LLM(object):
-    def __init__(self, chat_model, pic_model, temperature=0.8):
-        self.chat_model_name = chat_model['model_name']
-        self.pic_model_name = pic_model['model_name']
-        self.chat_client = OpenAI(api_key=chat_model['api_key'], base_url=chat_model['base_url'])
-        self.pic_client = OpenAI(api_key=pic_model['api_key'], base_url=pic_model['base_url'])
+    def __init__(self, router, temperature=0.8):
+        self.router = router
+        self.chat_model_name = router.primary_model_name()
+        self.pic_model_name = router.primary_model_name(ModelRouter.PICTURE)
         self.temperature = temperature
+        # 调用对话模型时的采样参数（同时作为回答缓存键的一部分）
+        self.sampling_params = {'top_p': 0.7}
+        # 各模型的聊天历史 token 预算（model_list.json 中的键名 -> ContextWindow，见 context_window()）
+        self._context_windows = {}
+        # model_list.json 中为模型单独配置的调用频率上限（rate_per_minute / burst）
+        for config in list(router.chat_configs.values()) + list(router.pic_configs.values()):
+            if config.get('rate_per_minute'):
+                rate_limiter.set_model_limit(config['model_name'], config['rate_per_minute'], config.get('burst'))
+        # 正在后台生成摘要的聊天ID
+        self._summarizing = set()
+        self._summary_lock = threading.Lock()
+
+        # 每个进程同时进行的异步模型调用上限
+        self.async_runner = AsyncRunner(
+            max_concurrency=int(os.environ.get('LLM_MAX_CONCURRENCY', 32))
+        )
 
         self.fix_json = '''
         I will provide text with formatting issues, and your task is to output the corrected JSON string. 
@@ -89,128 +122,420 @@ class LLM(object):
         self.history = None
 
     def save_history(self, question, answer, prompt, user_id, opera_id, chat_id=None):
+        """
+        保存一轮问答：新聊天写入系统提示词和本轮问答，已有聊天只追加本轮的两条消息
+        """
+        new_messages = [
+            {"role": "user", "content": question},
+            {"role": "assistant", "content": answer},
+        ]
         if chat_id is None:
-            new_history = [{"role": "system", "content": prompt}]
-        else:
-            new_history = [{"role": "system", "content": prompt}]
-            chat = Chat.get_chat_by_id(chat_id, user_id)
-            history = chat.chat_AI  # 使用属性访问而不是字典访问
-            # 确保 history 是列表类型
-            if isinstance(history, str):
-                print(f"Warning: chat_AI is string '{history}', converting to empty list")
-                history = []
-            elif history is None:
-                history = []
-            
-            for row in history:
-                new_history.append(row)
-        new_history.append({"role": "user", "content": question})
-        new_history.append({"role": "assistant", "content": answer})
+            Chat.create_chat(user_id, opera_id, [{"role": "system", "content": prompt}] + new_messages)
+            return
 
-        if chat_id is None:
-            chat = Chat.create_chat(user_id, opera_id, new_history)
-        else:
-            chat = Chat.update_chat_by_id(chat_id, user_id, new_history)
-        return
+        chat = Chat.get_chat_by_id(chat_id, user_id)
+        if isinstance(chat, tuple):
+            print(f"Warning: failed to save chat history: {chat[0]}")
+            return
+        rows = ChatMessage.append_messages_core(chat, new_messages)
+        if rows and not isinstance(rows, tuple):
+            self._schedule_summary(chat_id, rows[-1].seq)
+
+    def _schedule_summary(self, chat_id, last_seq):
+        """
+        较早的消息积累到一定数量后，在后台把它们压缩进聊天摘要（不阻塞当前请求）
+        """
+        if not ChatSummary.needs_update(chat_id, last_seq):
+            return
+        with self._summary_lock:
+            # 同一聊天同时只运行一个摘要任务
+            if chat_id in self._summarizing:
+                return
+            self._summarizing.add(chat_id)
 
-    def chat(self, question, prompt):
+        def run():
+            try:
+                result = ChatSummary.update_summary_core(chat_id)
+                if isinstance(result, tuple):
+                    print(f"Warning: failed to summarize chat {chat_id}: {result[0]}")
+                else:
+                    metrics.incr('llm.chat_summaries')
+            finally:
+                with self._summary_lock:
+                    self._summarizing.discard(chat_id)
+
+        job_queue.submit_background(run)
+
+    def chat(self, question, prompt, task=ModelRouter.DEFAULT):
         new_messages = [
             {"role": "system", "content": prompt},
             {"role": "user", "content": question},
         ]
+        return ''.join(self._stream_answer(new_messages, task=task))
+
+    def context_window(self, task=ModelRouter.DEFAULT):
+        """
+        任务首选模型的 token 预算（按 model_list.json 中该模型的 context_tokens / max_output_tokens，每个模型只构建一次）
+        """
+        key = self.router.route(task)[0]
+        window = self._context_windows.get(key)
+        if window is None:
+            window = self._context_windows[key] = ContextWindow.from_model_config(self.router.primary_config(task))
+        return window
+
+    def _build_messages(self, question, prompt, user_id, chat_id=None, task=ModelRouter.DEFAULT):
+        """
+        组装发送给模型的消息列表（系统提示词 + 历史记录 + 当前问题），历史按任务首选模型的 token 预算截取
+        """
+        head = [{"role": "system", "content": prompt}]
+        tail = [{"role": "user", "content": question}]
+        if not chat_id:
+            return head + tail
+
+        chat = Chat.get_chat_by_id(chat_id, user_id)
+        if isinstance(chat, tuple):
+            return head + tail
+
+        # 已压缩进摘要的较早消息以摘要形式发送，之后的消息原样发送
+        summary = ChatSummary.get_summary(chat_id)
+        after_seq = 0
+        if summary and summary.summary:
+            head.append({"role": "system", "content": f"Summary of the earlier conversation:\n{summary.summary}"})
+            after_seq = summary.covered_seq
+
+        # 系统提示词以本次传入的为准，历史中保存的系统消息不再重复发送；
+        # 历史从最新一条往前按 token 预算放入，超出预算的更早消息不再读取
+        history = (
+            row for row in ChatMessage.iter_messages_newest_first(chat, after_seq=after_seq)
+            if row["role"] != "system"
+        )
+        new_messages, truncated = self.context_window(task).fit(head, history, tail)
+        if truncated:
+            metrics.incr('llm.context_truncated')
+        return new_messages
+
+    def _structured_params(self, prompt, schema, task=ModelRouter.DEFAULT):
+        """
+        按任务首选模型配置的结构化输出模式调整系统提示词，并生成附加的请求参数
 
+        参数:
+            prompt: 系统提示词
+            schema: 结构名称（见 agent/schemas.py），为 None 时不使用结构化输出
+            task: 任务类型（见 ModelRouter）
+
+        返回:
+            (系统提示词, 附加请求参数)；切换到其他模型时由端点按自身配置调整 response_format
+        """
+        structured_output = (self.router.primary_config(task).get('structured_output') or '').lower()
+        if schema is None or structured_output not in ('json_schema', 'json_object'):
+            return prompt, {}
+        return prompt + STRUCTURED_OUTPUT_INSTRUCTION, {'response_format': response_format_for(schema)}
+
+    def _stream_answer(self, messages, extra_params=None, task=ModelRouter.DEFAULT, user_id=None):
+        """
+        调用对话模型（stream=True），逐块产出增量文本
+
+        每次尝试前按用户和实际调用的模型限流（见 agent/rate_limit.py），超出限额时排队，排队超时抛出 RateLimitExceeded；
+        按任务类型选择模型，建立请求失败时切换到路由中的下一个模型（见 agent/router.py）；
+        全部失败或熔断时抛出 ModelUnavailableError
+        """
         try:
-            response = self.chat_client.chat.completions.create(
-                model=self.chat_model_name,
-                messages=new_messages,
-                top_p=0.7,
+            response = self.router.call(task, lambda endpoint: endpoint.client.chat.completions.create(
+                model=endpoint.model_name,
+                messages=messages,
                 stream=True,
-            )
+                **self.sampling_params,
+                **endpoint.request_params(extra_params)
+            ), user_id=user_id)
         except Exception as e:
             print('chat_client error:', e)
-            print('current model is: ', self.chat_model_name)
-        answer = ''
-        print('思考中', end='\n')
+            print('current models are: ', self.router.route(task))
+            raise
         for trunk in response:
             if trunk.choices and len(trunk.choices) > 0:
                 if trunk.choices[0].delta and trunk.choices[0].delta.content:
-                    print(trunk.choices[0].delta.content, end='')
-                    answer += trunk.choices[0].delta.content
-        print('\n提问完成\n')
+                    yield trunk.choices[0].delta.content
+
+    def _cache_key(self, messages, use_cache, extra_params=None, task=ModelRouter.DEFAULT):
+        """
+        回答缓存的键（按任务首选模型区分）；未开启缓存或本次请求跳过缓存时返回 None
+        """
+        if response_cache is None or not use_cache:
+            return None
+        return response_cache.make_key(self.router.primary_model_name(task), messages,
+                                       dict(self.sampling_params, **(extra_params or {})))
+
+    def _cache_get(self, cache_key):
+        if cache_key is None:
+            return None
+        try:
+            answer = response_cache.get(cache_key)
+        except Exception as e:
+            print('response cache error:', e)
+            return None
+        metrics.incr('llm.response_cache_hit' if answer is not None else 'llm.response_cache_miss')
         return answer
 
-    def ask(self, question, prompt, user_id, opera_id, chat_id=None, save_history=False):
-        if not chat_id:
-            new_messages = [
-                {"role": "system", "content": prompt},
-                {"role": "user", "content": question},
-            ]
-        else:
-            new_messages = [{"role": "system", "content": prompt}]
-            chat = Chat.get_chat_by_id(chat_id, user_id)
-            history = chat.chat_AI
-            # 确保 history 是列表类型，如果是字符串则转换为空列表
-            if isinstance(history, str):
-                print(f"Warning: chat_AI is string '{history}', converting to empty list")
-                history = []
-            elif history is None:
-                history = []
-            
-            for row in history:
-                new_messages.append(row)
-            new_messages.append({"role": "user", "content": question})
+    def _cache_put(self, cache_key, answer):
+        if cache_key is None or not answer:
+            return
         try:
-            response = self.chat_client.chat.completions.create(
-                model=self.chat_model_name,
-                messages=new_messages,
-                top_p=0.7,
-                stream=True,
-            )
+            response_cache.put(cache_key, answer)
         except Exception as e:
-            print('chat_client error:', e)
-            print('current model is: ', self.chat_model_name)
-        answer = ''
-        print('思考中', end='\n')
-        for trunk in response:
-            if trunk.choices and len(trunk.choices) > 0:
-                if trunk.choices[0].delta and trunk.choices[0].delta.content:
-                    print(trunk.choices[0].delta.content, end='')
-                    answer += trunk.choices[0].delta.content
-        print('\n提问完成\n')
+            print('response cache error:', e)
+
+    def ask(self, question, prompt, user_id, opera_id, chat_id=None, save_history=False, use_cache=True, schema=None,
+            task=ModelRouter.DEFAULT):
+        """
+        调用对话模型并返回完整回答
+
+        开启回答缓存（LLM_RESPONSE_CACHE=1）时，发送内容完全相同的请求直接返回缓存的回答；
+        use_cache=False 时跳过缓存，用于用户明确要求重新生成的情况。
+        指定 schema 且模型配置了 structured_output 时，要求模型按该结构输出 JSON。
+        task 为任务类型（chat / help / character / outline / dialogue 等），用于按 model_list.json 的 routes 选择模型。
+        """
+        request_prompt, extra_params = self._structured_params(prompt, schema, task)
+        new_messages = self._build_messages(question, request_prompt, user_id, chat_id, task)
+        cache_key = self._cache_key(new_messages, use_cache, extra_params, task)
+        answer = self._cache_get(cache_key)
+        if answer is None:
+            answer = ''.join(self._stream_answer(new_messages, extra_params, task, user_id))
+            self._cache_put(cache_key, answer)
         if save_history:
             self.save_history(question, answer, prompt, user_id, opera_id, chat_id)
         return answer
 
+    def ask_stream(self, question, prompt, user_id, opera_id, chat_id=None, save_history=False, task=ModelRouter.DEFAULT):
+        """
+        流式版本的 ask：边生成边产出增量文本，生成结束后一次性保存历史记录
+
+        返回:
+            生成器，逐个产出模型输出的文本片段
+        """
+        new_messages = self._build_messages(question, prompt, user_id, chat_id, task)
+        answer_parts = []
+        for delta in self._stream_answer(new_messages, task=task, user_id=user_id):
+            answer_parts.append(delta)
+            yield delta
+        if save_history:
+            self.save_history(question, ''.join(answer_parts), prompt, user_id, opera_id, chat_id)
+
+    def ask_items(self, question, prompt, user_id, opera_id, schema, chat_id=None, save_history=False, use_cache=True,
+                  task=ModelRouter.DEFAULT):
+        """
+        生成 JSON 数组（角色列表、情节、对话等）并按结构校验
+
+        参数:
+            schema: 结构名称（character_list / outline / dialogue_list）
+
+        返回:
+            校验后的字典列表；无法解析或没有有效元素时返回 None
+        """
+        answer = self.ask(question, prompt, user_id, opera_id, chat_id=chat_id, save_history=save_history,
+                          use_cache=use_cache, schema=schema, task=task)
+        return self.parse_items(answer, schema)
+
+    def parse_items(self, text, schema):
+        """
+        解析模型回答中的 JSON 数组（或结构化输出的 {"items": [...]}），丢弃不符合结构的元素
+
+        返回:
+            校验后的字典列表；无法解析或没有有效元素时返回 None
+        """
+        try:
+            data = json.loads(text)
+            metrics.incr('llm.json_parse.direct')
+        except ValueError:
+            data = self.analyze_answer(text)
+        return validate_items(schema, data)
+
+    def ask_items_stream(self, question, prompt, user_id, opera_id, chat_id=None, save_history=False, use_cache=True,
+                         schema=None, task=ModelRouter.DEFAULT):
+        """
+        流式生成 JSON 数组（对话、情节、角色列表等），每个对象完整生成后立即产出，不必等待整段回答结束
+
+        流式解析没有得到任何对象时（如输出不是标准数组），回答结束后再用 analyze_answer 整体解析一次。
+        指定 schema 时使用结构化输出（见 ask），并跳过不符合结构的对象。
+
+        返回:
+            生成器，逐个产出数组中的对象（dict）
+        """
+        request_prompt, extra_params = self._structured_params(prompt, schema, task)
+        new_messages = self._build_messages(question, request_prompt, user_id, chat_id, task)
+        cache_key = self._cache_key(new_messages, use_cache, extra_params, task)
+        answer = self._cache_get(cache_key)
+
+        def checked(items):
+            if schema is None:
+                return items
+            return validate_items(schema, items) or []
+
+        parser = JsonArrayStream()
+        if answer is None:
+            answer_parts = []
+            for delta in self._stream_answer(new_messages, extra_params, task, user_id):
+                answer_parts.append(delta)
+                for item in checked(parser.feed(delta)):
+                    yield item
+            answer = ''.join(answer_parts)
+            self._cache_put(cache_key, answer)
+        else:
+            for item in checked(parser.feed(answer)):
+                yield item
+
+        if parser.count == 0:
+            items = self.analyze_answer(answer)
+            if isinstance(items, dict):
+                items = items.get('items', [items])
+            for item in checked(items) if isinstance(items, list) else []:
+                yield item
+        if save_history:
+            self.save_history(question, answer, prompt, user_id, opera_id, chat_id)
+
     def create_picture(self, prompt, user_id, opera_id):
+        """
+        调用图片模型生成图片，返回图片 URL
+
+        同一用户正在进行的相同提示词的生成会被合并，共享同一张图片；
+        失败时切换到 routes.picture 中的下一个模型；全部失败或熔断时抛出 ModelUnavailableError，其他错误返回 None
+        """
+        return single_flight.do(('create_picture', user_id, prompt), lambda: self._create_picture(prompt, user_id))
+
+    def _create_picture(self, prompt, user_id):
         try:
-            print('generating picture using: ', self.pic_model_name)
-            response = self.pic_client.images.generate(
-                model=self.pic_model_name,
+            print('generating picture using: ', self.router.route(ModelRouter.PICTURE))
+            response = self.router.call(ModelRouter.PICTURE, lambda endpoint: endpoint.client.images.generate(
+                model=endpoint.model_name,
                 prompt=prompt,
                 size="1024x1024",
                 quality="standard",
                 n=1,
-            )
+            ), user_id=user_id)
             image_url = response.data[0].url
             print('generate image_url: ', image_url)
             # self.save_history(question=prompt, answer="", prompt="", user_id=user_id, opera_id=opera_id)
             return image_url
+        except ModelUnavailableError:
+            print('pic model unavailable: ', self.router.route(ModelRouter.PICTURE))
+            raise
         except Exception as e:
             print('pic_client error:', e)
-            print('current model is: ', self.pic_model_name)
+            print('current models are: ', self.router.route(ModelRouter.PICTURE))
 
-    def analyze_answer(self, text):
-        try:
-            first_index = text.find('[')
-            last_index = text.rfind(']')
-            text = text[first_index:last_index + 1]
-            json_object = json.loads(text)
-            print(text)
-            return json_object
-        except:
+    async def acomplete(self, messages, use_cache=True, extra_params=None, task=ModelRouter.DEFAULT, user_id=None):
+        """
+        异步调用对话模型，返回完整回答文本
+
+        受进程级并发信号量限制，超出上限的调用在事件循环内排队等待；回答缓存、限流和模型路由与 ask 相同
+        """
+        cache_key = self._cache_key(messages, use_cache, extra_params, task)
+        answer = self._cache_get(cache_key)
+        if answer is not None:
+            return answer
+
+        async with self.async_runner.limit():
+            try:
+                response = await self.router.acall(task, lambda endpoint: endpoint.async_client().chat.completions.create(
+                    model=endpoint.model_name,
+                    messages=messages,
+                    stream=True,
+                    **self.sampling_params,
+                    **endpoint.request_params(extra_params)
+                ), user_id=user_id)
+            except Exception as e:
+                print('async chat_client error:', e)
+                print('current models are: ', self.router.route(task))
+                raise
+            answer_parts = []
+            async for trunk in response:
+                if trunk.choices and len(trunk.choices) > 0:
+                    if trunk.choices[0].delta and trunk.choices[0].delta.content:
+                        answer_parts.append(trunk.choices[0].delta.content)
+        answer = ''.join(answer_parts)
+        self._cache_put(cache_key, answer)
+        return answer
+
+    async def achat(self, question, prompt, use_cache=True, schema=None, task=ModelRouter.DEFAULT, user_id=None):
+        """
+        chat 的异步版本（不读写聊天历史）；schema、task 的含义与 ask 相同，user_id 用于限流
+        """
+        prompt, extra_params = self._structured_params(prompt, schema, task)
+        new_messages = [
+            {"role": "system", "content": prompt},
+            {"role": "user", "content": question},
+        ]
+        return await self.acomplete(new_messages, use_cache, extra_params, task, user_id)
+
+    async def acreate_picture(self, prompt, user_id=None):
+        """
+        create_picture 的异步版本，失败时返回 None（模型不可用时抛出 ModelUnavailableError）
+        """
+        async with self.async_runner.limit():
+            try:
+                response = await self.router.acall(ModelRouter.PICTURE, lambda endpoint: endpoint.async_client().images.generate(
+                    model=endpoint.model_name,
+                    prompt=prompt,
+                    size="1024x1024",
+                    quality="standard",
+                    n=1,
+                ), user_id=user_id)
+                return response.data[0].url
+            except ModelUnavailableError:
+                raise
+            except Exception as e:
+                print('async pic_client error:', e)
+                print('current models are: ', self.router.route(ModelRouter.PICTURE))
+                return None
+
+    def run_async(self, coro, timeout=None):
+        """
+        在同步代码中执行一个异步调用，例如 global_llm.run_async(global_llm.achat(q, p))
+        """
+        return self.async_runner.run(coro, timeout)
+
+    def run_all(self, coros, timeout=None):
+        """
+        在同步代码中并发执行多个异步调用，结果按顺序返回（失败项为异常对象）
+        """
+        return self.async_runner.run_all(coros, timeout)
+
+    def analyze_answer(self, text, max_fix_attempts=None):
+        """
+        从模型回答中解析 JSON 数组
+
+        依次尝试：直接解析 -> 本地修正（多余逗号、单引号、代码块、截断等）-> 让模型修正格式（最多 max_fix_attempts 次）。
+        各路径的使用次数记录在 metrics 的 llm.json_parse.* 中。
+
+        返回:
+            解析后的对象；全部失败时返回 None
+        """
+        if max_fix_attempts is None:
+            max_fix_attempts = JSON_FIX_ATTEMPTS
+        for attempt in range(max_fix_attempts + 1):
+            # 解析结果必须是对象数组（或对象），说明文字中的 "[3]" 之类解析成功也不算
+            try:
+                first_index = text.find('[')
+                last_index = text.rfind(']')
+                json_object = json.loads(text[first_index:last_index + 1])
+                if is_object_items(json_object):
+                    metrics.incr('llm.json_parse.direct' if attempt == 0 else 'llm.json_parse.llm_fixed')
+                    return json_object
+            except ValueError:
+                pass
+
+            json_object = repair_json(text)
+            if is_object_items(json_object):
+                metrics.incr('llm.json_parse.repaired')
+                return json_object
+
+            if attempt == max_fix_attempts:
+                break
             print("模型输出格式不符合json格式，将重新使用模型修正格式问题")
-            text = self.chat(question=text, prompt=self.fix_json)
-            json_object = self.analyze_answer(text=text)
-            return json_object
+            metrics.incr('llm.json_parse.llm_fix_calls')
+            text = self.chat(question=text, prompt=self.fix_json, task='json_fix')
+
+        print("模型输出无法解析为json")
+        metrics.incr('llm.json_parse.failed')
+        return None
 
-global_llm = LLM(chat_model=chat_model, pic_model=pic_model)
\ No newline at end of file
+global_llm = LLM(model_router)
\ No newline at end of file
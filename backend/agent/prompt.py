@@ -81,9 +81,21 @@ DIALOGUE_LIST_PROMPT = """Assume you are a playwright.
         },
         ]"""
 
+CHAT_SUMMARY_PROMPT = """
+#System
+You maintain a running summary of a tutoring conversation.
+I will provide the ###PREVIOUS_SUMMARY### (may be empty) and the ###NEW_MESSAGES### that follow it.
+#Instruction
+1.Rewrite them into one concise summary that keeps the user's goals, decisions, facts about the work (names, plots, characters) and open questions.
+2.Drop greetings and repeated content. Keep the summary under 300 words.
+3.Only output the summary text.
+If the conversation is Chinese, please output Chinese.
+"""
+
 PROMPT = {
     'character_list': CHARACTERLIST_PROMPT,
     'outline': OUTLINE_PROMPT,
     'chat': CHAT_PROMPT,
-    'dialogue_list': DIALOGUE_LIST_PROMPT
+    'dialogue_list': DIALOGUE_LIST_PROMPT,
+    'chat_summary': CHAT_SUMMARY_PROMPT
 }
\ No newline at end of file
@@ -0,0 +1,321 @@
+import asyncio
+import collections
+import os
+import threading
+import time
+from utils.metrics import metrics
+
+# redis 为可选依赖：只有 LLM_RATE_LIMIT_BACKEND=redis 时需要安装
+try:
+    import redis
+except ImportError:
+    redis = None
+
+# 每个用户每分钟可发起的模型调用次数及突发上限（0 表示不限制）
+USER_RATE_PER_MINUTE = float(os.environ.get('LLM_USER_RATE_PER_MINUTE', 0))
+USER_BURST = int(os.environ.get('LLM_USER_BURST', 5))
+# 每个模型每分钟的调用次数及突发上限（0 表示不限制；可在 model_list.json 的模型配置中用 rate_per_minute / burst 覆盖）
+MODEL_RATE_PER_MINUTE = float(os.environ.get('LLM_MODEL_RATE_PER_MINUTE', 0))
+MODEL_BURST = int(os.environ.get('LLM_MODEL_BURST', 20))
+# 超出限额的请求最多排队等待的秒数，以及每个用户最多同时排队的请求数；超出时返回 429
+MAX_WAIT_SECONDS = float(os.environ.get('LLM_RATE_LIMIT_MAX_WAIT', 30))
+MAX_QUEUED_PER_USER = int(os.environ.get('LLM_RATE_LIMIT_MAX_QUEUED', 5))
+# 排队时各用户的权重（如 "1=3,42=2"），权重为 n 的用户每轮最多连续获得 n 次调用机会，默认 1
+USER_WEIGHTS = {
+    int(user_id): int(weight)
+    for user_id, _, weight in (item.partition('=') for item in os.environ.get('LLM_RATE_LIMIT_USER_WEIGHTS', '').split(','))
+    if user_id.strip() and weight.strip()
+}
+
+
+class RateLimitExceeded(Exception):
+    """
+    排队超时或排队请求过多，接口层据此返回 429
+
+    retry_after: 建议客户端等待的秒数
+    """
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class MemoryBucketBackend(object):
+    """
+    进程内的令牌桶存储
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets = {}
+
+    def try_acquire(self, limits):
+        """
+        同时从多个令牌桶中各取一个令牌（全部可取时才扣除）
+
+        参数:
+            limits: [(键, 每秒补充的令牌数, 桶容量), ...]
+
+        返回:
+            (是否成功, 需要等待的秒数, 令牌不足的键)
+        """
+        now = time.time()
+        with self._lock:
+            states = []
+            for key, rate, burst in limits:
+                tokens, updated_at = self._buckets.get(key, (burst, now))
+                tokens = min(burst, tokens + (now - updated_at) * rate)
+                if tokens < 1:
+                    return False, (1 - tokens) / rate, key
+                states.append((key, tokens))
+            for key, tokens in states:
+                self._buckets[key] = (tokens - 1, now)
+            return True, 0, None
+
+
+class RedisBucketBackend(object):
+    """
+    基于 Redis 的令牌桶存储，多个进程 / 多台服务器共享限额
+    """
+
+    # 依次检查所有桶，全部有令牌时才扣除；返回 {是否成功, 等待毫秒数, 令牌不足的桶序号}
+    _SCRIPT = '''
+local now = tonumber(ARGV[1])
+local tokens = {}
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[i * 2])
+    local burst = tonumber(ARGV[i * 2 + 1])
+    local state = redis.call('HMGET', key, 'tokens', 'updated_at')
+    local current = tonumber(state[1]) or burst
+    local updated_at = tonumber(state[2]) or now
+    current = math.min(burst, current + (now - updated_at) * rate)
+    if current < 1 then
+        return {0, math.ceil((1 - current) / rate * 1000), i}
+    end
+    tokens[i] = current
+end
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[i * 2])
+    local burst = tonumber(ARGV[i * 2 + 1])
+    redis.call('HSET', key, 'tokens', tokens[i] - 1, 'updated_at', now)
+    redis.call('EXPIRE', key, math.ceil(burst / rate) + 60)
+end
+return {1, 0, 0}
+'''
+
+    def __init__(self, url, prefix='llm_rate:'):
+        if redis is None:
+            raise RuntimeError('LLM_RATE_LIMIT_BACKEND=redis requires the redis package')
+        self.prefix = prefix
+        self._client = redis.Redis.from_url(url)
+        self._script = self._client.register_script(self._SCRIPT)
+
+    def try_acquire(self, limits):
+        args = [time.time()]
+        for _, rate, burst in limits:
+            args.extend([rate, burst])
+        ok, wait_ms, index = self._script(keys=[self.prefix + key for key, _, _ in limits], args=args)
+        if ok:
+            return True, 0, None
+        return False, wait_ms / 1000, limits[index - 1][0]
+
+
+class _Waiter(object):
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.granted = False
+
+
+class _ModelQueue(object):
+    """
+    一个模型的排队请求：每个用户一个队列，按加权轮转依次放行
+    """
+
+    def __init__(self):
+        self.users = collections.OrderedDict()
+        # 当前轮次中正在放行的用户已经获得的次数
+        self.served = 0
+
+    def add(self, waiter):
+        self.users.setdefault(waiter.user_id, collections.deque()).append(waiter)
+
+    def remove(self, waiter):
+        queue = self.users.get(waiter.user_id)
+        if queue and waiter in queue:
+            queue.remove(waiter)
+            if not queue:
+                del self.users[waiter.user_id]
+                self.served = 0
+
+    def queued(self, user_id):
+        return len(self.users.get(user_id, ()))
+
+    def rotate(self):
+        """
+        当前用户的轮次结束，移到队尾
+        """
+        user_id, queue = self.users.popitem(last=False)
+        self.users[user_id] = queue
+        self.served = 0
+
+
+class RateLimiter(object):
+    """
+    按用户和模型的令牌桶限流
+
+    每次模型调用需要同时从“用户桶”和“模型桶”中各取一个令牌。取不到时请求在进程内排队而不是立即失败：
+    模型的额度按加权轮转在排队的用户之间分配，单个用户连续发起大量请求也不会挤占其他用户；
+    排队超过 max_wait 秒或同一用户排队请求过多时抛出 RateLimitExceeded。
+
+    令牌桶存储可替换：默认保存在进程内，设置 LLM_RATE_LIMIT_BACKEND=redis 后多个进程共享限额。
+    """
+
+    def __init__(self, backend, user_rate=0, user_burst=5, model_rate=0, model_burst=20,
+                 max_wait=30, max_queued_per_user=5, user_weights=None):
+        self.backend = backend
+        # 每分钟的调用次数
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.model_rate = model_rate
+        self.model_burst = model_burst
+        self.max_wait = max_wait
+        self.max_queued_per_user = max_queued_per_user
+        self.user_weights = user_weights or {}
+        # 模型名称 -> (每分钟次数, 突发上限)，来自 model_list.json
+        self.model_limits = {}
+        self._cond = threading.Condition()
+        self._queues = {}
+
+    def set_model_limit(self, model, rate_per_minute, burst=None):
+        self.model_limits[model] = (float(rate_per_minute), int(burst or self.model_burst))
+
+    def _limits(self, user_id, model):
+        limits = []
+        if self.user_rate > 0 and user_id is not None:
+            limits.append((f'user:{user_id}', self.user_rate / 60, self.user_burst))
+        model_rate, model_burst = self.model_limits.get(model, (self.model_rate, self.model_burst))
+        if model_rate > 0:
+            limits.append((f'model:{model}', model_rate / 60, model_burst))
+        return limits
+
+    def _pump(self, model, queue):
+        """
+        按加权轮转放行排队的请求（需持有锁）
+
+        返回:
+            下一次可能有令牌的等待秒数
+        """
+        next_wait = self.max_wait
+        skipped = set()
+        while queue.users and len(skipped) < len(queue.users):
+            user_id, waiters = next(iter(queue.users.items()))
+            if user_id in skipped:
+                queue.rotate()
+                continue
+            ok, wait, key = self.backend.try_acquire(self._limits(user_id, model))
+            if not ok:
+                next_wait = min(next_wait, wait)
+                if key.startswith('model:'):
+                    # 模型额度用完，所有用户都需要等待
+                    break
+                # 该用户自身的额度用完，本轮跳过
+                skipped.add(user_id)
+                queue.rotate()
+                continue
+            waiters.popleft().granted = True
+            queue.served += 1
+            if not waiters:
+                del queue.users[user_id]
+                queue.served = 0
+            elif queue.served >= self.user_weights.get(user_id, 1):
+                queue.rotate()
+        self._cond.notify_all()
+        return next_wait
+
+    def _enqueue(self, user_id, model):
+        """
+        尝试直接获取令牌；需要排队时返回排队对象（需持有锁）
+        """
+        limits = self._limits(user_id, model)
+        if not limits:
+            return None
+        queue = self._queues.setdefault(model, _ModelQueue())
+        if not queue.users:
+            ok, wait, _ = self.backend.try_acquire(limits)
+            if ok:
+                return None
+        if queue.queued(user_id) >= self.max_queued_per_user:
+            metrics.incr('llm.rate_limit.rejected')
+            raise RateLimitExceeded('Too many queued model requests, please retry later', self.max_wait)
+        waiter = _Waiter(user_id)
+        queue.add(waiter)
+        metrics.incr('llm.rate_limit.queued')
+        return waiter
+
+    def _give_up(self, model, waiter):
+        self._queues[model].remove(waiter)
+        metrics.incr('llm.rate_limit.timeout')
+        raise RateLimitExceeded(f'Model request queue wait exceeded {self.max_wait:g}s', self.max_wait)
+
+    def acquire(self, user_id, model):
+        """
+        获取一次调用额度，必要时排队等待
+
+        参数:
+            user_id: 用户ID（None 表示系统调用，只受模型限额约束）
+            model: 模型名称
+        """
+        started = time.time()
+        with self._cond:
+            waiter = self._enqueue(user_id, model)
+            if waiter is None:
+                return
+            queue = self._queues[model]
+            while True:
+                wait = self._pump(model, queue)
+                if waiter.granted:
+                    break
+                remaining = started + self.max_wait - time.time()
+                if remaining <= 0:
+                    self._give_up(model, waiter)
+                self._cond.wait(min(wait, remaining))
+        metrics.observe('llm.rate_limit.wait_seconds', time.time() - started)
+
+    async def acquire_async(self, user_id, model):
+        """
+        acquire 的异步版本（在事件循环中等待，不阻塞其他协程）
+        """
+        started = time.time()
+        with self._cond:
+            waiter = self._enqueue(user_id, model)
+            if waiter is None:
+                return
+            queue = self._queues[model]
+        while True:
+            with self._cond:
+                wait = self._pump(model, queue)
+                if waiter.granted:
+                    break
+                remaining = started + self.max_wait - time.time()
+                if remaining <= 0:
+                    self._give_up(model, waiter)
+            await asyncio.sleep(min(wait, remaining, 0.5))
+        metrics.observe('llm.rate_limit.wait_seconds', time.time() - started)
+
+
+def _create_backend():
+    if os.environ.get('LLM_RATE_LIMIT_BACKEND', 'memory') == 'redis':
+        return RedisBucketBackend(os.environ.get('LLM_RATE_LIMIT_REDIS_URL', 'redis://localhost:6379/0'))
+    return MemoryBucketBackend()
+
+
+rate_limiter = RateLimiter(
+    backend=_create_backend(),
+    user_rate=USER_RATE_PER_MINUTE,
+    user_burst=USER_BURST,
+    model_rate=MODEL_RATE_PER_MINUTE,
+    model_burst=MODEL_BURST,
+    max_wait=MAX_WAIT_SECONDS,
+    max_queued_per_user=MAX_QUEUED_PER_USER,
+    user_weights=USER_WEIGHTS
+)
@@ -0,0 +1,240 @@
+import asyncio
+import os
+import random
+import threading
+import time
+import openai
+from utils.metrics import metrics
+
+# 单次模型调用失败后的最大重试次数，以及指数退避的初始 / 最大间隔（秒，实际间隔在 0 与上限之间随机）
+RETRY_ATTEMPTS = int(os.environ.get('LLM_RETRIES', 2))
+RETRY_BASE_DELAY = float(os.environ.get('LLM_RETRY_BASE_DELAY', 0.5))
+RETRY_MAX_DELAY = float(os.environ.get('LLM_RETRY_MAX_DELAY', 8))
+# 包括重试在内，一次调用最多花费的时间（秒）；剩余时间不足以再等待一次退避时不再重试
+CALL_DEADLINE = float(os.environ.get('LLM_CALL_DEADLINE', 180))
+# 连续失败多少次后熔断，以及熔断后多久放行一次试探请求（秒）
+BREAKER_THRESHOLD = int(os.environ.get('LLM_BREAKER_THRESHOLD', 5))
+BREAKER_RESET_SECONDS = float(os.environ.get('LLM_BREAKER_RESET_SECONDS', 30))
+
+
+class ModelUnavailableError(Exception):
+    """
+    模型服务暂时不可用（熔断中或重试后仍然失败），接口层据此返回 503
+
+    retry_after: 建议客户端等待的秒数
+    """
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def is_retryable(error):
+    """
+    连接失败、超时、限流和 5xx 视为服务端的暂时性故障；参数错误、鉴权失败等直接抛出
+    """
+    if isinstance(error, (openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError)):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code >= 500
+    return False
+
+
+class CircuitBreaker(object):
+    """
+    单个模型的熔断器
+
+    closed: 正常放行；连续 failure_threshold 次暂时性故障后进入 open
+    open: 直接拒绝，reset_seconds 后进入 half_open
+    half_open: 只放行一个试探请求，成功则恢复 closed，失败则重新 open
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name, failure_threshold=5, reset_seconds=30):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0
+        self._probing = False
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._state == self.OPEN and time.time() - self._opened_at >= self.reset_seconds:
+                return self.HALF_OPEN
+            return self._state
+
+    def retry_after(self):
+        with self._lock:
+            return max(self.reset_seconds - (time.time() - self._opened_at), 0)
+
+    def allow(self):
+        """
+        是否放行本次调用
+        """
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.OPEN:
+                if time.time() - self._opened_at < self.reset_seconds:
+                    return False
+                self._state = self.HALF_OPEN
+                self._probing = False
+            # half_open：同一时间只放行一个试探请求
+            if self._probing:
+                return False
+            self._probing = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._probing = False
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != self.OPEN:
+                    metrics.incr(f'llm.breaker_opened.{self.name}')
+                self._state = self.OPEN
+                self._opened_at = time.time()
+
+    def release(self):
+        """
+        本次调用既不算成功也不算失败（请求本身有误）：不改变熔断状态，只释放半开状态下的试探名额
+        """
+        with self._lock:
+            self._probing = False
+
+    def snapshot(self):
+        state = self.state
+        with self._lock:
+            return {'state': state, 'consecutive_failures': self._failures}
+
+
+class Resilience(object):
+    """
+    模型调用的重试与熔断
+
+    每个模型一个熔断器；暂时性故障按带随机抖动的指数退避重试，直到次数用完或超过调用期限，
+    熔断期间的调用立即失败，不再等待超时。
+
+    用法:
+        resilience.call('gpt-4o', lambda: client.chat.completions.create(...))
+        await resilience.acall('gpt-4o', lambda: async_client.chat.completions.create(...))
+    """
+
+    def __init__(self, retries=2, base_delay=0.5, max_delay=8, deadline=180,
+                 failure_threshold=5, reset_seconds=30):
+        self.retries = retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def breaker(self, name):
+        with self._lock:
+            breaker = self._breakers.get(name)
+            if breaker is None:
+                breaker = self._breakers[name] = CircuitBreaker(name, self.failure_threshold, self.reset_seconds)
+            return breaker
+
+    def _backoff(self, attempt):
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    def _before_attempt(self, name, breaker):
+        if not breaker.allow():
+            metrics.incr(f'llm.breaker_rejected.{name}')
+            raise ModelUnavailableError(f'Model {name} is temporarily unavailable', breaker.retry_after())
+
+    def _after_failure(self, name, breaker, error, attempt, started, retries):
+        """
+        记录一次失败，返回下一次重试前的等待秒数；不再重试时抛出异常
+        """
+        if not is_retryable(error):
+            # 请求本身的问题（服务能够正常响应），不计入熔断，也不能据此关闭半开的熔断器
+            breaker.release()
+            raise error
+        breaker.record_failure()
+        metrics.incr(f'llm.call_failed.{name}')
+        delay = self._backoff(attempt)
+        if attempt >= retries or time.time() - started + delay > self.deadline:
+            raise ModelUnavailableError(f'Model {name} call failed: {error}', breaker.retry_after() or None) from error
+        metrics.incr(f'llm.retry.{name}')
+        print(f'model {name} call failed ({error}), retrying in {delay:.1f}s')
+        return delay
+
+    def call(self, name, func, retries=None):
+        """
+        同步调用 func()，失败时按策略重试
+
+        参数:
+            name: 模型（熔断器）名称
+            func: 无参数的调用函数
+            retries: 本次调用的最大重试次数（可选，默认使用 LLM_RETRIES；有备用模型时可设为 0 以便尽快切换）
+        """
+        if retries is None:
+            retries = self.retries
+        breaker = self.breaker(name)
+        started = time.time()
+        attempt = 0
+        while True:
+            self._before_attempt(name, breaker)
+            try:
+                result = func()
+            except Exception as e:
+                time.sleep(self._after_failure(name, breaker, e, attempt, started, retries))
+                attempt += 1
+                continue
+            breaker.record_success()
+            return result
+
+    async def acall(self, name, func, retries=None):
+        """
+        call 的异步版本，func() 返回一个可等待对象
+        """
+        if retries is None:
+            retries = self.retries
+        breaker = self.breaker(name)
+        started = time.time()
+        attempt = 0
+        while True:
+            self._before_attempt(name, breaker)
+            try:
+                result = await func()
+            except Exception as e:
+                await asyncio.sleep(self._after_failure(name, breaker, e, attempt, started, retries))
+                attempt += 1
+                continue
+            breaker.record_success()
+            return result
+
+    def breaker_states(self):
+        """
+        各模型熔断器的状态，用于 /api/metrics
+        """
+        with self._lock:
+            breakers = list(self._breakers.values())
+        return {breaker.name: breaker.snapshot() for breaker in breakers}
+
+
+resilience = Resilience(
+    retries=RETRY_ATTEMPTS,
+    base_delay=RETRY_BASE_DELAY,
+    max_delay=RETRY_MAX_DELAY,
+    deadline=CALL_DEADLINE,
+    failure_threshold=BREAKER_THRESHOLD,
+    reset_seconds=BREAKER_RESET_SECONDS
+)
@@ -0,0 +1,104 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+class ResponseCache(object):
+    """
+    按请求内容精确匹配的模型回答缓存（SQLite 文件存储，多进程共享，重启后仍然有效）
+
+    缓存键为 (模型, 消息列表, 采样参数) 的 SHA-256，消息列表中包含系统提示词；
+    条目超过 ttl_seconds 后失效，总数超过 max_entries 时淘汰最久未使用的条目。
+    """
+
+    def __init__(self, path, ttl_seconds=86400, max_entries=5000):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connect(self):
+        """
+        首次使用时打开数据库（需持有锁）
+        """
+        if self._conn is None:
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, timeout=10, check_same_thread=False)
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS llm_response ('
+                'cache_key TEXT PRIMARY KEY, response TEXT NOT NULL, '
+                'created_at REAL NOT NULL, last_used REAL NOT NULL)'
+            )
+            self._conn.execute('CREATE INDEX IF NOT EXISTS ix_llm_response_last_used ON llm_response (last_used)')
+            self._conn.commit()
+        return self._conn
+
+    @staticmethod
+    def make_key(model, messages, params):
+        payload = json.dumps(
+            {'model': model, 'messages': messages, 'params': params},
+            ensure_ascii=False, sort_keys=True
+        )
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """
+        获取未过期的缓存回答，未命中时返回 None
+        """
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute(
+                'SELECT response, created_at FROM llm_response WHERE cache_key = ?', (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if now - row[1] > self.ttl_seconds:
+                conn.execute('DELETE FROM llm_response WHERE cache_key = ?', (key,))
+                conn.commit()
+                return None
+            conn.execute('UPDATE llm_response SET last_used = ? WHERE cache_key = ?', (now, key))
+            conn.commit()
+            return row[0]
+
+    def put(self, key, response):
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            conn.execute(
+                'INSERT OR REPLACE INTO llm_response (cache_key, response, created_at, last_used) VALUES (?, ?, ?, ?)',
+                (key, response, now, now)
+            )
+            # 删除过期条目，并按最近使用时间淘汰超出上限的条目
+            conn.execute('DELETE FROM llm_response WHERE created_at < ?', (now - self.ttl_seconds,))
+            conn.execute(
+                'DELETE FROM llm_response WHERE cache_key IN ('
+                'SELECT cache_key FROM llm_response ORDER BY last_used DESC LIMIT -1 OFFSET ?)',
+                (self.max_entries,)
+            )
+            conn.commit()
+
+    def clear(self):
+        with self._lock:
+            conn = self._connect()
+            conn.execute('DELETE FROM llm_response')
+            conn.commit()
+
+
+def _create_response_cache():
+    if os.environ.get('LLM_RESPONSE_CACHE', '0') != '1':
+        return None
+    return ResponseCache(
+        path=os.environ.get('LLM_RESPONSE_CACHE_PATH', './data/llm_response_cache.sqlite3'),
+        ttl_seconds=int(os.environ.get('LLM_RESPONSE_CACHE_TTL', 86400)),
+        max_entries=int(os.environ.get('LLM_RESPONSE_CACHE_MAX_ENTRIES', 5000))
+    )
+
+
+# 默认关闭，设置 LLM_RESPONSE_CACHE=1 开启
+response_cache = _create_response_cache()
@@ -0,0 +1,246 @@
+import collections
+import os
+import random
+import threading
+import time
+import openai
+from openai import OpenAI, AsyncOpenAI
+from agent.resilience import resilience, ModelUnavailableError
+from agent.rate_limit import rate_limiter
+from utils.metrics import metrics
+
+# 未在 model_list.json 的 routes 中配置时使用的对话模型和图片模型（model_list.json 中的键名）
+DEFAULT_CHAT_MODEL = os.environ.get('LLM_CHAT_MODEL', 'doubao1.6')
+DEFAULT_PIC_MODEL = os.environ.get('LLM_PIC_MODEL', 'dall-e-3')
+# 单次请求的超时（秒）；重试由 agent/resilience.py 负责，客户端自身不再重试
+CHAT_TIMEOUT = float(os.environ.get('LLM_CHAT_TIMEOUT', 120))
+PIC_TIMEOUT = float(os.environ.get('LLM_PIC_TIMEOUT', 120))
+# 响应延迟的 p95 超过该秒数的端点被视为过慢，排到同一路由的其他端点之后
+SLOW_SECONDS = float(os.environ.get('LLM_ROUTER_SLOW_SECONDS', 20))
+# 延迟统计只使用最近这么多秒内的样本；过期后端点重新参与正常排序，以便恢复后重新被选中
+LATENCY_WINDOW_SECONDS = float(os.environ.get('LLM_ROUTER_WINDOW_SECONDS', 300))
+# 计算 p95 所需的最少样本数
+MIN_SAMPLES = 5
+# 某个端点返回这些错误时说明端点本身配置有误（密钥失效、无权限、模型不存在），切换到下一个端点
+_ENDPOINT_ERRORS = (openai.AuthenticationError, openai.PermissionDeniedError, openai.NotFoundError)
+
+
+class ModelEndpoint(object):
+    """
+    一个可调用的模型端点：模型配置中的一组 (api_key, base_url)
+
+    记录最近的响应延迟（流式请求为收到响应头的时间），用于路由时的排序和负载均衡。
+    """
+
+    def __init__(self, name, config, timeout):
+        self.name = name
+        self.config = config
+        self.model_name = config['model_name']
+        self.timeout = float(config.get('timeout') or timeout)
+        self.client = OpenAI(api_key=config['api_key'], base_url=config['base_url'],
+                             timeout=self.timeout, max_retries=0)
+        self._async_client = None
+        self._latencies = collections.deque(maxlen=200)
+        self._lock = threading.Lock()
+
+    def async_client(self):
+        """
+        异步客户端（只能在后台事件循环中调用；AsyncOpenAI 绑定首次使用时所在的事件循环）
+        """
+        if self._async_client is None:
+            self._async_client = AsyncOpenAI(api_key=self.config['api_key'], base_url=self.config['base_url'],
+                                             timeout=self.timeout, max_retries=0)
+        return self._async_client
+
+    def record_latency(self, seconds):
+        with self._lock:
+            self._latencies.append((time.time(), seconds))
+        metrics.observe(f'llm.latency.{self.name}', seconds)
+
+    def latency_percentiles(self):
+        """
+        返回:
+            (p50, p95, 样本数)；没有近期样本时 p50 / p95 为 None
+        """
+        cutoff = time.time() - LATENCY_WINDOW_SECONDS
+        with self._lock:
+            while self._latencies and self._latencies[0][0] < cutoff:
+                self._latencies.popleft()
+            samples = sorted(latency for _, latency in self._latencies)
+        if not samples:
+            return None, None, 0
+        return samples[len(samples) // 2], samples[min(int(len(samples) * 0.95), len(samples) - 1)], len(samples)
+
+    def degraded(self):
+        """
+        熔断中，或近期 p95 延迟超过 LLM_ROUTER_SLOW_SECONDS
+        """
+        if resilience.breaker(self.name).state == 'open':
+            return True
+        _, p95, count = self.latency_percentiles()
+        return count >= MIN_SAMPLES and p95 > SLOW_SECONDS
+
+    def request_params(self, extra_params):
+        """
+        按端点能力调整附加请求参数：不支持结构化输出的模型不传 response_format
+        """
+        if not extra_params or 'response_format' not in extra_params:
+            return extra_params or {}
+        mode = (self.config.get('structured_output') or '').lower()
+        params = dict(extra_params)
+        if mode == 'json_object':
+            params['response_format'] = {'type': 'json_object'}
+        elif mode != 'json_schema':
+            params.pop('response_format')
+        return params
+
+
+class ModelRouter(object):
+    """
+    按任务类型在多个模型之间路由，并在失败时切换到下一个模型
+
+    model_list.json 中的 routes 为每种任务配置按优先级排列的模型（chat_model / pic_model 中的键名），例如:
+        "routes": {
+            "help": ["doubao-lite", "doubao1.6"],
+            "dialogue": ["doubao1.6", "deepseek-v3"],
+            "picture": ["dall-e-3"]
+        }
+    未配置的任务使用 routes.default（图片任务为 routes.picture），仍未配置时使用 LLM_CHAT_MODEL / LLM_PIC_MODEL。
+
+    一个模型可以配置多组密钥和地址（"endpoints": [{"api_key": ..., "base_url": ...}, ...]，或 api_key 写成列表），
+    同一模型的端点按近期 p50 延迟加权随机排序以分摊负载；熔断中或 p95 延迟过高的端点排到最后。
+    """
+
+    # 对话任务类型：chat 聊天，help 写作辅助（*_help），summary 聊天摘要，character / outline / dialogue 生成，json_fix 修正 JSON 格式
+    PICTURE = 'picture'
+    DEFAULT = 'default'
+
+    def __init__(self, model_list):
+        self.routes = dict(model_list.get('routes') or {})
+        self.routes.setdefault(self.DEFAULT, [DEFAULT_CHAT_MODEL])
+        self.routes.setdefault(self.PICTURE, [DEFAULT_PIC_MODEL])
+        self.chat_configs = model_list.get('chat_model') or {}
+        self.pic_configs = model_list.get('pic_model') or {}
+
+        self._endpoints = {}
+        for task, keys in self.routes.items():
+            configs = self.pic_configs if task == self.PICTURE else self.chat_configs
+            timeout = PIC_TIMEOUT if task == self.PICTURE else CHAT_TIMEOUT
+            for key in keys:
+                if key not in configs:
+                    raise KeyError(f"Model '{key}' in route '{task}' is not defined in model_list.json")
+                if key not in self._endpoints:
+                    self._endpoints[key] = self._create_endpoints(key, configs[key], timeout)
+
+    @staticmethod
+    def _create_endpoints(key, config, timeout):
+        entries = config.get('endpoints')
+        if not entries:
+            api_keys = config['api_key'] if isinstance(config['api_key'], list) else [config['api_key']]
+            entries = [{'api_key': api_key} for api_key in api_keys]
+        endpoints = []
+        for i, entry in enumerate(entries):
+            endpoint_config = dict(config, **entry)
+            endpoint_config.pop('endpoints', None)
+            name = key if len(entries) == 1 else f'{key}#{i + 1}'
+            endpoints.append(ModelEndpoint(name, endpoint_config, timeout))
+        return endpoints
+
+    def route(self, task):
+        return self.routes.get(task) or self.routes[self.DEFAULT]
+
+    def primary_config(self, task=DEFAULT):
+        """
+        任务首选模型的配置（上下文预算、结构化输出等按它确定）
+        """
+        key = self.route(task)[0]
+        return (self.pic_configs if task == self.PICTURE else self.chat_configs)[key]
+
+    def primary_model_name(self, task=DEFAULT):
+        return self.primary_config(task)['model_name']
+
+    def candidates(self, task):
+        """
+        本次调用依次尝试的端点
+        """
+        ordered = []
+        for key in self.route(task):
+            endpoints = self._endpoints[key]
+            p50s = [endpoint.latency_percentiles()[0] for endpoint in endpoints]
+            known = [p50 for p50 in p50s if p50]
+            # 没有近期样本的端点按已知端点中最快的延迟对待，使其有机会被选中
+            default_p50 = min(known) if known else 1.0
+            # 按 1/p50 加权的随机排序（延迟越低越可能排在前面）
+            weighted = [
+                (random.random() ** (p50 or default_p50), endpoint)
+                for p50, endpoint in zip(p50s, endpoints)
+            ]
+            ordered.extend(endpoint for _, endpoint in sorted(weighted, key=lambda item: item[0], reverse=True))
+        healthy = [endpoint for endpoint in ordered if not endpoint.degraded()]
+        return healthy + [endpoint for endpoint in ordered if endpoint not in healthy]
+
+    def _next_or_raise(self, task, endpoint, error, is_last):
+        if is_last:
+            raise error
+        print(f'model {endpoint.name} failed for task {task} ({error}), switching to next model')
+        metrics.incr(f'llm.router.failover.{endpoint.name}')
+
+    def call(self, task, func, user_id=None):
+        """
+        依次在候选端点上调用 func(endpoint)，直到成功
+
+        除最后一个端点外不在同一端点上重试，失败后直接切换到下一个端点。
+        每次尝试前按用户和实际调用的模型限流（见 agent/rate_limit.py），切换到备用模型时计入备用模型的限额。
+
+        参数:
+            user_id: 发起调用的用户ID（None 表示系统调用，只受模型限额约束）
+
+        返回:
+            func 的返回值；全部端点都失败时抛出最后一个端点的异常
+        """
+        candidates = self.candidates(task)
+        for i, endpoint in enumerate(candidates):
+            is_last = i == len(candidates) - 1
+            rate_limiter.acquire(user_id, endpoint.model_name)
+            started = time.time()
+            try:
+                result = resilience.call(endpoint.name, lambda: func(endpoint), retries=None if is_last else 0)
+            except (ModelUnavailableError,) + _ENDPOINT_ERRORS as e:
+                self._next_or_raise(task, endpoint, e, is_last)
+                continue
+            endpoint.record_latency(time.time() - started)
+            return result
+
+    async def acall(self, task, func, user_id=None):
+        """
+        call 的异步版本，func(endpoint) 返回一个可等待对象
+        """
+        candidates = self.candidates(task)
+        for i, endpoint in enumerate(candidates):
+            is_last = i == len(candidates) - 1
+            await rate_limiter.acquire_async(user_id, endpoint.model_name)
+            started = time.time()
+            try:
+                result = await resilience.acall(endpoint.name, lambda: func(endpoint), retries=None if is_last else 0)
+            except (ModelUnavailableError,) + _ENDPOINT_ERRORS as e:
+                self._next_or_raise(task, endpoint, e, is_last)
+                continue
+            endpoint.record_latency(time.time() - started)
+            return result
+
+    def stats(self):
+        """
+        各端点的近期延迟和状态，用于 /api/metrics
+        """
+        stats = {}
+        for endpoints in self._endpoints.values():
+            for endpoint in endpoints:
+                p50, p95, count = endpoint.latency_percentiles()
+                stats[endpoint.name] = {
+                    'model_name': endpoint.model_name,
+                    'p50': p50,
+                    'p95': p95,
+                    'samples': count,
+                    'degraded': endpoint.degraded(),
+                }
+        return {'routes': self.routes, 'endpoints': stats}
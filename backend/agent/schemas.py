@@ -0,0 +1,175 @@
+from typing import Any, Dict, List, Optional, Union
+from pydantic import BaseModel, ConfigDict, ValidationError, field_validator
+from utils.metrics import metrics
+
+
+def _coerce_str(value):
+    # 模型常把空字段输出为 null，或把文本字段输出为数字
+    if value is None:
+        return ''
+    if isinstance(value, (int, float)):
+        return str(value)
+    return value
+
+
+def _coerce_list(value):
+    # 只有一个元素时模型常省略外层列表
+    if value is None:
+        return []
+    if isinstance(value, (str, dict)):
+        return [value]
+    return value
+
+
+class _Item(BaseModel):
+    # 保留模型额外输出的字段，只校验业务代码依赖的字段；
+    # 标识元素的字段（角色名、情节名、对话角色和内容）必须出现，值为 null 时按空字符串处理
+    model_config = ConfigDict(extra='allow')
+
+
+class CharacterRelation(_Item):
+    name: str
+    relation: Optional[str] = ''
+
+    _strings = field_validator('name', 'relation', mode='before')(_coerce_str)
+
+
+class CharacterItem(_Item):
+    """
+    CHARACTERLIST_PROMPT 输出中的一个角色
+    """
+    name: str
+    personality: Optional[str] = ''
+    appearance: Optional[str] = ''
+    image: Optional[List[Any]] = []
+    related: Optional[Union[List[Union[CharacterRelation, str]], Dict[str, Any]]] = []
+
+    _strings = field_validator('name', 'personality', 'appearance', mode='before')(_coerce_str)
+
+    @field_validator('image', mode='before')
+    @classmethod
+    def _image(cls, value):
+        return _coerce_list(value)
+
+    @field_validator('related', mode='before')
+    @classmethod
+    def _related(cls, value):
+        if value is None:
+            return []
+        if isinstance(value, str):
+            return [value]
+        return value
+
+
+class PlotScene(_Item):
+    name: Optional[str] = ''
+    content: Optional[str] = ''
+
+    _strings = field_validator('name', 'content', mode='before')(_coerce_str)
+
+
+class PlotItem(_Item):
+    """
+    OUTLINE_PROMPT 输出中的一个情节
+    """
+    plotName: str
+    scene: Optional[PlotScene] = None
+    beat: Optional[str] = ''
+    characters: Optional[List[str]] = []
+
+    _strings = field_validator('plotName', 'beat', mode='before')(_coerce_str)
+
+    @field_validator('scene', mode='before')
+    @classmethod
+    def _scene(cls, value):
+        # 场景只给出名称时按名称处理
+        if isinstance(value, str):
+            return {'name': value}
+        return value
+
+    @field_validator('characters', mode='before')
+    @classmethod
+    def _characters(cls, value):
+        return [_coerce_str(name) for name in _coerce_list(value)]
+
+
+class DialogueLine(_Item):
+    """
+    DIALOGUE_LIST_PROMPT 输出中的一条对话
+    """
+    character: str
+    content: str
+    monologue: Optional[str] = ''
+
+    _strings = field_validator('character', 'content', 'monologue', mode='before')(_coerce_str)
+
+
+# 结构化生成的结果：列表外包一层对象（结构化输出模式要求顶层为对象）
+class CharacterList(BaseModel):
+    items: List[CharacterItem]
+
+
+class PlotList(BaseModel):
+    items: List[PlotItem]
+
+
+class DialogueList(BaseModel):
+    items: List[DialogueLine]
+
+
+# 按提示词名称（与 PROMPT 的键一致）索引的结果结构和元素结构
+SCHEMAS = {
+    'character_list': CharacterList,
+    'outline': PlotList,
+    'dialogue_list': DialogueList,
+}
+ITEM_SCHEMAS = {
+    'character_list': CharacterItem,
+    'outline': PlotItem,
+    'dialogue_list': DialogueLine,
+}
+
+# 结构化输出模式下追加到系统提示词末尾的说明
+STRUCTURED_OUTPUT_INSTRUCTION = '''
+Output a single JSON object of the form {"items": [...]}, where each element of "items" follows the ###OutputExample###.
+'''
+
+
+def response_format_for(schema_name):
+    """
+    OpenAI 兼容接口的 json_schema 类型 response_format
+    """
+    return {
+        'type': 'json_schema',
+        'json_schema': {
+            'name': schema_name,
+            'schema': SCHEMAS[schema_name].model_json_schema(),
+        },
+    }
+
+
+def validate_items(schema_name, data):
+    """
+    按结构校验模型输出的列表，丢弃不符合结构的元素
+
+    参数:
+        schema_name: 结构名称（character_list / outline / dialogue_list）
+        data: 解析后的 JSON（列表，或结构化输出的 {"items": [...]}）
+
+    返回:
+        校验后的字典列表；没有任何有效元素时返回 None
+    """
+    if isinstance(data, dict) and isinstance(data.get('items'), list):
+        data = data['items']
+    if not isinstance(data, list):
+        return None
+
+    item_model = ITEM_SCHEMAS[schema_name]
+    items = []
+    for item in data:
+        try:
+            items.append(item_model.model_validate(item).model_dump(exclude_unset=True))
+        except ValidationError as e:
+            metrics.incr('llm.schema_invalid_items')
+            print(f'丢弃不符合 {schema_name} 结构的元素: {item!r:.200} ({e.error_count()} errors)')
+    return items or None
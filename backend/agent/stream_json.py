@@ -0,0 +1,101 @@
+import json
+from agent.json_repair import repair_json
+
+
+class JsonArrayStream(object):
+    """
+    增量解析模型流式输出中的 JSON 数组：每当数组中的一个对象完整到达（右花括号出现）时立即产出该对象
+
+    只保留当前正在接收的对象的文本，不需要等待整段回答结束；
+    单个对象格式不规范时使用本地 JSON 修正，仍无法解析的对象被跳过。
+
+    用法:
+        parser = JsonArrayStream()
+        for delta in deltas:
+            for item in parser.feed(delta):
+                ...
+    """
+
+    def __init__(self):
+        self._buffer = []
+        self._started = False
+        # 刚读到可能是数组开始的 '['，等待下一个非空白字符确认
+        self._opening = False
+        self._finished = False
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self.count = 0
+
+    @property
+    def finished(self):
+        return self._finished
+
+    def feed(self, chunk):
+        """
+        输入一段增量文本
+
+        返回:
+            本段文本中完成的对象列表（可能为空）
+        """
+        items = []
+        for ch in chunk:
+            if self._finished:
+                break
+            if not self._started:
+                # 跳过数组之前的说明文字和代码块标记；'[' 之后第一个非空白字符为 '{' 才是对象数组的开始，
+                # 说明文字中的方括号（如 "Here are [15] characters"）不会被当成数组
+                if self._opening and ch not in ' \t\r\n':
+                    self._opening = False
+                    if ch == '{':
+                        self._started = True
+                        self._buffer = [ch]
+                        self._depth = 1
+                        continue
+                if ch == '[':
+                    self._opening = True
+                continue
+
+            if self._depth == 0:
+                # 元素之间的逗号和空白
+                if ch == '{':
+                    self._buffer = [ch]
+                    self._depth = 1
+                elif ch == ']':
+                    self._finished = True
+                continue
+
+            self._buffer.append(ch)
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == '\\':
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                continue
+
+            if ch == '"':
+                self._in_string = True
+            elif ch in '{[':
+                self._depth += 1
+            elif ch in '}]':
+                self._depth -= 1
+                if self._depth == 0:
+                    item = self._parse(''.join(self._buffer))
+                    self._buffer = []
+                    if item is not None:
+                        self.count += 1
+                        items.append(item)
+        return items
+
+    @staticmethod
+    def _parse(text):
+        try:
+            return json.loads(text)
+        except ValueError:
+            repaired = repair_json(f'[{text}]')
+            if isinstance(repaired, list) and repaired and isinstance(repaired[0], dict):
+                return repaired[0]
+            return None
+
@@ -17,3 +17,7 @@ from . import scene
 from . import scene_image
 from . import dialogue
 from . import chat
+from . import job
+from . import metrics
+from . import blob
+from . import errors
@@ -0,0 +1,24 @@
+import os
+from flask import jsonify, send_file
+from . import api_bp
+from utils.blob_store import local_blob_store
+
+# 对象键由内容哈希决定，内容永不改变，允许客户端和 CDN 长期缓存
+BLOB_CACHE_SECONDS = 365 * 24 * 3600
+
+
+@api_bp.route('/blob/<path:key>', methods=['GET'])
+def get_blob_route(key):
+    """
+    提供本地图片存储中的文件
+
+    对象键为内容的 SHA-256，无法被猜测，因此与原先的 GitHub 链接一样无需登录即可访问，
+    可以直接用于 <img> 标签。生产环境也可以让静态服务器直接指向 BLOB_STORE_DIR。
+    """
+    path = local_blob_store.path_for(key)
+    if not path or not os.path.isfile(path):
+        return jsonify({'msg': 'Blob not found'}), 404
+
+    response = send_file(path, conditional=True, max_age=BLOB_CACHE_SECONDS)
+    response.headers['Cache-Control'] = f'public, max-age={BLOB_CACHE_SECONDS}, immutable'
+    return response
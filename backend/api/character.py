@@ -1,11 +1,16 @@
 from flask import request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from agent.llm import global_llm
+from agent.resilience import ModelUnavailableError
+from agent.rate_limit import RateLimitExceeded
 from sql import *
 from . import api_bp
 from agent.prompt import PROMPT
 from sql.character_db import Character
+from sql.ownership import resolve_owned
 from sql import db
+from utils.job_queue import dedup_id, job_handler
+from .job import submit_job_response
 
 
 # 路由函数：解析请求数据并显式传参
@@ -57,16 +62,11 @@ def get_characters_by_storyline(storyline_id):
     # 从token中获取当前登录用户ID
     current_user_id = int(get_jwt_identity())
 
-    # 1. 验证故事概要是否存在
-    storyline = Storyline.query.get(storyline_id)
-    if not storyline:
-        return jsonify({'msg': 'Storyline not found'}), 404
-
-    # 2. 验证当前用户是否为故事概要所属用户（权限控制）
-    # 通过 storyline -> opera -> user 关联链验证所有权
-    opera = Opera.query.get(storyline.opera_id)
-    if not opera or opera.user_id != current_user_id:
-        return jsonify({'msg': 'Permission denied: You do not own this storyline'}), 403
+    # 1. 验证故事概要是否存在，且当前用户为所属剧本的所有者（权限控制）
+    # 通过 storyline -> opera -> user 关联链一次联表查询验证所有权
+    owned = resolve_owned('storyline', storyline_id, current_user_id)
+    if isinstance(owned, tuple):
+        return jsonify({'msg': owned[0]}), owned[1]
 
     # 3. 查询该故事概要下的所有角色（按角色ID升序排列）
     characters = Character.query.filter_by(storyline_id=storyline_id).order_by(Character.character_id.asc()).all()
@@ -176,6 +176,23 @@ def generate_characters():
             'message': 'Missing required field: storyline_id'
         }), 400
 
+    # async=true 时提交后台任务，立即返回 job_id
+    if data.get('async'):
+        return submit_job_response(current_user_id, 'character.generate_characters', data)
+
+    result, status_code = generate_characters_job(current_user_id, data)
+    return jsonify(result), status_code
+
+
+@job_handler('character.generate_characters',
+             dedup_key=lambda data: (dedup_id(data.get('storyline_id')), bool(data.get('no_cache'))))
+def generate_characters_job(current_user_id, data):
+    """
+    根据故事概要生成角色（同步接口与后台任务共用）
+
+    返回:
+        (响应体字典, 状态码)
+    """
     storyline_id = data["storyline_id"]
 
     try:
@@ -185,84 +202,78 @@ def generate_characters():
         # 检查故事概要获取结果
         if not isinstance(storyline, Storyline):
             message, status_code = storyline
-            return jsonify({
+            return {
                 'success': False,
                 'message': message
-            }), status_code
+            }, status_code
 
         Character.delete_characters_by_storyline_core(current_user_id, storyline_id)
 
         # 构建提示词并调用LLM生成角色
         question = f"\n###LOGLINE###: {storyline.storyline_content}"
-        characters = global_llm.ask(
+        characters = global_llm.ask_items(
             question,
             global_llm.CHARACTERLIST_PROMPT,
             current_user_id,
             storyline.opera_id,
+            'character_list',
             chat_id=None,
-            save_history=True
+            save_history=True,
+            use_cache=not data.get('no_cache'),
+            task='character'
         )
-        characters = global_llm.analyze_answer(characters)
 
         # 验证LLM返回结果
         if not isinstance(characters, list) or len(characters) == 0:
-            return jsonify({
+            return {
                 'success': False,
                 'message': 'Failed to generate characters from LLM'
-            }), 500
-
-        created_characters = []
-        failed_creations = []
-
-        # 批量创建角色
-        for idx, character in enumerate(characters):
-            try:
-                character_name = character.get("name", f"Generated_Character_{idx + 1}")
-                appearance = character.get("appearance", "")
-                personality = character.get("personality", "")
-                related = character.get("related", {})
-
-                # 调用创建角色的核心函数
-                result = Character.create_character_core(
-                    user_id=current_user_id,
-                    storyline_id=storyline_id,
-                    character_name=character_name,
-                    appearance=appearance,
-                    personality=personality,
-                    related=related
-                )
-
-                if isinstance(result, Character):
-                    created_characters.append({
-                        'character_id': result.character_id,
-                        'character_name': result.character_name
-                    })
-                else:
-                    err_msg, _ = result
-                    failed_creations.append({
-                        'character_name': character_name,
-                        'error': err_msg
-                    })
-
-            except Exception as e:
-                failed_creations.append({
-                    'character_name': character.get("character_name", f"Character_{idx + 1}"),
-                    'error': str(e)
-                })
+            }, 500
+
+        # 所有权只验证一次，全部角色在一个事务中插入
+        result = Character.create_characters_bulk_core(
+            user_id=current_user_id,
+            storyline_id=storyline_id,
+            characters=[
+                {
+                    'character_name': character.get("name", f"Generated_Character_{idx + 1}"),
+                    'appearance': character.get("appearance", ""),
+                    'personality': character.get("personality", ""),
+                    'related': character.get("related", {})
+                }
+                for idx, character in enumerate(characters)
+            ],
+            commit=False
+        )
+        if isinstance(result, tuple):
+            message, status_code = result
+            return {'success': False, 'message': message}, status_code
+
+        # 提交前读取ID，避免提交后逐个对象重新加载
+        created_characters = [
+            {'character_id': character.character_id, 'character_name': character.character_name}
+            for character in result['created']
+        ]
+        failed_creations = result['failed']
+        db.session.commit()
 
         # 构建最终响应
-        return jsonify({
+        return {
             'success': len(created_characters) > 0,
             'message': f"Successfully generated {len(created_characters)} characters. {len(failed_creations)} failed.",
             'created_characters': created_characters,
             'failed_characters': failed_creations
-        }), 200 if len(created_characters) > 0 else 500
+        }, 200 if len(created_characters) > 0 else 500
 
+    except (ModelUnavailableError, RateLimitExceeded):
+        raise
     except Exception as e:
-        return jsonify({
+        # 撤销未提交的批量插入
+        db.session.rollback()
+        return {
             'success': False,
             'message': f"Error generating characters: {str(e)}"
-        }), 500
+        }, 500
 
 
 @api_bp.route('/character/delete/<int:character_id>', methods=['DELETE'])
@@ -1,13 +1,20 @@
 from flask import request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from agent.llm import global_llm
+from agent.resilience import ModelUnavailableError
+from agent.rate_limit import RateLimitExceeded
 from sql import *
-import requests
+from utils.blob_store import load_image_cached, load_images_base64
+from utils.image_response import send_image_url
+from utils.image_derivatives import thumbnail_urls
 import base64
 from . import api_bp
 from agent.prompt import PROMPT
 from sql.character_image_db import CharacterImage
+from sql.ownership import resolve_owned
 from sql import db
+from utils.job_queue import dedup_id, job_handler
+from .job import submit_job_response
 
 
 @api_bp.route('/character/generate_image', methods=['POST'])
@@ -20,6 +27,7 @@ def generate_character_image_route():
         character_id: 角色ID（必填）
         character_prompt: 角色描述提示词（可选）
         style: 图片风格（可选）
+        async: 是否以后台任务方式执行（可选，默认false；为true时返回202和job_id）
     
     返回:
         成功: 201状态码和新创建的角色图片信息
@@ -29,24 +37,37 @@ def generate_character_image_route():
     data = request.get_json() or {}
     current_user_id = int(get_jwt_identity())
     
-    # 从请求数据中提取各字段
-    character_id = data.get('character_id')
-    character_prompt = data.get('character_prompt', '')
-    style = data.get('style', '')
-    
     # 验证必填参数
-    if not character_id:
+    if not data.get('character_id'):
         return jsonify({'msg': 'Missing required field: character_id'}), 400
     
+    # async=true 时提交后台任务，立即返回 job_id
+    if data.get('async'):
+        return submit_job_response(current_user_id, 'character.generate_image', data)
+
+    result, status_code = generate_character_image_job(current_user_id, data)
+    return jsonify(result), status_code
+
+
+@job_handler('character.generate_image',
+             dedup_key=lambda data: (dedup_id(data.get('character_id')), data.get('character_prompt', ''), data.get('style', '')))
+def generate_character_image_job(current_user_id, data):
+    """
+    生成角色图片并保存记录（同步接口与后台任务共用）
+
+    返回:
+        (响应体字典, 状态码)
+    """
+    character_id = data.get('character_id')
+    character_prompt = data.get('character_prompt', '')
+    style = data.get('style', '')
+
     try:
-        # 验证角色是否存在并获取角色信息
-        character = Character.query.get(character_id)
-        if not character:
-            return jsonify({'msg': 'Character not found'}), 404
-        
-        # 验证用户权限
-        if character.user_id != current_user_id:
-            return jsonify({'msg': 'Permission denied: You do not own this character'}), 403
+        # 一次联表查询获取角色及其故事概要，并验证用户权限
+        owned = resolve_owned('character', character_id, current_user_id)
+        if isinstance(owned, tuple):
+            return {'msg': owned[0]}, owned[1]
+        character = owned.character
         
         # 构建完整的图片生成提示词
         full_prompt = character_prompt or f"A character named {character.character_name}"
@@ -57,21 +78,16 @@ def generate_character_image_route():
         if style:
             full_prompt += f", style: {style}"
         
-        # 获取故事概要信息用于传递给LLM
-        storyline = Storyline.query.get(character.storyline_id)
-        if not storyline:
-            return jsonify({'msg': 'Storyline not found'}), 404
-        
         # 调用LLM生成图片
         image_url = global_llm.create_picture(
             prompt=full_prompt,
             user_id=current_user_id,
-            opera_id=storyline.opera_id
+            opera_id=owned.opera_id
         )
         
         if not image_url:
             print('Failed to generate image')
-            return jsonify({'msg': 'Failed to generate image'}), 500
+            return {'msg': 'Failed to generate image'}, 500
         
         # 上传到代码仓库并获取可访问的 URL
         try:
@@ -81,11 +97,11 @@ def generate_character_image_route():
             )
             if not ok:
                 print('Failed to upload image to repo: ', uploaded_url_or_err)
-                return jsonify({'msg': uploaded_url_or_err}), 500
+                return {'msg': uploaded_url_or_err}, 500
             uploaded_url = uploaded_url_or_err
         except Exception as e:
             print('Failed to upload image to repo: ', e)
-            return jsonify({'msg': f'Failed to upload image to repository: {str(e)}'}), 500
+            return {'msg': f'Failed to upload image to repository: {str(e)}'}, 500
         
         # 调用核心函数创建角色图片记录（直接保存为 URL 字符串）
         result = CharacterImage.create_character_image_core(
@@ -98,7 +114,7 @@ def generate_character_image_route():
         
         if isinstance(result, CharacterImage):
             # 成功创建，返回角色图片信息
-            return jsonify({
+            return {
                 'msg': 'Character image generated successfully',
                 'character_image': {
                     'character_image_id': result.character_image_id,
@@ -108,16 +124,18 @@ def generate_character_image_route():
                     'image_url': uploaded_url,
                     'character_name': character.character_name
                 }
-            }), 201
+            }, 201
         else:
             # 创建失败，返回错误信息
             message, status_code = result
             print('create character image failed: ', message)
-            return jsonify({'msg': message}), status_code
+            return {'msg': message}, status_code
             
+    except (ModelUnavailableError, RateLimitExceeded):
+        raise
     except Exception as e:
         print('create character image failed: ', e)
-        return jsonify({'msg': f'Server error: {str(e)}'}), 500
+        return {'msg': f'Server error: {str(e)}'}, 500
 
 
 @api_bp.route('/character/get_image/<int:character_image_id>', methods=['GET'])
@@ -136,26 +154,18 @@ def get_character_image_route(character_image_id):
     current_user_id = int(get_jwt_identity())
     
     try:
-        # 查找角色图片
-        character_image = CharacterImage.query.get(character_image_id)
-        if not character_image:
-            return jsonify({'msg': 'Character image not found'}), 404
-        
-        # 验证用户权限
-        if character_image.user_id != current_user_id:
-            return jsonify({'msg': 'Permission denied: You do not own this character image'}), 403
-        
-        # 获取关联的角色信息
-        character = Character.query.get(character_image.character_id)
+        # 一次联表查询获取角色图片及其关联的角色，并验证用户权限
+        owned = resolve_owned('character_image', character_image_id, current_user_id)
+        if isinstance(owned, tuple):
+            return jsonify({'msg': owned[0]}), owned[1]
+        character_image, character = owned.character_image, owned.character
         
         # 角色图片字段为 URL：下载并转为 base64
         image_base64 = None
         if character_image.character_image:
             image_url = str(character_image.character_image).strip()
             try:
-                resp = requests.get(image_url, timeout=30)
-                resp.raise_for_status()
-                image_base64 = base64.b64encode(resp.content).decode('utf-8')
+                image_base64 = base64.b64encode(load_image_cached(image_url)).decode('utf-8')
             except Exception as e:
                 return jsonify({'msg': f'Failed to download image from url: {str(e)}'}), 500
         
@@ -176,6 +186,39 @@ def get_character_image_route(character_image_id):
         return jsonify({'msg': f'Server error: {str(e)}'}), 500
 
 
+@api_bp.route('/character/image_file/<int:character_image_id>', methods=['GET'])
+@jwt_required()
+def get_character_image_file_route(character_image_id):
+    """
+    以二进制流获取角色图片（支持 ETag / If-None-Match 和 Range 请求）
+    
+    参数:
+        character_image_id: 角色图片ID（路径参数）
+        size: 查询参数（可选），需要的图片尺寸（最长边像素），有合适的缩略图尺寸时返回缩略图
+    
+    返回:
+        成功: 200 / 206 状态码和图片内容，图片未变化时返回 304
+        失败: 相应的错误状态码和错误消息
+    """
+    current_user_id = int(get_jwt_identity())
+    
+    try:
+        owned = resolve_owned('character_image', character_image_id, current_user_id)
+        if isinstance(owned, tuple):
+            return jsonify({'msg': owned[0]}), owned[1]
+        character_image = owned.character_image
+        
+        if not character_image.character_image:
+            return jsonify({'msg': 'Character image has no image data'}), 404
+        try:
+            return send_image_url(str(character_image.character_image).strip(), request.args.get('size', type=int))
+        except Exception as e:
+            return jsonify({'msg': f'Failed to download image from url: {str(e)}'}), 500
+        
+    except Exception as e:
+        return jsonify({'msg': f'Server error: {str(e)}'}), 500
+
+
 @api_bp.route('/character/get_images/<int:character_id>', methods=['GET'])
 @jwt_required()
 def get_character_images_by_character_route(character_id):
@@ -184,22 +227,25 @@ def get_character_images_by_character_route(character_id):
     
     参数:
         character_id: 角色ID（路径参数）
+        inline: 查询参数，为 1 时在每项中附带图片的 base64 数据（image_data，并发读取并缓存）；
+                默认只返回图片元数据和 image_url，由前端直接按 URL 加载图片
+        size: 查询参数（可选），需要的缩略图尺寸（最长边像素）；传入时每项附带 thumbnail_url，
+              inline 模式下 image_data 也改为缩略图数据
     
     返回:
         成功: 200状态码和角色图片列表
         失败: 相应的错误状态码和错误消息
     """
     current_user_id = int(get_jwt_identity())
+    inline = request.args.get('inline', '').lower() in ('1', 'true')
+    size = request.args.get('size', type=int)
     
     try:
-        # 验证角色是否存在
-        character = Character.query.get(character_id)
-        if not character:
-            return jsonify({'msg': 'Character not found'}), 404
-        
-        # 验证用户权限
-        if character.user_id != current_user_id:
-            return jsonify({'msg': 'Permission denied: You do not own this character'}), 403
+        # 一次联表查询验证角色及用户权限
+        owned = resolve_owned('character', character_id, current_user_id)
+        if isinstance(owned, tuple):
+            return jsonify({'msg': owned[0]}), owned[1]
+        character = owned.character
         
         # 查询该角色的所有图片
         character_images = CharacterImage.query.filter_by(character_id=character_id).order_by(CharacterImage.character_image_id.desc()).all()
@@ -212,8 +258,20 @@ def get_character_images_by_character_route(character_id):
                 'character_id': img.character_id,
                 'character_prompt': img.character_prompt,
                 'style': img.style,
-                'image_url': str(img.character_image) if img.character_image else None
+                'image_url': str(img.character_image).strip() if img.character_image else None
             })
+
+        image_urls = [item['image_url'] for item in image_list]
+        if size:
+            image_urls = thumbnail_urls(image_urls, size)
+            for item, thumbnail_url in zip(image_list, image_urls):
+                item['thumbnail_url'] = thumbnail_url
+
+        # inline 模式：并发读取所有图片，耗时与图片数量无关
+        if inline:
+            images_base64 = load_images_base64(image_urls)
+            for item, image_base64 in zip(image_list, images_base64):
+                item['image_data'] = image_base64
         
         return jsonify({
             'msg': 'Character images retrieved successfully',
@@ -255,19 +313,11 @@ def update_character_image_route(character_image_id):
     regenerate_image = data.get('regenerate_image', True)  # 默认重新生成图片
     
     try:
-        # 首先获取现有的角色图片记录
-        character_image = CharacterImage.query.get(character_image_id)
-        if not character_image:
-            return jsonify({'msg': 'Character image not found'}), 404
-        
-        # 验证用户权限
-        if character_image.user_id != current_user_id:
-            return jsonify({'msg': 'Permission denied: You do not own this character image'}), 403
-        
-        # 获取关联的角色信息
-        character = Character.query.get(character_image.character_id)
-        if not character:
-            return jsonify({'msg': 'Associated character not found'}), 404
+        # 一次联表查询获取角色图片及其关联的角色，并验证用户权限
+        owned = resolve_owned('character_image', character_image_id, current_user_id)
+        if isinstance(owned, tuple):
+            return jsonify({'msg': owned[0]}), owned[1]
+        character_image, character = owned.character_image, owned.character
         
         # 准备更新的数据（URL 方式）
         new_image_url = None
@@ -291,16 +341,11 @@ def update_character_image_route(character_image_id):
             if current_style:
                 full_prompt += f", style: {current_style}"
             
-            # 获取故事概要信息用于传递给LLM
-            storyline = Storyline.query.get(character.storyline_id)
-            if not storyline:
-                return jsonify({'msg': 'Storyline not found'}), 404
-            
             # 调用LLM生成新图片 URL
             image_url = global_llm.create_picture(
                 prompt=full_prompt,
                 user_id=current_user_id,
-                opera_id=storyline.opera_id
+                opera_id=owned.opera_id
             )
             
             if not image_url:
@@ -351,6 +396,8 @@ def update_character_image_route(character_image_id):
             message, status_code = result
             return jsonify({'msg': message}), status_code
             
+    except (ModelUnavailableError, RateLimitExceeded):
+        raise
     except Exception as e:
         return jsonify({'msg': f'Server error: {str(e)}'}), 500
 
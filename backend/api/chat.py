@@ -1,10 +1,48 @@
 from flask import request, jsonify
 from . import api_bp
 from agent.llm import global_llm
+from agent.resilience import ModelUnavailableError
+from agent.rate_limit import RateLimitExceeded
 from agent.prompt import PROMPT
 from sql import db
 from sql.chat_db import Chat
+from sql.chat_message_db import ChatMessage
+from sql.request_cache import get_cached
 from flask_jwt_extended import jwt_required, get_jwt_identity
+from .sse import sse_event, sse_response
+
+
+def stream_answer_response(question, prompt, user_id, opera_id, chat_id, extra=None, task='chat'):
+    """
+    以 SSE 形式返回模型回答
+
+    事件依次为:
+        start: 包含 chat_id 及 extra 中的附加字段
+        delta: 每个增量文本片段 {"delta": "..."}
+        done: 生成结束（此时历史记录已保存）
+        error: 生成过程中出错 {"error": "..."}
+    """
+    def generate():
+        start_payload = {'chat_id': chat_id}
+        start_payload.update(extra or {})
+        yield sse_event(start_payload, event='start')
+        try:
+            for delta in global_llm.ask_stream(
+                question=question,
+                prompt=prompt,
+                user_id=user_id,
+                opera_id=opera_id,
+                chat_id=chat_id,
+                save_history=True,
+                task=task
+            ):
+                yield sse_event({'delta': delta}, event='delta')
+        except Exception as e:
+            yield sse_event({'error': f"Server error: {str(e)}"}, event='error')
+            return
+        yield sse_event({'chat_id': chat_id}, event='done')
+
+    return sse_response(generate())
 
 
 @api_bp.route('/chat/create', methods=['POST'])
@@ -49,7 +87,7 @@ def get_chat(chat_id):  # 重命名路由函数避免冲突
             'data': {
                 'chat_id': result.chat_id,
                 'opera_id': result.opera_id,
-                'chat_AI': result.chat_AI,
+                'chat_AI': ChatMessage.get_messages(result),
                 'chat_time': result.chat_time.isoformat()
             }
         }), 200
@@ -86,7 +124,7 @@ def update_chat_route(chat_id):
             'data': {
                 'chat_id': result.chat_id,
                 'opera_id': result.opera_id,
-                'chat_AI': result.chat_AI,
+                'chat_AI': ChatMessage.get_messages(result),
                 'chat_time': result.chat_time.isoformat()
             }
         }), 200
@@ -106,9 +144,8 @@ def get_response():
     # 获取当前用户ID
     current_user_id = int(get_jwt_identity())
 
-    # 获取用户输入和历史记录
+    # 获取用户输入
     user_input = data.get('user_input')
-    history = data.get('history', [])
     opera_id = data.get('opera_id')
 
     if not user_input:
@@ -148,13 +185,19 @@ def get_response():
             }), status_code
 
     prompt = PROMPT['chat'] # Assuming 'chat' is a key in PROMPT dict
+
+    # stream=true 时以 SSE 形式逐块返回回答
+    if data.get('stream'):
+        return stream_answer_response(user_input, prompt, current_user_id, chat_record.opera_id, chat_id)
+
     response = global_llm.ask(
         question=user_input,
         prompt=prompt,
         user_id=current_user_id,
         opera_id=chat_record.opera_id,
         chat_id=chat_id,
-        save_history=True
+        save_history=True,
+        task='chat'
     )
 
     return jsonify({
@@ -174,9 +217,10 @@ def get_storyline_help():
         storyline: 故事概要内容（可选）
         user_input: 用户问题（必填）
         chat_id: 聊天记录ID（可选，用于继续对话）
+        stream: 是否以 SSE 流式返回（可选，默认false）
     
     返回:
-        成功: 200状态码和AI回答
+        成功: 200状态码和AI回答（stream=true 时为 text/event-stream）
         失败: 相应的错误状态码和错误消息
     """
     # 获取请求数据和当前用户ID
@@ -202,7 +246,7 @@ def get_storyline_help():
     try:
         # 验证剧本是否存在并检查权限
         from sql import Opera
-        opera = Opera.query.get(opera_id)
+        opera = get_cached(Opera, opera_id)
         if not opera:
             return jsonify({"error": "Opera not found"}), 404
         
@@ -236,6 +280,13 @@ def get_storyline_help():
                 }), status_code
             chat_id = chat_result.chat_id
         
+        # stream=true 时以 SSE 形式逐块返回回答
+        if data.get("stream"):
+            return stream_answer_response(
+                question, storyline_help_prompt, current_user_id, opera_id, chat_id,
+                extra={'storyline': storyline, 'user_input': user_input}, task='help'
+            )
+
         # 调用LLM获取回答
         answer = global_llm.ask(
             question=question,
@@ -243,7 +294,8 @@ def get_storyline_help():
             user_id=current_user_id,
             opera_id=opera_id,
             chat_id=chat_id,
-            save_history=True
+            save_history=True,
+            task='help'
         )
         
         return jsonify({
@@ -254,6 +306,8 @@ def get_storyline_help():
             "chat_id": chat_id
         }), 200
         
+    except (ModelUnavailableError, RateLimitExceeded):
+        raise
     except Exception as e:
         return jsonify({"error": f"Server error: {str(e)}"}), 500
 
@@ -270,9 +324,10 @@ def get_role_help():
         character_list: 角色列表（可选）
         user_input: 用户问题（必填）
         chat_id: 聊天记录ID（可选）
+        stream: 是否以 SSE 流式返回（可选，默认false）
     
     返回:
-        成功: 200状态码和AI回答
+        成功: 200状态码和AI回答（stream=true 时为 text/event-stream）
         失败: 相应的错误状态码和错误消息
     """
     # 获取请求数据和当前用户ID
@@ -299,7 +354,7 @@ def get_role_help():
     try:
         # 验证剧本是否存在并检查权限
         from sql import Opera
-        opera = Opera.query.get(opera_id)
+        opera = get_cached(Opera, opera_id)
         if not opera:
             return jsonify({"error": "Opera not found"}), 404
         
@@ -350,6 +405,14 @@ def get_role_help():
                 }), status_code
             chat_id = chat_result.chat_id
         
+        # stream=true 时以 SSE 形式逐块返回回答
+        if data.get("stream"):
+            return stream_answer_response(
+                question, role_help_prompt, current_user_id, opera_id, chat_id,
+                extra={'storyline': storyline, 'character_list': character_list, 'user_input': user_input},
+                task='help'
+            )
+
         # 调用LLM获取回答
         answer = global_llm.ask(
             question=question,
@@ -357,7 +420,8 @@ def get_role_help():
             user_id=current_user_id,
             opera_id=opera_id,
             chat_id=chat_id,
-            save_history=True
+            save_history=True,
+            task='help'
         )
         
         return jsonify({
@@ -369,6 +433,8 @@ def get_role_help():
             "chat_id": chat_id
         }), 200
         
+    except (ModelUnavailableError, RateLimitExceeded):
+        raise
     except Exception as e:
         return jsonify({"error": f"Server error: {str(e)}"}), 500
 
@@ -385,9 +451,10 @@ def get_plot_help():
         character_list: 角色列表（可选）
         user_input: 用户问题（必填）
         chat_id: 聊天记录ID（可选）
+        stream: 是否以 SSE 流式返回（可选，默认false）
     
     返回:
-        成功: 200状态码和AI回答
+        成功: 200状态码和AI回答（stream=true 时为 text/event-stream）
         失败: 相应的错误状态码和错误消息
     """
     # 获取请求数据和当前用户ID
@@ -414,7 +481,7 @@ def get_plot_help():
     try:
         # 验证剧本是否存在并检查权限
         from sql import Opera
-        opera = Opera.query.get(opera_id)
+        opera = get_cached(Opera, opera_id)
         if not opera:
             return jsonify({"error": "Opera not found"}), 404
         
@@ -465,6 +532,14 @@ def get_plot_help():
                 }), status_code
             chat_id = chat_result.chat_id
         
+        # stream=true 时以 SSE 形式逐块返回回答
+        if data.get("stream"):
+            return stream_answer_response(
+                question, plot_help_prompt, current_user_id, opera_id, chat_id,
+                extra={'storyline': storyline, 'character_list': character_list, 'user_input': user_input},
+                task='help'
+            )
+
         # 调用LLM获取回答
         answer = global_llm.ask(
             question=question,
@@ -472,7 +547,8 @@ def get_plot_help():
             user_id=current_user_id,
             opera_id=opera_id,
             chat_id=chat_id,
-            save_history=True
+            save_history=True,
+            task='help'
         )
         
         return jsonify({
@@ -484,5 +560,7 @@ def get_plot_help():
             "chat_id": chat_id
         }), 200
         
+    except (ModelUnavailableError, RateLimitExceeded):
+        raise
     except Exception as e:
         return jsonify({"error": f"Server error: {str(e)}"}), 500
\ No newline at end of file
@@ -1,13 +1,16 @@
-from datetime import date  # 用于处理日期
 from flask import request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from sql.opera_db import Opera
 from sql.dialogue_db import Dialogue
+from agent.resilience import ModelUnavailableError
+from agent.rate_limit import RateLimitExceeded
 from sql.storyline_db import Storyline
 from sql.plot_db import Plot
 from sql import db
+from utils.job_queue import dedup_id, job_handler
+from utils.singleflight import single_flight
+from .job import submit_job_response
+from .sse import sse_event, sse_response
 from . import api_bp
-import base64
 
 
 @api_bp.route('/dialogue/generate_from_plot', methods=['POST'])
@@ -18,6 +21,7 @@ def generate_dialogue_from_plot_route():
     
     请求参数:
         plot_id: 情节ID（必填）
+        no_cache: 是否跳过模型回答缓存、强制重新生成（可选，默认false）
     
     返回:
         成功: 201状态码和新创建的对话信息
@@ -34,16 +38,17 @@ def generate_dialogue_from_plot_route():
     if not plot_id:
         return jsonify({'msg': 'Missing required field: plot_id'}), 400
     
-    try:
+    def generate():
         # 调用核心函数生成对话
         result = Dialogue.generate_dialogue_from_plot_core(
             user_id=current_user_id,
-            plot_id=plot_id
+            plot_id=plot_id,
+            use_cache=not data.get('no_cache')
         )
-        
+
         if isinstance(result, Dialogue):
             # 成功创建，返回对话信息
-            return jsonify({
+            return {
                 'msg': 'Dialogue generated successfully',
                 'dialogue': {
                     'dialogue_id': result.dialogue_id,
@@ -52,16 +57,74 @@ def generate_dialogue_from_plot_route():
                     'dialogue_count': len(result.dialogue_content) if result.dialogue_content else 0,
                     'dialogue_content': result.dialogue_content
                 }
-            }), 201
-        else:
-            # 生成失败，返回错误信息
-            message, status_code = result
-            return jsonify({'msg': message}), status_code
+            }, 201
+        # 生成失败，返回错误信息
+        message, status_code = result
+        return {'msg': message}, status_code
+
+    try:
+        # 同一用户对同一情节的重复请求（如重复点击）合并为一次生成，共享同一个结果
+        key = ('dialogue.generate_from_plot', current_user_id, dedup_id(plot_id), bool(data.get('no_cache')))
+        body, status_code = single_flight.do(key, generate)
+        return jsonify(body), status_code
             
+    except (ModelUnavailableError, RateLimitExceeded):
+        raise
     except Exception as e:
         return jsonify({'msg': f'Server error: {str(e)}'}), 500
 
 
+@api_bp.route('/dialogue/generate_from_plot_stream', methods=['POST'])
+@jwt_required()
+def generate_dialogue_from_plot_stream_route():
+    """
+    根据情节ID流式生成对话的接口（SSE），每条对话生成后立即保存并推送
+    
+    请求参数:
+        plot_id: 情节ID（必填）
+        no_cache: 是否跳过模型回答缓存、强制重新生成（可选，默认false）
+    
+    返回:
+        成功: text/event-stream，事件依次为:
+            start: {"plot_id"}
+            dialogue: 每条对话 {"dialogue_id", "index", "item"}（第一条到达时已创建对话记录）
+            done: {"dialogue_id", "dialogue_count"}
+            error: 生成过程中出错 {"error", "dialogue_id"}（已推送的对话已保存）
+        失败: 相应的错误状态码和错误消息
+    """
+    data = request.get_json() or {}
+    current_user_id = int(get_jwt_identity())
+    plot_id = data.get('plot_id')
+    
+    # 参数和权限在开始推送前校验，失败时返回普通的 JSON 错误
+    result = Dialogue.stream_dialogue_from_plot_core(
+        user_id=current_user_id,
+        plot_id=plot_id,
+        use_cache=not data.get('no_cache')
+    )
+    if isinstance(result, tuple):
+        message, status_code = result
+        return jsonify({'msg': message}), status_code
+    
+    def generate():
+        yield sse_event({'plot_id': plot_id}, event='start')
+        dialogue_id = None
+        count = 0
+        try:
+            for dialogue_id, item in result:
+                yield sse_event({'dialogue_id': dialogue_id, 'index': count, 'item': item}, event='dialogue')
+                count += 1
+        except Exception as e:
+            yield sse_event({'error': f'Server error: {str(e)}', 'dialogue_id': dialogue_id}, event='error')
+            return
+        if count == 0:
+            yield sse_event({'error': 'Failed to generate dialogue', 'dialogue_id': None}, event='error')
+            return
+        yield sse_event({'dialogue_id': dialogue_id, 'dialogue_count': count}, event='done')
+    
+    return sse_response(generate())
+
+
 @api_bp.route('/dialogue/get/<int:dialogue_id>', methods=['GET'])
 @jwt_required()
 def get_dialogue_route(dialogue_id):
@@ -257,6 +320,8 @@ def generate_dialogues_from_storyline_route():
 
     请求参数:
         storyline_id: 故事概要ID（必填）
+        async: 是否以后台任务方式执行（可选，默认false；为true时返回202和job_id）
+        no_cache: 是否跳过模型回答缓存、强制重新生成（可选，默认false）
 
     返回:
         成功: 200状态码，包含生成结果的摘要信息
@@ -272,51 +337,66 @@ def generate_dialogues_from_storyline_route():
     if not storyline_id:
         return jsonify({'msg': 'Missing required field: storyline_id'}), 400
 
+    # async=true 时提交后台任务，立即返回 job_id
+    if data.get('async'):
+        return submit_job_response(current_user_id, 'dialogue.generate_from_storyline', data)
+
+    result, status_code = generate_dialogues_from_storyline_job(current_user_id, data)
+    return jsonify(result), status_code
+
+
+@job_handler('dialogue.generate_from_storyline',
+             dedup_key=lambda data: (dedup_id(data.get('storyline_id')), bool(data.get('no_cache'))))
+def generate_dialogues_from_storyline_job(current_user_id, data):
+    """
+    为故事概要下的所有剧情并发生成对话（同步接口与后台任务共用）
+
+    返回:
+        (响应体字典, 状态码)
+    """
+    storyline_id = data.get('storyline_id')
+
     try:
-        # 验证故事概要是否存在及权限
-        storyline = Storyline.query.get(storyline_id)
-        if not storyline:
-            return jsonify({'msg': 'Storyline not found'}), 404
-
-        opera = Opera.query.get(storyline.opera_id)
-        if opera.user_id != current_user_id:
-            return jsonify({'msg': 'Permission denied: You do not own this storyline'}), 403
-
-        # 获取该故事概要下的所有剧情
-        plots = Plot.query.filter_by(storyline_id=storyline_id).order_by(Plot.plot_id.asc()).all()
-        if not plots:
-            return jsonify({
+        # 并发生成所有剧情的对话（结果顺序与剧情顺序一致，并在一个事务中保存）
+        result = Dialogue.generate_dialogues_for_storyline_core(
+            user_id=current_user_id,
+            storyline_id=storyline_id,
+            use_cache=not data.get('no_cache')
+        )
+        if isinstance(result, tuple):
+            message, status_code = result
+            return {'msg': message}, status_code
+
+        storyline = result['storyline']
+        if not result['plots']:
+            return {
                 'msg': 'No plots found for this storyline',
                 'storyline_id': storyline_id,
                 'storyline_theme': storyline.theme,
                 'storyline_name': storyline.storyline_name
-            }), 404
+            }, 404
 
-        # 为每个剧情生成对话
         generated_dialogues = []
-        for plot in plots:
-            # 调用核心函数生成对话
-            result = Dialogue.generate_dialogue_from_plot_core(
-                user_id=current_user_id,
-                plot_id=plot.plot_id,
-            )
-            if not isinstance(result, tuple):
-                generated_dialogues.append({
-                    'plot_id': plot.plot_id,
-                    'dialogue_id': result.dialogue_id,
-                    'dialogue_content': result.dialogue_content
-                })
+        for plot, dialogue in result['generated']:
+            generated_dialogues.append({
+                'plot_id': plot.plot_id,
+                'dialogue_id': dialogue.dialogue_id,
+                'dialogue_content': dialogue.dialogue_content
+            })
 
         # 返回生成结果
-        return jsonify({
+        return {
             'msg': 'Dialogues generated successfully from storyline',
             'storyline_id': storyline_id,
             'storyline_theme': storyline.theme,
             'storyline_name': storyline.storyline_name,
             'generated_dialogues_count': len(generated_dialogues),
-            'generated_dialogues': generated_dialogues
-        }), 200
+            'generated_dialogues': generated_dialogues,
+            'failed_dialogues': result['failed']
+        }, 200
 
+    except (ModelUnavailableError, RateLimitExceeded):
+        raise
     except Exception as e:
         db.session.rollback()
-        return jsonify({'msg': f'Failed to generate dialogues: {str(e)}'}), 500
\ No newline at end of file
+        return {'msg': f'Failed to generate dialogues: {str(e)}'}, 500
\ No newline at end of file
@@ -0,0 +1,29 @@
+import math
+from flask import jsonify
+from . import api_bp
+from agent.resilience import ModelUnavailableError
+from agent.rate_limit import RateLimitExceeded
+
+
+def _retry_later_response(error, status_code):
+    response = jsonify({'success': False, 'msg': str(error), 'retry_after': error.retry_after})
+    response.status_code = status_code
+    if error.retry_after:
+        response.headers['Retry-After'] = str(math.ceil(error.retry_after))
+    return response
+
+
+@api_bp.errorhandler(ModelUnavailableError)
+def handle_model_unavailable(error):
+    """
+    模型服务熔断或重试后仍失败时返回 503，并通过 Retry-After 提示客户端稍后重试
+    """
+    return _retry_later_response(error, 503)
+
+
+@api_bp.errorhandler(RateLimitExceeded)
+def handle_rate_limit_exceeded(error):
+    """
+    模型调用排队超时或排队请求过多时返回 429
+    """
+    return _retry_later_response(error, 429)
@@ -0,0 +1,46 @@
+from flask import jsonify
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from . import api_bp
+from sql.job_db import Job
+from utils.job_queue import job_queue
+
+
+def submit_job_response(user_id, job_type, params):
+    """
+    提交后台任务并立即返回 202 和 job_id，供生成类接口在 async=true 时使用
+    """
+    job = job_queue.submit(user_id, job_type, params)
+    if isinstance(job, tuple):
+        message, status_code = job
+        return jsonify({'success': False, 'msg': message}), status_code
+
+    return jsonify({
+        'success': True,
+        'msg': 'Job submitted',
+        'job_id': job.job_id,
+        'status': job.status,
+        'status_url': f'/api/job/{job.job_id}'
+    }), 202
+
+
+@api_bp.route('/job/<string:job_id>', methods=['GET'])
+@jwt_required()
+def get_job_route(job_id):
+    """
+    查询后台任务的状态和结果
+
+    返回:
+        成功: 200状态码和任务信息；status 为 succeeded/failed 时 result 为原同步接口的响应体
+        失败: 相应的错误状态码和错误消息
+    """
+    current_user_id = int(get_jwt_identity())
+
+    result = Job.get_job_core(current_user_id, job_id)
+    if isinstance(result, tuple):
+        message, status_code = result
+        return jsonify({'msg': message}), status_code
+
+    return jsonify({
+        'msg': 'Job retrieved successfully',
+        'job': result.to_dict()
+    }), 200
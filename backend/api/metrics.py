@@ -0,0 +1,22 @@
+from flask import jsonify
+from flask_jwt_extended import jwt_required
+from . import api_bp
+from utils.metrics import metrics
+from utils.http_client import pool_stats
+from agent.resilience import resilience
+from agent.llm import global_llm
+
+
+@api_bp.route('/metrics', methods=['GET'])
+@jwt_required()
+def get_metrics_route():
+    """
+    查看进程内的运行指标（如每个请求的 SQL 查询次数）
+
+    返回:
+        200状态码和当前进程的计数器与观测值，出站 HTTP 连接池的复用情况（http_pools）
+        、各模型熔断器的状态（circuit_breakers）和各模型端点的近期延迟（model_routes）
+    """
+    return jsonify(dict(metrics.snapshot(), http_pools=pool_stats(),
+                        circuit_breakers=resilience.breaker_states(),
+                        model_routes=global_llm.router.stats())), 200
@@ -3,8 +3,9 @@ from flask import request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from sql.opera_db import Opera
 from sql import db
+from sql.image_blob import store_image, image_url_for
+from utils.image_response import send_image_url
 from . import api_bp
-import base64
 
 @api_bp.route('/opera/create', methods=['POST'])
 @jwt_required()  # 要求登录状态，确保只有已注册用户能创建剧本
@@ -29,24 +30,19 @@ def create_opera():
     if len(opera_name) > 50:
         return jsonify({'msg': 'Opera name must be less than 50 characters'}), 400
 
-    # 可选：解析 base64 图片
-    opera_image_bytes = None
+    # 可选：解析 base64 图片（兼容 dataURL 前缀）并保存到图片存储，行内只保存 URL
+    opera_image_url = None
     if isinstance(opera_image_b64, str) and opera_image_b64:
-        try:
-            # 兼容 dataURL 前缀
-            if ',' in opera_image_b64 and opera_image_b64.strip().startswith('data:'):
-                opera_image_b64 = opera_image_b64.split(',', 1)[1]
-            opera_image_bytes = base64.b64decode(opera_image_b64)
-        except Exception:
-            # 如果解析失败，置空，不因图片问题阻塞创建
-            opera_image_bytes = None
+        ok, url_or_err = store_image(opera_image_b64)
+        # 如果解析或保存失败，置空，不因图片问题阻塞创建
+        opera_image_url = url_or_err if ok else None
 
     # 构建新剧本对象
     new_opera = Opera(
         user_id=current_user_id,  # 关联当前登录用户
         opera_name=opera_name,
         create_time=date.today(),  # 默认为当前日期
-        opera_image=opera_image_bytes
+        opera_image_url=opera_image_url
     )
 
     # 保存到数据库
@@ -61,6 +57,7 @@ def create_opera():
                 'opera_id': new_opera.opera_id,
                 'opera_name': new_opera.opera_name,
                 'create_time': new_opera.create_time.isoformat(),  # 转为ISO格式日期字符串
+                'opera_image_url': new_opera.opera_image_url,
             }
         }), 201  # 201表示资源创建成功
     except Exception as e:
@@ -91,6 +88,7 @@ def get_operas():
             'opera_id': opera.opera_id,
             'opera_name': opera.opera_name,
             'create_time': opera.create_time.isoformat(),  # 日期转为字符串便于JSON传输
+            'opera_image_url': opera.opera_image_url,
         })
 
     return jsonify({
@@ -144,3 +142,28 @@ def update_opera_name(opera_id):
         db.session.rollback()
         return jsonify({'msg': 'Failed to update opera name', 'error': str(e)}), 500
 
+
+@api_bp.route('/opera/image_file/<int:opera_id>', methods=['GET'])
+@jwt_required()  # 验证登录状态
+def get_opera_image_file(opera_id):
+    """
+    以二进制流获取剧本封面图片（支持 ETag / If-None-Match 和 Range 请求，可通过 size 参数获取缩略图）
+    """
+    current_user_id = int(get_jwt_identity())
+
+    opera = Opera.query.get(opera_id)
+    if not opera:
+        return jsonify({'msg': 'Opera not found'}), 404
+
+    # 验证当前用户是否为剧本的所有者
+    if opera.user_id != current_user_id:
+        return jsonify({'msg': 'Permission denied: You are not the owner of this opera'}), 403
+
+    try:
+        image_url = image_url_for(opera, 'opera_image_url', 'opera_image')
+        if not image_url:
+            return jsonify({'msg': 'Opera has no image'}), 404
+        return send_image_url(image_url, request.args.get('size', type=int))
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'msg': 'Failed to load opera image', 'error': str(e)}), 500
@@ -1,11 +1,16 @@
 from flask import request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from agent.llm import global_llm
+from agent.resilience import ModelUnavailableError
+from agent.rate_limit import RateLimitExceeded
 from sql import *
 from . import api_bp
 from agent.prompt import PROMPT
 from sql.plot_db import Plot
+from sql.ownership import resolve_owned
 from sql import db
+from utils.job_queue import dedup_id, job_handler
+from .job import submit_job_response
 import json
 from datetime import datetime
 
@@ -195,6 +200,8 @@ def generate_plot_route():
     请求参数:
         opera_id: 剧本ID（必填）
         storyline_id: 故事概要ID（必填）
+        async: 是否以后台任务方式执行（可选，默认false；为true时返回202和job_id）
+        no_cache: 是否跳过模型回答缓存、强制重新生成（可选，默认false）
     
     返回:
         成功: 201状态码和生成的剧情大纲信息
@@ -204,36 +211,47 @@ def generate_plot_route():
     data = request.get_json() or {}
     current_user_id = int(get_jwt_identity())
     
-    # 从请求数据中提取各字段
-    opera_id = data.get('opera_id')
-    storyline_id = data.get('storyline_id')
-    
     # 验证必填参数
-    if not opera_id:
+    if not data.get('opera_id'):
         return jsonify({'msg': 'Missing required field: opera_id'}), 400
-    if not storyline_id:
+    if not data.get('storyline_id'):
         return jsonify({'msg': 'Missing required field: storyline_id'}), 400
-    
+
+    # async=true 时提交后台任务，立即返回 job_id
+    if data.get('async'):
+        return submit_job_response(current_user_id, 'plot.generate', data)
+
+    result, status_code = generate_plot_job(current_user_id, data)
+    return jsonify(result), status_code
+
+
+@job_handler('plot.generate',
+             dedup_key=lambda data: (dedup_id(data.get('storyline_id')), bool(data.get('no_cache'))))
+def generate_plot_job(current_user_id, data):
+    """
+    根据故事概要和角色生成剧情大纲及场景（同步接口与后台任务共用）
+
+    返回:
+        (响应体字典, 状态码)
+    """
+    # 从请求数据中提取各字段
+    opera_id = data.get('opera_id')
+    storyline_id = data.get('storyline_id')
+
     try:
-        # 验证剧本是否存在并属于当前用户
-        opera = Opera.query.get(opera_id)
-        if not opera:
-            return jsonify({'msg': 'Opera not found'}), 404
-        if opera.user_id != current_user_id:
-            return jsonify({'msg': 'Permission denied: You do not own this opera'}), 403
-        
-        # 验证故事概要是否存在并属于指定剧本
-        storyline = Storyline.query.get(storyline_id)
-        if not storyline:
-            return jsonify({'msg': 'Storyline not found'}), 404
+        # 一次联表查询验证故事概要存在、属于当前用户，且属于指定剧本
+        owned = resolve_owned('storyline', storyline_id, current_user_id)
+        if isinstance(owned, tuple):
+            return {'msg': owned[0]}, owned[1]
+        storyline = owned.storyline
         if storyline.opera_id != opera_id:
-            return jsonify({'msg': 'Storyline does not belong to the specified opera'}), 400
+            return {'msg': 'Storyline does not belong to the specified opera'}, 400
         
         # 查找该故事概要下的所有角色
         characters = Character.query.filter_by(storyline_id=storyline_id).order_by(Character.character_id.asc()).all()
         
         if not characters:
-            return jsonify({'msg': 'No characters found for this storyline. Please create characters first.'}), 400
+            return {'msg': 'No characters found for this storyline. Please create characters first.'}, 400
         
         # 创建角色名称到ID的映射
         character_name_to_id = {char.character_name: char.character_id for char in characters}
@@ -256,128 +274,100 @@ def generate_plot_route():
 
 ###CHARACTERLIST###: {character_list}"""
         
-        # 调用LLM生成剧情大纲
-        plot_outline = global_llm.ask(
+        # 调用LLM生成剧情大纲，并按情节结构解析、校验返回结果
+        plots = global_llm.ask_items(
             question,
             global_llm.OUTLINE_PROMPT,
             current_user_id,
             opera_id,
+            'outline',
             chat_id=None,
-            save_history=True
+            save_history=True,
+            use_cache=not data.get('no_cache'),
+            task='outline'
         )
         
-        # 解析LLM返回结果
-        plots = global_llm.analyze_answer(plot_outline)
-        
         # 验证LLM返回结果
         if not isinstance(plots, list) or len(plots) == 0:
-            return jsonify({
+            return {
                 'success': False,
                 'message': 'Failed to generate plot outline from LLM'
-            }), 500
+            }, 500
         
         # 删除旧的plots
         success, message = Plot.delete_plots_by_storyline(current_user_id, storyline_id)
         if not success:
-            return jsonify({'success': False, 'message': message}), 500
+            return {'success': False, 'message': message}, 500
 
-        created_plots = []
-        failed_creations = []
-        # 记录索引与成功创建的 plot_id 的映射，便于后续创建场景
-        idx_to_plot_id = {}
-        
-        # 批量创建剧情大纲
-        for idx, plot in enumerate(plots):
-            try:
-                plot_name = plot.get("plotName", f"Plot_{idx + 1}")
-                abstract = plot.get("beat", "")
-                character_data = plot.get("characters", [])
-                
-                # 将角色名称列表转换为角色ID列表
-                character_ids = [character_name_to_id[name] for name in character_data if name in character_name_to_id]
-                
-                # 调用创建剧情的核心函数（会自动查询角色）
-                result = Plot.create_plot_core(
-                    user_id=current_user_id,
-                    storyline_id=storyline_id,
-                    plot_name=plot_name,
-                    characters=character_ids,
-                    abstract=abstract
-                )
-                
-                if isinstance(result, Plot):
-                    created_plots.append({
-                        'plot_id': result.plot_id,
-                        'plot_name': result.plot_name,
-                        'abstract': result.abstract
-                    })
-                    idx_to_plot_id[idx] = result.plot_id
-                else:
-                    err_msg, _ = result
-                    failed_creations.append({
-                        'plot_name': plot_name,
-                        'error': err_msg
-                    })
-                    
-            except Exception as e:
-                failed_creations.append({
+        # 所有剧情和场景在一个事务中插入，所有权各只验证一次
+        plot_result = Plot.create_plots_bulk_core(
+            user_id=current_user_id,
+            storyline_id=storyline_id,
+            plots=[
+                {
                     'plot_name': plot.get("plotName", f"Plot_{idx + 1}"),
-                    'error': str(e)
-                })
-        
-        # 基于 LLM 输出读取所有场景，去重后逐一新建
-        created_scenes = []
-        failed_scenes = []
+                    'abstract': plot.get("beat", ""),
+                    # 将角色名称列表转换为角色ID列表
+                    'characters': [character_name_to_id[name] for name in plot.get("characters", []) if name in character_name_to_id]
+                }
+                for idx, plot in enumerate(plots)
+            ],
+            commit=False
+        )
+        if isinstance(plot_result, tuple):
+            return {'success': False, 'message': plot_result[0]}, plot_result[1]
+
+        created_plots = [
+            {'plot_id': plot.plot_id, 'plot_name': plot.plot_name, 'abstract': plot.abstract}
+            for _, plot in plot_result['created']
+        ]
+        failed_creations = plot_result['failed']
+        # 记录索引与成功创建的 plot_id 的映射，便于后续创建场景
+        idx_to_plot_id = {idx: plot.plot_id for idx, plot in plot_result['created']}
+
+        # 基于 LLM 输出读取所有场景，去重后一次性新建
+        scenes = []
         seen_scene_keys = set()
 
         for idx, plot in enumerate(plots):
-            try:
-                scene_obj = (plot or {}).get("scene") or {}
-                scene_name = (scene_obj.get("name") or "").strip()
-                scene_content = (scene_obj.get("content") or "").strip()
+            scene_obj = (plot or {}).get("scene") or {}
+            scene_name = (scene_obj.get("name") or "").strip()
+            scene_content = (scene_obj.get("content") or "").strip()
 
-                # 必须有对应成功创建的 plot 才能创建 scene
-                if idx not in idx_to_plot_id:
-                    continue
+            # 必须有对应成功创建的 plot 才能创建 scene
+            if idx not in idx_to_plot_id:
+                continue
 
-                # 去重 key：name + content
-                key = f"{scene_name.lower()}||{scene_content.lower()}"
-                if not scene_name:
-                    continue
-                if key in seen_scene_keys:
-                    continue
+            # 去重 key：name + content
+            key = f"{scene_name.lower()}||{scene_content.lower()}"
+            if not scene_name:
+                continue
+            if key in seen_scene_keys:
+                continue
 
-                seen_scene_keys.add(key)
+            seen_scene_keys.add(key)
+            scenes.append({
+                'plot_id': idx_to_plot_id[idx],
+                'scene_name': scene_name,
+                'scene_content': scene_content,
+                'scene_object': scene_obj,
+                'location': ""
+            })
 
-                scene_result = Scene.create_scene_core(
-                    user_id=current_user_id,
-                    plot_id=idx_to_plot_id[idx],
-                    scene_name=scene_name,
-                    scene_content=scene_content,
-                    scene_object=scene_obj,
-                    location=""
-                )
+        scene_result = Scene.create_scenes_bulk_core(current_user_id, scenes, commit=False)
+        if isinstance(scene_result, tuple):
+            return {'success': False, 'message': scene_result[0]}, scene_result[1]
 
-                if isinstance(scene_result, Scene):
-                    created_scenes.append({
-                        'scene_id': scene_result.scene_id,
-                        'plot_id': scene_result.plot_id,
-                        'scene_name': scene_result.scene_name
-                    })
-                else:
-                    err_msg, _ = scene_result
-                    failed_scenes.append({
-                        'scene_name': scene_name or f"Scene_{idx+1}",
-                        'error': err_msg
-                    })
-            except Exception as e:
-                failed_scenes.append({
-                    'scene_name': (plot or {}).get('scene', {}).get('name', f"Scene_{idx+1}"),
-                    'error': str(e)
-                })
+        # 提交前读取ID，避免提交后逐个对象重新加载
+        created_scenes = [
+            {'scene_id': scene.scene_id, 'plot_id': scene.plot_id, 'scene_name': scene.scene_name}
+            for scene in scene_result['created']
+        ]
+        failed_scenes = scene_result['failed']
+        db.session.commit()
 
         # 构建最终响应
-        return jsonify({
+        return {
             'success': len(created_plots) > 0,
             'message': f"Successfully generated {len(created_plots)} plots. {len(failed_creations)} failed.",
             'storyline': {
@@ -391,10 +381,14 @@ def generate_plot_route():
             'created_scenes': created_scenes,
             'failed_scenes': failed_scenes,
             'raw_llm_output': plots  # 包含完整的LLM输出供调试使用
-        }), 201 if len(created_plots) > 0 else 500
+        }, 201 if len(created_plots) > 0 else 500
         
+    except (ModelUnavailableError, RateLimitExceeded):
+        raise
     except Exception as e:
-        return jsonify({
+        # 撤销未提交的批量插入
+        db.session.rollback()
+        return {
             'success': False,
             'message': f"Error generating plot: {str(e)}"
-        }), 500
+        }, 500
@@ -1,13 +1,20 @@
 from flask import request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from agent.llm import global_llm
+from agent.resilience import ModelUnavailableError
+from agent.rate_limit import RateLimitExceeded
 from sql import *
-import requests
+from utils.blob_store import load_image_cached, load_images_base64
+from utils.image_response import send_image_url
+from utils.image_derivatives import thumbnail_urls
 import base64
 from . import api_bp
 from agent.prompt import PROMPT
 from sql.scene_image_db import SceneImage
+from sql.ownership import resolve_owned
 from sql import db
+from utils.job_queue import dedup_id, job_handler
+from .job import submit_job_response
 
 
 @api_bp.route('/scene/generate_image', methods=['POST'])
@@ -20,6 +27,7 @@ def generate_scene_image_route():
         scene_id: 场景ID（必填）
         scene_prompt: 场景描述提示词（可选）
         style: 图片风格（可选）
+        async: 是否以后台任务方式执行（可选，默认false；为true时返回202和job_id）
     
     返回:
         成功: 201状态码和新创建的场景图片信息
@@ -29,35 +37,37 @@ def generate_scene_image_route():
     data = request.get_json() or {}
     current_user_id = int(get_jwt_identity())
     
-    # 从请求数据中提取各字段
-    scene_id = data.get('scene_id')
-    scene_prompt = data.get('scene_prompt', '')
-    style = data.get('style', '')
-    
     # 验证必填参数
-    if not scene_id:
+    if not data.get('scene_id'):
         return jsonify({'msg': 'Missing required field: scene_id'}), 400
     
+    # async=true 时提交后台任务，立即返回 job_id
+    if data.get('async'):
+        return submit_job_response(current_user_id, 'scene.generate_image', data)
+
+    result, status_code = generate_scene_image_job(current_user_id, data)
+    return jsonify(result), status_code
+
+
+@job_handler('scene.generate_image',
+             dedup_key=lambda data: (dedup_id(data.get('scene_id')), data.get('scene_prompt', ''), data.get('style', '')))
+def generate_scene_image_job(current_user_id, data):
+    """
+    生成场景图片并保存记录（同步接口与后台任务共用）
+
+    返回:
+        (响应体字典, 状态码)
+    """
+    scene_id = data.get('scene_id')
+    scene_prompt = data.get('scene_prompt', '')
+    style = data.get('style', '')
+
     try:
-        # 验证场景是否存在并获取场景信息
-        scene = Scene.query.get(scene_id)
-        if not scene:
-            return jsonify({'msg': 'Scene not found'}), 404
-        
-        # 获取关联的情节信息
-        plot = Plot.query.get(scene.plot_id)
-        if not plot:
-            return jsonify({'msg': 'Plot not found'}), 404
-        
-        # 获取故事概要信息
-        storyline = Storyline.query.get(plot.storyline_id)
-        if not storyline:
-            return jsonify({'msg': 'Storyline not found'}), 404
-        
-        # 验证用户权限（通过剧本验证）
-        opera = Opera.query.get(storyline.opera_id)
-        if not opera or opera.user_id != current_user_id:
-            return jsonify({'msg': 'Permission denied: You do not own this scene'}), 403
+        # 一次联表查询获取场景、情节、故事概要并验证用户权限
+        owned = resolve_owned('scene', scene_id, current_user_id)
+        if isinstance(owned, tuple):
+            return {'msg': owned[0]}, owned[1]
+        plot, storyline = owned.plot, owned.storyline
         
         # 构建完整的图片生成提示词
         full_prompt = scene_prompt or f"A scene from plot '{plot.plot_name}'"
@@ -76,11 +86,11 @@ def generate_scene_image_route():
         image_url = global_llm.create_picture(
             prompt=full_prompt,
             user_id=current_user_id,
-            opera_id=opera.opera_id
+            opera_id=owned.opera_id
         )
         
         if not image_url:
-            return jsonify({'msg': 'Failed to generate image'}), 500
+            return {'msg': 'Failed to generate image'}, 500
         
         # 上传到代码仓库并获取可访问URL
         try:
@@ -90,10 +100,10 @@ def generate_scene_image_route():
             )
             if not ok:
                 print('Failed to upload scene image to repo: ', uploaded_url_or_err)
-                return jsonify({'msg': uploaded_url_or_err}), 500
+                return {'msg': uploaded_url_or_err}, 500
             uploaded_url = uploaded_url_or_err
         except Exception as e:
-            return jsonify({'msg': f'Failed to upload image to repository: {str(e)}'}), 500
+            return {'msg': f'Failed to upload image to repository: {str(e)}'}, 500
         
         # 调用核心函数创建场景图片记录（保存 URL 字符串）
         result = SceneImage.create_scene_image_core(
@@ -106,7 +116,7 @@ def generate_scene_image_route():
         
         if isinstance(result, SceneImage):
             # 成功创建，返回场景图片信息
-            return jsonify({
+            return {
                 'msg': 'Scene image generated successfully',
                 'scene_image': {
                     'scene_image_id': result.scene_image_id,
@@ -117,14 +127,16 @@ def generate_scene_image_route():
                     'plot_name': plot.plot_name,
                     'storyline_theme': storyline.theme
                 }
-            }), 201
+            }, 201
         else:
             # 创建失败，返回错误信息
             message, status_code = result
-            return jsonify({'msg': message}), status_code
+            return {'msg': message}, status_code
             
+    except (ModelUnavailableError, RateLimitExceeded):
+        raise
     except Exception as e:
-        return jsonify({'msg': f'Server error: {str(e)}'}), 500
+        return {'msg': f'Server error: {str(e)}'}, 500
 
 
 @api_bp.route('/scene/get_image/<int:scene_image_id>', methods=['GET'])
@@ -143,36 +155,18 @@ def get_scene_image_route(scene_image_id):
     current_user_id = int(get_jwt_identity())
     
     try:
-        # 查找场景图片
-        scene_image = SceneImage.query.get(scene_image_id)
-        if not scene_image:
-            return jsonify({'msg': 'Scene image not found'}), 404
-        
-        # 验证用户权限（通过场景->情节->故事概要->剧本的关联链验证）
-        scene = Scene.query.get(scene_image.scene_id)
-        if not scene:
-            return jsonify({'msg': 'Scene not found'}), 404
-            
-        plot = Plot.query.get(scene.plot_id)
-        if not plot:
-            return jsonify({'msg': 'Plot not found'}), 404
-            
-        storyline = Storyline.query.get(plot.storyline_id)
-        if not storyline:
-            return jsonify({'msg': 'Storyline not found'}), 404
-            
-        opera = Opera.query.get(storyline.opera_id)
-        if not opera or opera.user_id != current_user_id:
-            return jsonify({'msg': 'Permission denied: You do not own this scene image'}), 403
+        # 一次联表查询获取场景图片及其关联的场景、情节、故事概要，并验证用户权限
+        owned = resolve_owned('scene_image', scene_image_id, current_user_id)
+        if isinstance(owned, tuple):
+            return jsonify({'msg': owned[0]}), owned[1]
+        scene_image, plot, storyline = owned.scene_image, owned.plot, owned.storyline
         
         # 将 URL 下载后转为 base64
         image_base64 = None
         if scene_image.scene_image:
             image_url = str(scene_image.scene_image).strip()
             try:
-                resp = requests.get(image_url, timeout=30)
-                resp.raise_for_status()
-                image_base64 = base64.b64encode(resp.content).decode('utf-8')
+                image_base64 = base64.b64encode(load_image_cached(image_url)).decode('utf-8')
             except Exception as e:
                 return jsonify({'msg': f'Failed to download image from url: {str(e)}'}), 500
         
@@ -194,6 +188,39 @@ def get_scene_image_route(scene_image_id):
         return jsonify({'msg': f'Server error: {str(e)}'}), 500
 
 
+@api_bp.route('/scene/image_file/<int:scene_image_id>', methods=['GET'])
+@jwt_required()
+def get_scene_image_file_route(scene_image_id):
+    """
+    以二进制流获取场景图片（支持 ETag / If-None-Match 和 Range 请求）
+    
+    参数:
+        scene_image_id: 场景图片ID（路径参数）
+        size: 查询参数（可选），需要的图片尺寸（最长边像素），有合适的缩略图尺寸时返回缩略图
+    
+    返回:
+        成功: 200 / 206 状态码和图片内容，图片未变化时返回 304
+        失败: 相应的错误状态码和错误消息
+    """
+    current_user_id = int(get_jwt_identity())
+    
+    try:
+        owned = resolve_owned('scene_image', scene_image_id, current_user_id)
+        if isinstance(owned, tuple):
+            return jsonify({'msg': owned[0]}), owned[1]
+        scene_image = owned.scene_image
+        
+        if not scene_image.scene_image:
+            return jsonify({'msg': 'Scene image has no image data'}), 404
+        try:
+            return send_image_url(str(scene_image.scene_image).strip(), request.args.get('size', type=int))
+        except Exception as e:
+            return jsonify({'msg': f'Failed to download image from url: {str(e)}'}), 500
+        
+    except Exception as e:
+        return jsonify({'msg': f'Server error: {str(e)}'}), 500
+
+
 @api_bp.route('/scene/get_images/<int:scene_id>', methods=['GET'])
 @jwt_required()
 def get_scene_images_by_scene_route(scene_id):
@@ -202,57 +229,51 @@ def get_scene_images_by_scene_route(scene_id):
     
     参数:
         scene_id: 场景ID（路径参数）
+        inline: 查询参数，为 1 时在每项中附带图片的 base64 数据（image_data，并发读取并缓存）；
+                默认只返回图片元数据和 scene_image_url，由前端直接按 URL 加载图片
+        size: 查询参数（可选），需要的缩略图尺寸（最长边像素）；传入时每项附带 thumbnail_url，
+              inline 模式下 image_data 也改为缩略图数据
     
     返回:
         成功: 200状态码和场景图片列表
         失败: 相应的错误状态码和错误消息
     """
     current_user_id = int(get_jwt_identity())
+    inline = request.args.get('inline', '').lower() in ('1', 'true')
+    size = request.args.get('size', type=int)
     
     try:
-        # 验证场景是否存在
-        scene = Scene.query.get(scene_id)
-        if not scene:
-            return jsonify({'msg': 'Scene not found'}), 404
-        
-        # 获取关联的情节信息
-        plot = Plot.query.get(scene.plot_id)
-        if not plot:
-            return jsonify({'msg': 'Plot not found'}), 404
-        
-        # 获取故事概要信息
-        storyline = Storyline.query.get(plot.storyline_id)
-        if not storyline:
-            return jsonify({'msg': 'Storyline not found'}), 404
-        
-        # 验证用户权限（通过剧本验证）
-        opera = Opera.query.get(storyline.opera_id)
-        if not opera or opera.user_id != current_user_id:
-            return jsonify({'msg': 'Permission denied: You do not own this scene'}), 403
+        # 一次联表查询验证场景及用户权限
+        owned = resolve_owned('scene', scene_id, current_user_id)
+        if isinstance(owned, tuple):
+            return jsonify({'msg': owned[0]}), owned[1]
+        plot, storyline = owned.plot, owned.storyline
         
         # 查询该场景的所有图片
         scene_images = SceneImage.query.filter_by(scene_id=scene_id).order_by(SceneImage.scene_image_id.desc()).all()
         
-        # 构造返回数据（包含每张图片的 base64）
+        # 构造返回数据（默认只包含元数据和图片 URL）
         image_list = []
         for img in scene_images:
-            item = {
+            image_list.append({
                 'scene_image_id': img.scene_image_id,
                 'scene_id': img.scene_id,
                 'scene_prompt': img.scene_prompt,
                 'style': img.style,
-                'scene_image_url': str(img.scene_image) if img.scene_image else None
-            }
-            image_base64 = None
-            if item['scene_image_url']:
-                try:
-                    resp = requests.get(item['scene_image_url'], timeout=30)
-                    resp.raise_for_status()
-                    image_base64 = base64.b64encode(resp.content).decode('utf-8')
-                except Exception:
-                    image_base64 = None
-            item['image_data'] = image_base64
-            image_list.append(item)
+                'scene_image_url': str(img.scene_image).strip() if img.scene_image else None
+            })
+
+        image_urls = [item['scene_image_url'] for item in image_list]
+        if size:
+            image_urls = thumbnail_urls(image_urls, size)
+            for item, thumbnail_url in zip(image_list, image_urls):
+                item['thumbnail_url'] = thumbnail_url
+
+        # inline 模式：并发读取所有图片，耗时与图片数量无关
+        if inline:
+            images_base64 = load_images_base64(image_urls)
+            for item, image_base64 in zip(image_list, images_base64):
+                item['image_data'] = image_base64
         
         return jsonify({
             'msg': 'Scene images retrieved successfully',
@@ -295,27 +316,11 @@ def update_scene_image_route(scene_image_id):
     regenerate_image = data.get('regenerate_image', True)  # 默认重新生成图片
     
     try:
-        # 首先获取现有的场景图片记录
-        scene_image = SceneImage.query.get(scene_image_id)
-        if not scene_image:
-            return jsonify({'msg': 'Scene image not found'}), 404
-        
-        # 获取关联的场景、情节、故事概要和剧本信息
-        scene = Scene.query.get(scene_image.scene_id)
-        if not scene:
-            return jsonify({'msg': 'Scene not found'}), 404
-            
-        plot = Plot.query.get(scene.plot_id)
-        if not plot:
-            return jsonify({'msg': 'Plot not found'}), 404
-            
-        storyline = Storyline.query.get(plot.storyline_id)
-        if not storyline:
-            return jsonify({'msg': 'Storyline not found'}), 404
-            
-        opera = Opera.query.get(storyline.opera_id)
-        if not opera or opera.user_id != current_user_id:
-            return jsonify({'msg': 'Permission denied: You do not own this scene image'}), 403
+        # 一次联表查询获取场景图片及其关联的场景、情节、故事概要，并验证用户权限
+        owned = resolve_owned('scene_image', scene_image_id, current_user_id)
+        if isinstance(owned, tuple):
+            return jsonify({'msg': owned[0]}), owned[1]
+        scene_image, plot, storyline = owned.scene_image, owned.plot, owned.storyline
         
         # 准备更新的数据（URL 方式）
         new_image_url = None
@@ -348,7 +353,7 @@ def update_scene_image_route(scene_image_id):
             image_url = global_llm.create_picture(
                 prompt=full_prompt,
                 user_id=current_user_id,
-                opera_id=opera.opera_id
+                opera_id=owned.opera_id
             )
             
             if not image_url:
@@ -401,6 +406,8 @@ def update_scene_image_route(scene_image_id):
             message, status_code = result
             return jsonify({'msg': message}), status_code
             
+    except (ModelUnavailableError, RateLimitExceeded):
+        raise
     except Exception as e:
         return jsonify({'msg': f'Server error: {str(e)}'}), 500
 
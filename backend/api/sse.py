@@ -0,0 +1,37 @@
+import json
+from flask import Response, stream_with_context
+
+
+def sse_event(data, event=None):
+    """
+    将数据编码为一条 Server-Sent Events 消息
+
+    参数:
+        data: 可 JSON 序列化的数据
+        event: 事件名称（可选）
+
+    返回:
+        符合 SSE 格式的字符串
+    """
+    lines = []
+    if event:
+        lines.append(f"event: {event}")
+    lines.append(f"data: {json.dumps(data, ensure_ascii=False)}")
+    return "\n".join(lines) + "\n\n"
+
+
+def sse_response(generator):
+    """
+    将生成器包装为 text/event-stream 响应
+
+    使用 stream_with_context 保持请求上下文，生成器内部仍可访问数据库
+    """
+    return Response(
+        stream_with_context(generator),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            # 关闭 Nginx 等反向代理的缓冲，保证增量内容即时送达浏览器
+            'X-Accel-Buffering': 'no'
+        }
+    )
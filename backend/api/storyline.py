@@ -4,6 +4,7 @@ from flask_jwt_extended import jwt_required, get_jwt_identity
 from . import api_bp
 from sql.storyline_db import Storyline
 from sql.opera_db import Opera
+from sql.ownership import resolve_owned
 from sql import db
 
 @api_bp.route('/storyline/create', methods=['POST'])
@@ -135,18 +136,12 @@ def update_storyline(storyline_id):
     # 从token中获取当前登录用户ID
     current_user_id = int(get_jwt_identity())
 
-    # 查询故事概要是否存在
-    storyline = Storyline.query.get(storyline_id)
-    if not storyline:
-        return jsonify({'msg': 'Storyline not found'}), 404
-
-    # 验证当前用户是否为所属剧本的所有者（通过关联表查询）
-    # 逻辑：storyline -> opera -> user，确保归属关系
-    opera = Opera.query.get(storyline.opera_id)
-    if not opera:
-        return jsonify({'msg': 'Associated opera not found'}), 404
-    if opera.user_id != current_user_id:
-        return jsonify({'msg': 'Permission denied: You are not the owner of this storyline'}), 403
+    # 查询故事概要，并验证当前用户是否为所属剧本的所有者
+    # 逻辑：storyline -> opera -> user，一次联表查询确保归属关系
+    owned = resolve_owned('storyline', storyline_id, current_user_id)
+    if isinstance(owned, tuple):
+        return jsonify({'msg': owned[0]}), owned[1]
+    storyline = owned.storyline
 
     # 获取请求数据
     data = request.get_json()
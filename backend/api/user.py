@@ -1,6 +1,9 @@
 from flask import request, jsonify
 from sql import db
 from sql.user_db import User
+from sql.request_cache import get_current_user
+from sql.image_blob import store_image, image_url_for
+from utils.image_response import send_image_url
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identity
 from . import api_bp  # 从 api/__init__.py 导入蓝图
@@ -22,13 +25,21 @@ def register():
     if User.query.filter((User.username == username) | (User.email == email)).first():
         return jsonify({'msg': 'Username or email already exists'}), 409
 
+    # 头像（base64，可带 dataURL 前缀）保存到图片存储，行内只保存 URL
+    user_image_url = None
+    if user_image:
+        ok, url_or_err = store_image(user_image)
+        if not ok:
+            return jsonify({'msg': 'Failed to save user image', 'error': url_or_err}), 400
+        user_image_url = url_or_err
+
     hashed_password = generate_password_hash(password)
     new_user = User(
         username=username,
         email=email,
         password=hashed_password,
         identity=identity,
-        user_image=user_image
+        user_image_url=user_image_url
     )
     db.session.add(new_user)
     db.session.commit()
@@ -64,7 +75,7 @@ def get_user_info():
         pass
 
     # 根据用户ID查询数据库中的用户信息
-    user = User.query.get(current_user_id)
+    user = get_current_user(current_user_id)
     if not user:
         return jsonify({'msg': 'User not found'}), 404
 
@@ -73,11 +84,33 @@ def get_user_info():
         'username': user.username,
         'email': user.email,
         'identity': user.identity,  # 注意字段名大小写（与User模型保持一致）
-        'user_image': user.user_image
+        'user_image_url': user.user_image_url
     }
     return jsonify(user_info), 200
 
 
+@api_bp.route('/user/image_file', methods=['GET'])
+@jwt_required()
+def get_user_image_file():
+    """
+    以二进制流获取当前用户的头像（支持 ETag / If-None-Match 和 Range 请求，可通过 size 参数获取缩略图）
+    """
+    current_user_id = int(get_jwt_identity())
+
+    user = get_current_user(current_user_id)
+    if not user:
+        return jsonify({'msg': 'User not found'}), 404
+
+    try:
+        image_url = image_url_for(user, 'user_image_url', 'user_image')
+        if not image_url:
+            return jsonify({'msg': 'User has no image'}), 404
+        return send_image_url(image_url, request.args.get('size', type=int))
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'msg': 'Failed to load user image', 'error': str(e)}), 500
+
+
 @api_bp.route('/user/update_info', methods=['PUT'])
 @jwt_required()  # 验证access_token
 def update_user_info():
@@ -89,7 +122,7 @@ def update_user_info():
         pass
 
     # 查询用户是否存在
-    user = User.query.get(current_user_id)
+    user = get_current_user(current_user_id)
     if not user:
         return jsonify({'msg': 'User not found'}), 404
 
@@ -119,7 +152,14 @@ def update_user_info():
         user.identity = new_identity  # 保持与模型字段名大小写一致
 
     if new_user_image is not None:  # 允许清空图片（如果业务允许）
-        user.user_image = new_user_image
+        if new_user_image:
+            ok, url_or_err = store_image(new_user_image)
+            if not ok:
+                return jsonify({'msg': 'Failed to save user image', 'error': url_or_err}), 400
+            user.user_image_url = url_or_err
+        else:
+            user.user_image_url = None
+        user.user_image = None
 
     # 提交数据库变更
     try:
@@ -130,7 +170,7 @@ def update_user_info():
                 'username': user.username,
                 'email': user.email,
                 'identity': user.identity,
-                'user_image': user.user_image
+                'user_image_url': user.user_image_url
             }
         }), 200
     except Exception as e:
@@ -149,7 +189,7 @@ def delete_user():
         pass
 
     # 查询用户是否存在
-    user = User.query.get(current_user_id)
+    user = get_current_user(current_user_id)
     if not user:
         return jsonify({'msg': 'User not found'}), 404
 
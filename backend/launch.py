@@ -3,14 +3,15 @@ import logging
 from flask import Flask, request, jsonify
 from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity
 from dotenv import load_dotenv
+
+# 加载环境变量（需在导入各模块之前，部分模块在导入时读取配置）
+load_dotenv(override=True)
+
 from sql import *
 import json
 from api import api_bp  # 导入我们创建的蓝图
 from datetime import timedelta
 
-# 加载环境变量
-load_dotenv(override=True)
-
 app = Flask(__name__)
 
 # 配置日志
@@ -48,6 +49,11 @@ app.config['JWT_ACCESS_TOKEN_EXPIRES'] = timedelta(days=7)
 # 打印当前数据库 URI，便于确认是否指向正确的数据库
 app.logger.info('DB URI: %s', app.config['SQLALCHEMY_DATABASE_URI'])
 
+# 配置了缩略图尺寸但没有安装 Pillow 时，?size= 参数被忽略，各接口返回原图
+from utils import image_derivatives
+if image_derivatives.DERIVATIVE_SIZES and image_derivatives.Image is None:
+    app.logger.warning('IMAGE_DERIVATIVE_SIZES is set but Pillow is not installed; serving original images only')
+
 # 注册蓝图，并统一添加 /api 前缀
 app.register_blueprint(api_bp, url_prefix='/api')
 
@@ -55,6 +61,10 @@ app.register_blueprint(api_bp, url_prefix='/api')
 db.init_app(app)
 jwt = JWTManager(app)
 
+# 请求内实体缓存与每请求 SQL 查询计数
+from sql.request_cache import init_request_cache
+init_request_cache(app)
+
 # 可选：数据库初始化函数，生产环境建议单独执行
 def init_db():
     with app.app_context():
@@ -65,6 +75,23 @@ def init_db():
         db.create_all()
         app.logger.info('Database schema ensured.')
 
+# 将旧版保存在 chat.chat_AI 中的整段聊天记录迁移到 chat_message 表（可重复执行）
+# 未迁移的聊天也会在首次读写时自动迁移，此函数用于一次性批量完成
+def migrate_chat_history():
+    with app.app_context():
+        db.create_all()
+        migrated = ChatMessage.migrate_all_chat_blobs()
+        app.logger.info('Migrated %d chats to chat_message.', migrated)
+
+# 将用户头像和剧本封面从数据库行内的二进制字段迁移到图片存储（可重复执行）
+# 未迁移的图片也会在首次通过 image_file 接口访问时自动迁移，此函数用于一次性批量完成
+def migrate_entity_images():
+    from sql.image_blob import ensure_image_url_columns, migrate_all_image_blobs
+    with app.app_context():
+        ensure_image_url_columns()
+        migrated = migrate_all_image_blobs()
+        app.logger.info('Migrated %d inline images to the blob store.', migrated)
+
 if __name__ == '__main__':
     # 生产环境不应在这里初始化数据库，而是单独执行
     # init_db()
@@ -20,4 +20,7 @@ from sql.scene_db import Scene
 from sql.character_image_db import CharacterImage
 from sql.scene_image_db import SceneImage
 from sql.chat_db import Chat
-from sql.dialogue_db import Dialogue
\ No newline at end of file
+from sql.chat_message_db import ChatMessage
+from sql.chat_summary_db import ChatSummary
+from sql.dialogue_db import Dialogue
+from sql.job_db import Job
\ No newline at end of file
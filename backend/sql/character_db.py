@@ -46,16 +46,12 @@ class Character(db.Model):
         """
         try:
             # 运行时导入避免循环导入
-            from sql import User, Storyline, Opera
+            from sql.ownership import resolve_owned
             
             # 处理related默认值
             if related is None:
                 related = {}
 
-            # 验证用户是否存在
-            user = User.query.get(user_id)
-            if not user:
-                return ("User not found", 404)
 
             # 验证必填参数
             if not storyline_id:
@@ -63,23 +59,15 @@ class Character(db.Model):
             if not character_name:
                 return ("Missing required field: character_name", 400)
 
-            # 验证故事概要是否存在
-            storyline = Storyline.query.get(storyline_id)
-            if not storyline:
-                return ("Storyline not found", 404)
-
-            # 验证所有权（通过故事概要关联的剧本）
-            opera = Opera.query.get(storyline.opera_id)
-            if not opera or opera.user_id != user_id:
-                return ("Permission denied: You do not own this storyline", 403)
+            # 一次联表查询验证故事概要是否存在及所有权（故事概要 -> 剧本）
+            owned = resolve_owned('storyline', storyline_id, user_id)
+            if isinstance(owned, tuple):
+                return owned
 
             # 字段长度校验
-            if len(character_name) > 50:
-                return ("Character name must be less than 50 characters", 400)
-            if len(appearance) > 200:
-                return ("Appearance must be less than 200 characters", 400)
-            if len(personality) > 200:
-                return ("Personality must be less than 200 characters", 400)
+            error = Character._validate_fields(character_name, appearance, personality)
+            if error:
+                return error
 
             # 创建新角色
             new_character = Character(
@@ -103,6 +91,90 @@ class Character(db.Model):
         except Exception as e:
             return (f'Server error: {str(e)}', 500)
 
+    @staticmethod
+    def _validate_fields(character_name, appearance, personality):
+        """
+        字段长度校验
+
+        返回:
+            通过: None
+            失败: (错误信息, 状态码)
+        """
+        if len(character_name) > 50:
+            return ("Character name must be less than 50 characters", 400)
+        if len(appearance) > 200:
+            return ("Appearance must be less than 200 characters", 400)
+        if len(personality) > 200:
+            return ("Personality must be less than 200 characters", 400)
+        return None
+
+    @staticmethod
+    # 核心业务逻辑函数：批量创建角色
+    def create_characters_bulk_core(user_id, storyline_id, characters, commit=True):
+        """
+        在一个事务中批量创建同一故事概要下的角色（用于生成结果入库）
+
+        故事概要的所有权只验证一次；逐条做必填和长度校验，不合格的条目记入 failed，其余一次性插入。
+
+        参数:
+            user_id: 用户ID
+            storyline_id: 关联的故事概要ID（必填）
+            characters: 角色列表 [{"character_name", "appearance", "personality", "related"}, ...]
+            commit: 是否提交事务（为 False 时只 flush 以获得角色ID，由调用方统一提交）
+
+        返回:
+            成功: {"created": [角色对象, ...], "failed": [{"character_name", "error"}, ...]}
+            失败: (错误信息, 状态码)
+        """
+        try:
+            # 运行时导入避免循环导入
+            from sql.ownership import resolve_owned
+
+            if not storyline_id:
+                return ("Missing required field: storyline_id", 400)
+
+            # 一次联表查询验证故事概要是否存在及所有权（故事概要 -> 剧本）
+            owned = resolve_owned('storyline', storyline_id, user_id)
+            if isinstance(owned, tuple):
+                return owned
+
+            created = []
+            failed = []
+            for item in characters:
+                character_name = item.get("character_name")
+                appearance = item.get("appearance") or ""
+                personality = item.get("personality") or ""
+                if not character_name:
+                    failed.append({"character_name": character_name, "error": "Missing required field: character_name"})
+                    continue
+                error = Character._validate_fields(character_name, appearance, personality)
+                if error:
+                    failed.append({"character_name": character_name, "error": error[0]})
+                    continue
+                created.append(Character(
+                    user_id=user_id,
+                    storyline_id=storyline_id,
+                    character_name=character_name,
+                    appearance=appearance,
+                    personality=personality,
+                    related=item.get("related") or {}
+                ))
+
+            if created:
+                db.session.add_all(created)
+                db.session.flush()
+            if commit:
+                db.session.commit()
+
+            return {"created": created, "failed": failed}
+
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            return (f'Database error: {str(e)}', 500)
+        except Exception as e:
+            db.session.rollback()
+            return (f'Server error: {str(e)}', 500)
+
     @staticmethod
     # 核心业务逻辑函数：按故事概要批量删除角色
     def delete_characters_by_storyline_core(user_id, storyline_id):
@@ -119,26 +191,17 @@ class Character(db.Model):
         """
         try:
             # 运行时导入避免循环导入
-            from sql import User, Storyline, Opera
+            from sql.ownership import resolve_owned
 
             # 校验必填参数
             if not storyline_id:
                 return ("Missing required field: storyline_id", 400)
 
-            # 验证用户是否存在
-            user = User.query.get(user_id)
-            if not user:
-                return ("User not found", 404)
 
-            # 验证故事概要是否存在
-            storyline = Storyline.query.get(storyline_id)
-            if not storyline:
-                return ("Storyline not found", 404)
-
-            # 验证所有权（通过故事概要关联的剧本）
-            opera = Opera.query.get(storyline.opera_id)
-            if not opera or opera.user_id != user_id:
-                return ("Permission denied: You do not own this storyline", 403)
+            # 一次联表查询验证故事概要是否存在及所有权（故事概要 -> 剧本）
+            owned = resolve_owned('storyline', storyline_id, user_id)
+            if isinstance(owned, tuple):
+                return owned
 
             # 查询并删除角色
             characters = Character.query.filter_by(storyline_id=storyline_id).all()
@@ -174,30 +237,17 @@ class Character(db.Model):
         """
         try:
             # 运行时导入避免循环导入
-            from sql import User, Storyline, Opera
+            from sql.ownership import resolve_owned
             
             # 验证必填参数
             if not character_id:
                 return ("Missing required field: character_id", 400)
 
-            # 查找要删除的角色
-            character = Character.query.get(character_id)
-            if not character:
-                return ("Character not found", 404)
-
-            # 验证用户是否存在
-            user = User.query.get(user_id)
-            if not user:
-                return ("User not found", 404)
-
-            # 验证所有权（通过故事概要关联的剧本）
-            storyline = Storyline.query.get(character.storyline_id)
-            if not storyline:
-                return ("Storyline not found", 404)
-            
-            opera = Opera.query.get(storyline.opera_id)
-            if not opera or opera.user_id != user_id:
-                return ("Permission denied: You do not own this character", 403)
+            # 一次联表查询获取角色并验证所有权（角色 -> 故事概要 -> 剧本）
+            owned = resolve_owned('character', character_id, user_id)
+            if isinstance(owned, tuple):
+                return owned
+            character = owned.character
 
             # 保存角色信息用于返回
             deleted_character = character
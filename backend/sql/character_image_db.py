@@ -1,12 +1,7 @@
 from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.orm import relationship
-import requests
-import base64
-import os
-import uuid
-import time
 
-from sql import db, User, Character
+from sql import db
 
 class CharacterImage(db.Model):
     __tablename__ = 'character_image'
@@ -48,23 +43,17 @@ class CharacterImage(db.Model):
             失败: (错误信息, 状态码)
         """
         try:
-            # 验证用户是否存在
-            user = User.query.get(user_id)
-            if not user:
-                return ("User not found", 404)
+            # 运行时导入避免循环导入
+            from sql.ownership import resolve_owned
 
             # 验证必填参数
             if not character_id:
                 return ("Missing required field: character_id", 400)
 
-            # 验证角色是否存在
-            character = Character.query.get(character_id)
-            if not character:
-                return ("Character not found", 404)
-
-            # 验证所有权（确保用户拥有这个角色）
-            if character.user_id != user_id:
-                return ("Permission denied: You do not own this character", 403)
+            # 一次联表查询验证角色及所有权（角色->故事概要->剧本）
+            owned = resolve_owned('character', character_id, user_id)
+            if isinstance(owned, tuple):
+                return owned
 
             # 字段长度校验
             if len(character_prompt) > 500:
@@ -117,28 +106,18 @@ class CharacterImage(db.Model):
             失败: (错误信息, 状态码)
         """
         try:
+            # 运行时导入避免循环导入
+            from sql.ownership import resolve_owned
+
             # 验证必填参数
             if not character_image_id:
                 return ("Missing required field: character_image_id", 400)
 
-            # 查找要更新的角色图片
-            character_image_obj = CharacterImage.query.get(character_image_id)
-            if not character_image_obj:
-                return ("Character image not found", 404)
-
-            # 验证用户是否存在
-            user = User.query.get(user_id)
-            if not user:
-                return ("User not found", 404)
-
-            # 验证所有权（确保用户拥有这个角色图片）
-            if character_image_obj.user_id != user_id:
-                return ("Permission denied: You do not own this character image", 403)
-
-            # 验证关联的角色是否存在
-            character = Character.query.get(character_image_obj.character_id)
-            if not character:
-                return ("Associated character not found", 404)
+            # 一次联表查询获取角色图片并验证所有权（角色图片->角色->故事概要->剧本）
+            owned = resolve_owned('character_image', character_image_id, user_id)
+            if isinstance(owned, tuple):
+                return owned
+            character_image_obj = owned.character_image
 
             # 字段长度校验（只校验提供的字段）
             if character_prompt is not None and len(character_prompt) > 500:
@@ -180,28 +159,18 @@ class CharacterImage(db.Model):
             失败: (错误信息, 状态码)
         """
         try:
+            # 运行时导入避免循环导入
+            from sql.ownership import resolve_owned
+
             # 验证必填参数
             if not character_image_id:
                 return ("Missing required field: character_image_id", 400)
 
-            # 查找要删除的角色图片
-            character_image = CharacterImage.query.get(character_image_id)
-            if not character_image:
-                return ("Character image not found", 404)
-
-            # 验证用户是否存在
-            user = User.query.get(user_id)
-            if not user:
-                return ("User not found", 404)
-
-            # 验证所有权（确保用户拥有这个角色图片）
-            if character_image.user_id != user_id:
-                return ("Permission denied: You do not own this character image", 403)
-
-            # 验证关联的角色是否存在
-            character = Character.query.get(character_image.character_id)
-            if not character:
-                return ("Associated character not found", 404)
+            # 一次联表查询获取角色图片并验证所有权（角色图片->角色->故事概要->剧本）
+            owned = resolve_owned('character_image', character_image_id, user_id)
+            if isinstance(owned, tuple):
+                return owned
+            character_image = owned.character_image
 
             # 保存角色图片信息用于返回
             deleted_character_image = character_image
@@ -221,75 +190,24 @@ class CharacterImage(db.Model):
     @staticmethod
     def upload_picture(image_url, file_name=None, target_dir=None, branch=None):
         """
-        从给定的 image_url 下载图片，上传到指定的 GitHub 仓库路径下，并返回上传后的下载链接。
+        从给定的 image_url 下载图片，保存到图片存储（见 utils/blob_store.py），并返回可访问的链接。
 
         参数:
             image_url: 需要上传的图片 URL
-            file_name: 目标文件名（可选；若不传将自动生成唯一名）
-            branch: 分支名（可选，默认从环境变量读取，否则 'main'）
+            file_name: 目标文件名（仅 GitHub 存储使用；若不传将自动生成唯一名）
+            target_dir: 目标目录（仅 GitHub 存储使用）
+            branch: 分支名（仅 GitHub 存储使用，默认从环境变量读取，否则 'main'）
 
         返回:
             (True, download_url) 或 (False, error_message)
         """
-        try:
-            # 0) 从环境变量读取目标仓库配置
-            repo_owner = os.getenv("GITHUB_REPO_OWNER")
-            repo_name = os.getenv("GITHUB_REPO_NAME")
-            token = os.getenv("GITHUB_TOKEN")
-            branch = branch or os.getenv("GITHUB_BRANCH", "main")
-            if not repo_owner or not repo_name or not token:
-                return (False, "Missing required env: GITHUB_REPO_OWNER/GITHUB_REPO_NAME/GITHUB_TOKEN")
-
-            # 1) 下载图片
-            resp = requests.get(image_url, timeout=30)
-            resp.raise_for_status()
-            file_data = resp.content
-
-            # 2) 生成唯一文件名（固定使用 .png 扩展名）
-            if not file_name:
-                file_name = f"{int(time.time()*1000)}_{uuid.uuid4().hex}.png"
-
-            # 3) 目标路径拼接
-            target_dir = target_dir.strip("/")
-            remote_path = f"{target_dir}/{file_name}" if target_dir else file_name
-
-            # 4) GitHub API URL
-            api_base = "https://api.github.com"
-            contents_url = f"{api_base}/repos/{repo_owner}/{repo_name}/contents/{remote_path}"
-
-            headers = {
-                "Authorization": f"token {token}",
-                "Accept": "application/vnd.github+json",
-            }
-
-            # 5) 读取现有文件（若存在则需要 sha）
-            sha = None
-            get_params = {"ref": branch}
-            get_resp = requests.get(contents_url, headers=headers, params=get_params)
-            if get_resp.status_code == 200:
-                sha = get_resp.json().get("sha")
-
-            # 6) 组装上传数据
-            content_b64 = base64.b64encode(file_data).decode("utf-8")
-            payload = {
-                "message": f"upload {remote_path}",
-                "content": content_b64,
-                "branch": branch,
-            }
-            if sha:
-                payload["sha"] = sha
-
-            put_resp = requests.put(contents_url, headers=headers, json=payload)
-            if put_resp.status_code not in (200, 201):
-                return (False, f"GitHub upload failed: {put_resp.status_code} {put_resp.text}")
-
-            content_obj = put_resp.json().get("content") or {}
-            download_url = content_obj.get("download_url")
-            if not download_url:
-                # 兜底用 raw 链接
-                download_url = f"https://raw.githubusercontent.com/{repo_owner}/{repo_name}/{branch}/{remote_path}"
-
-            return (True, download_url)
-
-        except Exception as e:
-            return (False, f"upload_picture error: {str(e)}")
\ No newline at end of file
+        # 运行时导入避免循环导入
+        from utils.blob_store import blob_store
+        from utils.image_derivatives import derivatives_enabled, generate_derivatives
+        from utils.job_queue import job_queue
+
+        result = blob_store.put_url(image_url, target_dir=target_dir, file_name=file_name, branch=branch)
+        # 上传成功后在后台生成缩略图等派生图片，不影响本次请求的耗时
+        if result[0] and derivatives_enabled():
+            job_queue.submit_background(generate_derivatives, result[1])
+        return result
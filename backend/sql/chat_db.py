@@ -11,7 +11,8 @@ class Chat(db.Model):
     chat_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.user_id'), nullable=False)
     opera_id = db.Column(db.Integer, db.ForeignKey('opera.opera_id'), nullable=False)
-    chat_AI = db.Column(JSON)
+    # 旧版整段 JSON 聊天记录，新消息保存在 chat_message 表；迁移后置为 NULL
+    chat_AI = db.Column(JSON(none_as_null=True))
     chat_time = db.Column(DateTime, default=datetime.utcnow, nullable=False)
 
     # 关系
@@ -36,24 +37,21 @@ class Chat(db.Model):
         """
         try:
             # 运行时导入避免循环导入
-            from sql import User
-            
-            # 验证用户是否存在
-            user = User.query.get(user_id)
-            if not user:
-                return ("User not found", 404)
-
-            # 创建新聊天记录
+            from sql.chat_message_db import ChatMessage
+
+            # 创建新聊天记录（消息逐条写入 chat_message 表）
             new_chat = Chat(
                 user_id=user_id,
                 opera_id=opera_id,
-                chat_AI=chat_AI,
+                chat_AI=None,
                 # 可以指定时间，否则不指定则使用默认的utc时间
                 chat_time=datetime.utcnow()
             )
 
             # 保存到数据库
             db.session.add(new_chat)
+            db.session.flush()
+            ChatMessage.insert_messages(new_chat.chat_id, chat_AI)
             db.session.commit()
 
             return new_chat  # 成功时返回新创建的聊天记录对象
@@ -79,15 +77,10 @@ class Chat(db.Model):
         """
         try:
             # 运行时导入避免循环导入
-            from sql import User
-            
-            # 验证用户是否存在
-            user = User.query.get(user_id)
-            if not user:
-                return ("User not found", 404)
-
-            # 查询聊天记录
-            chat = Chat.query.get(chat_id)
+            from sql.request_cache import get_cached
+
+            # 查询聊天记录（同一请求内只查询一次）
+            chat = get_cached(Chat, chat_id)
             if not chat:
                 return (f'聊天记录 {chat_id} 不存在', 404)
 
@@ -118,15 +111,10 @@ class Chat(db.Model):
         """
         try:
             # 运行时导入避免循环导入
-            from sql import User
-            
-            # 验证用户是否存在
-            user = User.query.get(user_id)
-            if not user:
-                return ("User not found", 404)
-
-            # 查询聊天记录
-            chat = Chat.query.get(chat_id)
+            from sql.request_cache import get_cached
+
+            # 查询聊天记录（同一请求内只查询一次）
+            chat = get_cached(Chat, chat_id)
             if not chat:
                 return (f'聊天记录 {chat_id} 不存在', 404)
 
@@ -134,13 +122,10 @@ class Chat(db.Model):
             if chat.user_id != user_id:
                 return ("没有权限更新该聊天记录", 403)
 
-            # 允许更新的字段列表，防止恶意更新不允许修改的字段
-            allowed_fields = ['chat_AI']
-
-            # 应用更新
-            for field in allowed_fields:
-                if field in update_data:
-                    setattr(chat, field, update_data[field])
+            # 允许更新的字段：chat_AI（整段替换聊天消息），防止恶意更新不允许修改的字段
+            if 'chat_AI' in update_data:
+                from sql.chat_message_db import ChatMessage
+                ChatMessage.replace_messages_core(chat, update_data['chat_AI'])
 
             # 更新时间可以选择是否更新为当前时间
             if 'update_time' in update_data and update_data['update_time']:
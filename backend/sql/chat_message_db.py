@@ -0,0 +1,235 @@
+from sqlalchemy.exc import SQLAlchemyError, IntegrityError
+from sqlalchemy import DateTime, JSON, func, null
+from datetime import datetime
+from sql import db
+
+
+class ChatMessage(db.Model):
+    """
+    聊天消息：每条消息一行，按 seq 在同一聊天内递增排序
+
+    追加消息只需插入新行，不再读写整段聊天记录；
+    旧版本保存在 chat.chat_AI 中的 JSON 数组会在首次访问时迁移到本表（见 migrate_chat_blob）。
+    """
+    __tablename__ = 'chat_message'
+    __table_args__ = (
+        db.UniqueConstraint('chat_id', 'seq', name='uq_chat_message_chat_seq'),
+    )
+
+    message_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    chat_id = db.Column(db.Integer, db.ForeignKey('chat.chat_id', ondelete='CASCADE'), nullable=False, index=True)
+    seq = db.Column(db.Integer, nullable=False)
+    role = db.Column(db.String(20), nullable=False)
+    content = db.Column(db.Text, nullable=False, default='')
+    created_at = db.Column(DateTime, default=datetime.utcnow, nullable=False)
+
+    def __repr__(self):
+        return f"<ChatMessage {self.message_id} chat_id={self.chat_id} seq={self.seq} role={self.role}>"
+
+    def to_dict(self):
+        return {"role": self.role, "content": self.content}
+
+    @staticmethod
+    def _normalize(messages):
+        """
+        过滤掉格式不正确的消息（旧数据中可能混入字符串等），只保留 role/content
+        """
+        normalized = []
+        for message in messages or []:
+            if isinstance(message, dict) and message.get('role'):
+                normalized.append({"role": message['role'], "content": message.get('content') or ''})
+        return normalized
+
+    @staticmethod
+    def insert_messages(chat_id, messages, start_seq=1):
+        """
+        将消息按顺序加入会话（不提交事务）
+
+        参数:
+            chat_id: 聊天记录ID
+            messages: 消息列表 [{"role", "content"}, ...]
+            start_seq: 第一条消息的序号
+
+        返回:
+            新建的消息对象列表
+        """
+        rows = [
+            ChatMessage(chat_id=chat_id, seq=start_seq + i, role=m['role'], content=m['content'])
+            for i, m in enumerate(ChatMessage._normalize(messages))
+        ]
+        db.session.add_all(rows)
+        return rows
+
+    @staticmethod
+    def last_seq(chat_id):
+        """
+        聊天中最后一条消息的序号（没有消息时为 0）
+        """
+        # (chat_id, seq) 上有唯一索引，取最大值只需读索引的一端
+        max_seq = db.session.query(func.max(ChatMessage.seq)).filter(ChatMessage.chat_id == chat_id).scalar()
+        return max_seq or 0
+
+    @staticmethod
+    def _next_seq(chat_id):
+        return ChatMessage.last_seq(chat_id) + 1
+
+    @staticmethod
+    def migrate_chat_blob(chat, commit=True):
+        """
+        将 chat.chat_AI 中的旧版 JSON 聊天记录迁移到 chat_message 表，并清空 chat_AI
+
+        参数:
+            chat: 聊天记录对象
+            commit: 是否立即提交
+
+        返回:
+            迁移的消息条数（没有需要迁移的数据时为 0）
+        """
+        blob = chat.chat_AI
+        messages = ChatMessage._normalize(blob if isinstance(blob, list) else [])
+        if messages:
+            # 旧聊天在迁移前不会有新消息写入本表，迁移后的序号从 1 开始；
+            # 固定从 1 开始也保证同一聊天被并发迁移时必然触发 (chat_id, seq) 唯一索引冲突，而不是插入两份
+            ChatMessage.insert_messages(chat.chat_id, messages, 1)
+        # 旧数据中的 JSON null 读出来也是 None，赋值 None 不会产生 UPDATE；显式写入 SQL NULL，保证处理过的行不再被查到
+        chat.chat_AI = null()
+        if commit:
+            db.session.commit()
+        return len(messages)
+
+    @staticmethod
+    def _migrate_before_read(chat):
+        """
+        读取消息前迁移旧版聊天记录
+
+        同一聊天的两个首次读取同时迁移时，后提交的一方序号冲突：回滚并重新加载聊天记录，使用另一方迁移的结果
+        """
+        if chat.chat_AI is None:
+            return
+        try:
+            ChatMessage.migrate_chat_blob(chat)
+        except IntegrityError:
+            db.session.rollback()
+            db.session.refresh(chat)
+
+    @staticmethod
+    def get_messages(chat):
+        """
+        按顺序获取聊天的全部消息
+
+        参数:
+            chat: 已通过权限验证的聊天记录对象
+
+        返回:
+            消息列表 [{"role", "content"}, ...]
+        """
+        ChatMessage._migrate_before_read(chat)
+        rows = ChatMessage.query.filter_by(chat_id=chat.chat_id).order_by(ChatMessage.seq.asc()).all()
+        return [row.to_dict() for row in rows]
+
+    @staticmethod
+    def iter_messages_newest_first(chat, after_seq=0, batch_size=50):
+        """
+        从最新的消息开始逐批向前读取，调用方读够（如达到上下文预算）后即可停止，不必加载整段历史
+
+        参数:
+            chat: 已通过权限验证的聊天记录对象
+            after_seq: 只读取序号大于该值的消息（如已被摘要覆盖的消息不再读取）
+            batch_size: 每批查询的消息条数
+
+        返回:
+            按从新到旧顺序产出 {"role", "content"} 的生成器
+        """
+        ChatMessage._migrate_before_read(chat)
+
+        before_seq = None
+        while True:
+            query = ChatMessage.query.filter(ChatMessage.chat_id == chat.chat_id, ChatMessage.seq > after_seq)
+            if before_seq is not None:
+                query = query.filter(ChatMessage.seq < before_seq)
+            rows = query.order_by(ChatMessage.seq.desc()).limit(batch_size).all()
+            for row in rows:
+                yield row.to_dict()
+            if len(rows) < batch_size:
+                return
+            before_seq = rows[-1].seq
+
+    @staticmethod
+    def append_messages_core(chat, messages, retries=3):
+        """
+        在聊天末尾追加消息（只插入新行，与已有消息数量无关）
+
+        参数:
+            chat: 已通过权限验证的聊天记录对象
+            messages: 要追加的消息列表 [{"role", "content"}, ...]
+            retries: 并发追加导致序号冲突时的重试次数
+
+        返回:
+            成功: 新插入的消息对象列表
+            失败: (错误信息, 状态码)
+        """
+        messages = ChatMessage._normalize(messages)
+        if not messages:
+            return []
+
+        chat_id = chat.chat_id
+        for attempt in range(retries):
+            try:
+                if chat.chat_AI is not None:
+                    ChatMessage.migrate_chat_blob(chat, commit=False)
+                rows = ChatMessage.insert_messages(chat_id, messages, ChatMessage._next_seq(chat_id))
+                chat.chat_time = datetime.utcnow()
+                db.session.commit()
+                return rows
+
+            except IntegrityError:
+                # 同一聊天被并发追加时序号可能冲突，回滚后重新取序号
+                db.session.rollback()
+                if attempt == retries - 1:
+                    return ('聊天消息保存冲突，请重试', 409)
+            except SQLAlchemyError as e:
+                db.session.rollback()
+                return (f'数据库错误: {str(e)}', 500)
+
+    @staticmethod
+    def replace_messages_core(chat, messages):
+        """
+        用新的消息列表整体替换聊天记录（仅用于显式编辑整段记录的接口，不提交事务）
+
+        新消息的序号从 1 重新开始，原有摘要覆盖的序号不再对应，在同一事务中一并删除
+        """
+        # 运行时导入避免循环导入
+        from sql.chat_summary_db import ChatSummary
+
+        ChatMessage.query.filter_by(chat_id=chat.chat_id).delete(synchronize_session=False)
+        ChatSummary.delete_summary(chat.chat_id)
+        chat.chat_AI = None
+        ChatMessage.insert_messages(chat.chat_id, messages)
+
+    @staticmethod
+    def migrate_all_chat_blobs(batch_size=100):
+        """
+        批量迁移所有仍保存在 chat.chat_AI 中的旧聊天记录（需要在应用上下文中调用）
+
+        返回:
+            迁移的聊天数量
+        """
+        from sql import Chat
+
+        migrated = 0
+        last_id = 0
+        while True:
+            # 跳过保存为 JSON null 的旧数据（没有需要迁移的消息）；按 chat_id 递增分批，每一批都向前推进，循环一定结束
+            chats = Chat.query.filter(
+                Chat.chat_AI.isnot(None),
+                Chat.chat_AI != JSON.NULL,
+                Chat.chat_id > last_id
+            ).order_by(Chat.chat_id.asc()).limit(batch_size).all()
+            if not chats:
+                return migrated
+            for chat in chats:
+                # 迁移后 chat_AI 置为 NULL，下一批不会再查到
+                ChatMessage.migrate_chat_blob(chat, commit=False)
+            last_id = chats[-1].chat_id
+            db.session.commit()
+            migrated += len(chats)
@@ -0,0 +1,121 @@
+import os
+from sqlalchemy.exc import SQLAlchemyError, IntegrityError
+from sqlalchemy import DateTime
+from datetime import datetime
+from sql import db
+
+# 最近多少条消息始终原样发送给模型，不参与摘要
+KEEP_RECENT_MESSAGES = int(os.environ.get('CHAT_SUMMARY_KEEP_RECENT', 12))
+# 未摘要的较早消息累计到多少条时触发一次摘要
+SUMMARY_BATCH_MESSAGES = int(os.environ.get('CHAT_SUMMARY_BATCH', 20))
+# 单条消息参与摘要的最大字符数，避免个别超长回答撑大摘要请求
+MAX_MESSAGE_CHARS = 2000
+
+
+class ChatSummary(db.Model):
+    """
+    聊天的滚动摘要：covered_seq 及之前的消息已被压缩进 summary，
+    组装上下文时发送“摘要 + covered_seq 之后的消息”，而不是整段历史。
+    """
+    __tablename__ = 'chat_summary'
+
+    chat_id = db.Column(db.Integer, db.ForeignKey('chat.chat_id', ondelete='CASCADE'), primary_key=True)
+    summary = db.Column(db.Text, nullable=False, default='')
+    covered_seq = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(DateTime, default=datetime.utcnow, nullable=False)
+
+    def __repr__(self):
+        return f"<ChatSummary chat_id={self.chat_id} covered_seq={self.covered_seq}>"
+
+    @staticmethod
+    def get_summary(chat_id):
+        """
+        获取聊天的摘要（请求内缓存），尚未生成时返回 None
+        """
+        # 运行时导入避免循环导入
+        from sql.request_cache import get_cached
+        return get_cached(ChatSummary, chat_id)
+
+    @staticmethod
+    def delete_summary(chat_id):
+        """
+        删除聊天的摘要（聊天记录被整体替换时调用，不提交事务）
+        """
+        # 运行时导入避免循环导入
+        from sql.request_cache import clear_request_cache
+        ChatSummary.query.filter_by(chat_id=chat_id).delete(synchronize_session=False)
+        # 批量删除不经过 session.deleted，需要手动清空请求缓存中的旧摘要
+        clear_request_cache()
+
+    @staticmethod
+    def needs_update(chat_id, last_seq):
+        """
+        判断追加到 last_seq 后，是否有足够多的较早消息需要压缩进摘要
+        """
+        summary = ChatSummary.get_summary(chat_id)
+        covered_seq = summary.covered_seq if summary else 0
+        return last_seq - KEEP_RECENT_MESSAGES - covered_seq >= SUMMARY_BATCH_MESSAGES
+
+    @staticmethod
+    def update_summary_core(chat_id):
+        """
+        将上次摘要之后、最近 KEEP_RECENT_MESSAGES 条之前的消息合并进摘要（在后台线程中调用）
+
+        参数:
+            chat_id: 聊天记录ID
+
+        返回:
+            成功: 最新的摘要对象（无需更新或已被其他执行者更新时返回当前摘要或 None）
+            失败: (错误信息, 状态码)
+        """
+        try:
+            # 运行时导入避免循环导入
+            from sql.chat_message_db import ChatMessage
+            from agent.llm import global_llm
+            from agent.prompt import PROMPT
+
+            summary = ChatSummary.query.get(chat_id)
+            covered_seq = summary.covered_seq if summary else 0
+            upto_seq = ChatMessage.last_seq(chat_id) - KEEP_RECENT_MESSAGES
+            if upto_seq - covered_seq < SUMMARY_BATCH_MESSAGES:
+                return summary
+
+            rows = ChatMessage.query.filter(
+                ChatMessage.chat_id == chat_id,
+                ChatMessage.seq > covered_seq,
+                ChatMessage.seq <= upto_seq,
+                ChatMessage.role != 'system'
+            ).order_by(ChatMessage.seq.asc()).all()
+            new_messages = "\n".join(f"{row.role}: {row.content[:MAX_MESSAGE_CHARS]}" for row in rows)
+            previous = summary.summary if summary else ''
+            user_input = f"###PREVIOUS_SUMMARY###\n{previous}\n###NEW_MESSAGES###\n{new_messages}"
+            # 调用模型前结束只读事务，避免在等待模型期间占用数据库连接
+            db.session.rollback()
+
+            text = global_llm.chat(user_input, PROMPT['chat_summary'], task='summary').strip()
+            if not text:
+                return ('Empty summary', 500)
+
+            # 调用模型期间可能已有其他执行者更新了摘要，只在 covered_seq 未变化时写入
+            if summary is None:
+                summary = ChatSummary(chat_id=chat_id, summary=text, covered_seq=upto_seq)
+                db.session.add(summary)
+            else:
+                updated = ChatSummary.query.filter_by(chat_id=chat_id, covered_seq=covered_seq).update(
+                    {'summary': text, 'covered_seq': upto_seq, 'updated_at': datetime.utcnow()},
+                    synchronize_session=False
+                )
+                if not updated:
+                    db.session.rollback()
+                    return ChatSummary.query.get(chat_id)
+            db.session.commit()
+            return ChatSummary.query.get(chat_id)
+
+        except IntegrityError:
+            db.session.rollback()
+            return ChatSummary.query.get(chat_id)
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            return (f'数据库错误: {str(e)}', 500)
+        except Exception as e:
+            return (f'服务器错误: {str(e)}', 500)
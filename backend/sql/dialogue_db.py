@@ -1,5 +1,9 @@
 from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.orm import relationship
+import asyncio
+import os
+from agent.resilience import ModelUnavailableError
+from agent.rate_limit import RateLimitExceeded
 
 from sql import db
 
@@ -42,12 +46,7 @@ class Dialogue(db.Model):
         """
         try:
             # 运行时导入避免循环导入
-            from sql import User, Storyline, Plot, Opera
-            
-            # 验证用户是否存在
-            user = User.query.get(user_id)
-            if not user:
-                return ("User not found", 404)
+            from sql.ownership import resolve_owned
 
             # 验证必填参数
             if not storyline_id:
@@ -57,25 +56,16 @@ class Dialogue(db.Model):
             if not dialogue_content:
                 return ("Missing required field: dialogue_content", 400)
 
-            # 验证故事概要是否存在
-            storyline = Storyline.query.get(storyline_id)
-            if not storyline:
-                return ("Storyline not found", 404)
-
-            # 验证情节是否存在
-            plot = Plot.query.get(plot_id)
-            if not plot:
-                return ("Plot not found", 404)
+            # 一次联表查询获取情节并验证所有权（情节->故事概要->剧本）
+            owned = resolve_owned('plot', plot_id, user_id)
+            if isinstance(owned, tuple):
+                return owned
+            plot = owned.plot
 
             # 验证情节是否属于指定的故事概要
             if plot.storyline_id != storyline_id:
                 return ("Plot does not belong to the specified storyline", 400)
 
-            # 验证所有权（通过故事概要关联的剧本）
-            opera = Opera.query.get(storyline.opera_id)
-            if not opera or opera.user_id != user_id:
-                return ("Permission denied: You do not own this storyline", 403)
-
             # 验证对话内容格式（应该是有效的JSON格式）
             if not isinstance(dialogue_content, (dict, list)):
                 return ("Dialogue content must be a valid JSON object or array", 400)
@@ -115,30 +105,17 @@ class Dialogue(db.Model):
         """
         try:
             # 运行时导入避免循环导入
-            from sql import User, Storyline, Opera
+            from sql.ownership import resolve_owned
 
             # 验证必填参数
             if not dialogue_id:
                 return ("Missing required field: dialogue_id", 400)
 
-            # 查找对话
-            dialogue = Dialogue.query.get(dialogue_id)
-            if not dialogue:
-                return ("Dialogue not found", 404)
-
-            # 验证用户是否存在
-            user = User.query.get(user_id)
-            if not user:
-                return ("User not found", 404)
-
-            # 验证所有权
-            storyline = Storyline.query.get(dialogue.storyline_id)
-            if not storyline:
-                return ("Associated storyline not found", 404)
-                
-            opera = Opera.query.get(storyline.opera_id)
-            if not opera or opera.user_id != user_id:
-                return ("Permission denied: You do not own this dialogue", 403)
+            # 一次联表查询获取对话并验证所有权（对话->故事概要->剧本）
+            owned = resolve_owned('dialogue', dialogue_id, user_id)
+            if isinstance(owned, tuple):
+                return owned
+            dialogue = owned.dialogue
 
             return dialogue
 
@@ -162,30 +139,16 @@ class Dialogue(db.Model):
         """
         try:
             # 运行时导入避免循环导入
-            from sql import User, Storyline, Opera, Plot
+            from sql.ownership import resolve_owned
 
             # 验证必填参数
             if not plot_id:
                 return ("Missing required field: plot_id", 400)
 
-            # 验证用户是否存在
-            user = User.query.get(user_id)
-            if not user:
-                return ("User not found", 404)
-
-            # 验证剧情是否存在
-            plot = Plot.query.get(plot_id)
-            if not plot:
-                return ("Plot not found", 404)
-
-            # 验证所有权
-            storyline = Storyline.query.get(plot.storyline_id)
-            if not storyline:
-                return ("Associated storyline not found", 404)
-            
-            opera = Opera.query.get(storyline.opera_id)
-            if not opera or opera.user_id != user_id:
-                return ("Permission denied: You do not own this plot", 403)
+            # 一次联表查询验证剧情及所有权（剧情->故事概要->剧本）
+            owned = resolve_owned('plot', plot_id, user_id)
+            if isinstance(owned, tuple):
+                return owned
             
             # 查找对话
             dialogue = Dialogue.query.filter_by(plot_id=plot_id).first()
@@ -219,30 +182,17 @@ class Dialogue(db.Model):
         """
         try:
             # 运行时导入避免循环导入
-            from sql import User, Storyline, Opera
+            from sql.ownership import resolve_owned
             
             # 验证必填参数
             if not dialogue_id:
                 return ("Missing required field: dialogue_id", 400)
 
-            # 查找要更新的对话
-            dialogue = Dialogue.query.get(dialogue_id)
-            if not dialogue:
-                return ("Dialogue not found", 404)
-
-            # 验证用户是否存在
-            user = User.query.get(user_id)
-            if not user:
-                return ("User not found", 404)
-
-            # 验证所有权（通过故事概要关联的剧本）
-            storyline = Storyline.query.get(dialogue.storyline_id)
-            if not storyline:
-                return ("Associated storyline not found", 404)
-                
-            opera = Opera.query.get(storyline.opera_id)
-            if not opera or opera.user_id != user_id:
-                return ("Permission denied: You do not own this dialogue", 403)
+            # 一次联表查询获取对话并验证所有权（对话->故事概要->剧本）
+            owned = resolve_owned('dialogue', dialogue_id, user_id)
+            if isinstance(owned, tuple):
+                return owned
+            dialogue = owned.dialogue
 
             # 更新字段（只更新提供的字段）
             if dialogue_content is not None:
@@ -277,30 +227,17 @@ class Dialogue(db.Model):
         """
         try:
             # 运行时导入避免循环导入
-            from sql import User, Storyline, Opera
+            from sql.ownership import resolve_owned
             
             # 验证必填参数
             if not dialogue_id:
                 return ("Missing required field: dialogue_id", 400)
 
-            # 查找要删除的对话
-            dialogue = Dialogue.query.get(dialogue_id)
-            if not dialogue:
-                return ("Dialogue not found", 404)
-
-            # 验证用户是否存在
-            user = User.query.get(user_id)
-            if not user:
-                return ("User not found", 404)
-
-            # 验证所有权（通过故事概要关联的剧本）
-            storyline = Storyline.query.get(dialogue.storyline_id)
-            if not storyline:
-                return ("Associated storyline not found", 404)
-                
-            opera = Opera.query.get(storyline.opera_id)
-            if not opera or opera.user_id != user_id:
-                return ("Permission denied: You do not own this dialogue", 403)
+            # 一次联表查询获取对话并验证所有权（对话->故事概要->剧本）
+            owned = resolve_owned('dialogue', dialogue_id, user_id)
+            if isinstance(owned, tuple):
+                return owned
+            dialogue = owned.dialogue
 
             # 保存对话信息用于返回
             deleted_dialogue = dialogue
@@ -318,13 +255,14 @@ class Dialogue(db.Model):
             return (f'Server error: {str(e)}', 500)
 
     @staticmethod
-    def generate_dialogue_from_plot_core(user_id, plot_id):
+    def generate_dialogue_from_plot_core(user_id, plot_id, use_cache=True):
         """
         根据情节ID生成对话并保存到数据库
 
         参数:
             user_id: 用户ID
             plot_id: 情节ID（必填）
+            use_cache: 是否使用模型回答缓存（可选，默认True）
 
         返回:
             成功: 新创建的对话对象
@@ -332,108 +270,43 @@ class Dialogue(db.Model):
         """
         try:
             # 运行时导入避免循环导入
-            from sql import User, Plot, Storyline, Opera, Character
+            from sql import Character
+            from sql.ownership import resolve_owned
             from agent.llm import global_llm
-            import json
-            
-            # 验证用户是否存在
-            user = User.query.get(user_id)
-            if not user:
-                return ("User not found", 404)
 
             # 验证必填参数
             if not plot_id:
                 return ("Missing required field: plot_id", 400)
 
-            # 验证情节是否存在
-            plot = Plot.query.get(plot_id)
-            if not plot:
-                return ("Plot not found", 404)
-
-            # 验证故事概要是否存在
-            storyline = Storyline.query.get(plot.storyline_id)
-            if not storyline:
-                return ("Storyline not found", 404)
-
-            # 验证所有权（通过故事概要关联的剧本）
-            opera = Opera.query.get(storyline.opera_id)
-            if not opera or opera.user_id != user_id:
-                return ("Permission denied: You do not own this plot", 403)
+            # 一次联表查询获取情节、故事概要并验证所有权（情节->故事概要->剧本）
+            owned = resolve_owned('plot', plot_id, user_id)
+            if isinstance(owned, tuple):
+                return owned
+            plot, storyline = owned.plot, owned.storyline
 
             # 获取该故事概要下的所有角色
             characters = Character.query.filter_by(storyline_id=storyline.storyline_id).all()
-            
-            # 构建角色列表信息
-            character_list = []
-            for char in characters:
-                character_info = {
-                    "name": char.character_name,
-                    "personality": char.personality or "",
-                    "appearance": char.appearance or ""
-                }
-                if char.related:
-                    character_info["related"] = char.related
-                character_list.append(character_info)
-
-            # 构建情节信息
-            plot_info = {
-                "plotName": plot.plot_name,
-                "abstract": plot.abstract or "",
-                "character": plot.characters or []
-            }
-
-            # 构建故事概要信息
-            storyline_info = {
-                "theme": storyline.theme or "",
-                "classtype": storyline.classtype or "",
-                "education": storyline.education or "",
-                "level": storyline.level or "",
-                "storyline_name": storyline.storyline_name or "",
-                "storyline_content": storyline.storyline_content or ""
-            }
-
-            # 获取对话生成提示词
-            dialogue_prompt = global_llm.setting_dialogue_create
-            
-            # 构建用户输入内容，包含所有必要信息
-            user_input = f"""
-###PLOT###
-{json.dumps(plot_info, ensure_ascii=False, indent=2)}
-
-###CHARACTERLIST###
-{json.dumps(character_list, ensure_ascii=False, indent=2)}
 
-###STORYLINE###
-{json.dumps(storyline_info, ensure_ascii=False, indent=2)}
-"""
+            # 构建包含情节、角色和故事概要的模型输入
+            user_input = Dialogue._build_dialogue_input(plot, storyline, characters)
 
             # 调用global_llm的ask方法生成对话
             print(f"正在为情节 '{plot.plot_name}' 生成对话...")
             dialogue_response = global_llm.ask(
                 question=user_input,
-                prompt=dialogue_prompt,
+                prompt=global_llm.setting_dialogue_create,
                 user_id=user_id,
-                opera_id=opera.opera_id,
-                save_history=False
+                opera_id=owned.opera_id,
+                save_history=False,
+                use_cache=use_cache,
+                schema='dialogue_list',
+                task='dialogue'
             )
 
             # 解析LLM返回的JSON格式对话
-            try:
-                dialogue_content = global_llm.analyze_answer(dialogue_response)
-                
-                # 验证对话内容格式
-                if not isinstance(dialogue_content, list):
-                    return ("Generated dialogue content must be a list", 500)
-                
-                # 验证每个对话项的格式
-                for dialogue_item in dialogue_content:
-                    if not isinstance(dialogue_item, dict):
-                        return ("Each dialogue item must be a dictionary", 500)
-                    if "character" not in dialogue_item or "content" not in dialogue_item:
-                        return ("Each dialogue item must contain 'character' and 'content' fields", 500)
-
-            except Exception as e:
-                return (f"Failed to parse generated dialogue: {str(e)}", 500)
+            dialogue_content = Dialogue._parse_dialogue_response(dialogue_response)
+            if isinstance(dialogue_content, tuple):
+                return dialogue_content
 
             # 创建新对话记录
             new_dialogue = Dialogue(
@@ -450,6 +323,262 @@ class Dialogue(db.Model):
             print(f"成功生成并保存对话，包含 {len(dialogue_content)} 条对话内容")
             return new_dialogue  # 成功时返回对话对象
 
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            return (f'Database error: {str(e)}', 500)
+        except (ModelUnavailableError, RateLimitExceeded):
+            raise
+        except Exception as e:
+            return (f'Server error: {str(e)}', 500)
+
+    @staticmethod
+    def stream_dialogue_from_plot_core(user_id, plot_id, use_cache=True):
+        """
+        根据情节ID流式生成对话：模型每生成完一条对话就立即保存到数据库并产出
+
+        第一条对话到达时创建对话记录，之后每条对话追加到该记录中，生成中途出错时已保存的对话会保留。
+
+        参数:
+            user_id: 用户ID
+            plot_id: 情节ID（必填）
+            use_cache: 是否使用模型回答缓存（可选，默认True）
+
+        返回:
+            成功: 生成器，每保存一条对话产出 (对话ID, 对话项)
+            失败: (错误信息, 状态码)（参数或权限校验失败时）
+        """
+        # 运行时导入避免循环导入
+        from sql import Character
+        from sql.ownership import resolve_owned
+        from agent.llm import global_llm
+
+        # 验证必填参数
+        if not plot_id:
+            return ("Missing required field: plot_id", 400)
+
+        # 一次联表查询获取情节、故事概要并验证所有权（情节->故事概要->剧本）
+        owned = resolve_owned('plot', plot_id, user_id)
+        if isinstance(owned, tuple):
+            return owned
+        plot, storyline = owned.plot, owned.storyline
+        storyline_id, opera_id = storyline.storyline_id, owned.opera_id
+
+        characters = Character.query.filter_by(storyline_id=storyline_id).all()
+        user_input = Dialogue._build_dialogue_input(plot, storyline, characters)
+        # 调用模型前结束只读事务，避免在等待模型期间占用数据库连接
+        db.session.rollback()
+
+        def generate():
+            dialogue = None
+            dialogue_content = []
+            for item in global_llm.ask_items_stream(
+                question=user_input,
+                prompt=global_llm.setting_dialogue_create,
+                user_id=user_id,
+                opera_id=opera_id,
+                save_history=False,
+                use_cache=use_cache,
+                schema='dialogue_list',
+                task='dialogue'
+            ):
+                if not isinstance(item, dict) or "character" not in item or "content" not in item:
+                    continue
+                dialogue_content.append(item)
+                try:
+                    if dialogue is None:
+                        dialogue = Dialogue(
+                            user_id=user_id,
+                            storyline_id=storyline_id,
+                            plot_id=plot_id,
+                            dialogue_content=list(dialogue_content)
+                        )
+                        db.session.add(dialogue)
+                    else:
+                        # JSON 字段整体重新赋值才会被识别为已修改
+                        dialogue.dialogue_content = list(dialogue_content)
+                    db.session.commit()
+                except SQLAlchemyError:
+                    db.session.rollback()
+                    raise
+                yield dialogue.dialogue_id, item
+
+        return generate()
+
+    @staticmethod
+    def _build_dialogue_input(plot, storyline, characters):
+        """
+        构建对话生成的模型输入（情节 + 角色列表 + 故事概要）
+
+        参数:
+            plot: 情节对象
+            storyline: 故事概要对象
+            characters: 该故事概要下的角色对象列表
+
+        返回:
+            模型输入字符串
+        """
+        import json
+
+        # 构建角色列表信息
+        character_list = []
+        for char in characters:
+            character_info = {
+                "name": char.character_name,
+                "personality": char.personality or "",
+                "appearance": char.appearance or ""
+            }
+            if char.related:
+                character_info["related"] = char.related
+            character_list.append(character_info)
+
+        # 构建情节信息
+        plot_info = {
+            "plotName": plot.plot_name,
+            "abstract": plot.abstract or "",
+            "character": plot.characters or []
+        }
+
+        # 构建故事概要信息
+        storyline_info = {
+            "theme": storyline.theme or "",
+            "classtype": storyline.classtype or "",
+            "education": storyline.education or "",
+            "level": storyline.level or "",
+            "storyline_name": storyline.storyline_name or "",
+            "storyline_content": storyline.storyline_content or ""
+        }
+
+        return f"""
+###PLOT###
+{json.dumps(plot_info, ensure_ascii=False, indent=2)}
+
+###CHARACTERLIST###
+{json.dumps(character_list, ensure_ascii=False, indent=2)}
+
+###STORYLINE###
+{json.dumps(storyline_info, ensure_ascii=False, indent=2)}
+"""
+
+    @staticmethod
+    def _parse_dialogue_response(dialogue_response):
+        """
+        解析并校验模型返回的对话列表（不含 character / content 字段的对话项被丢弃）
+
+        返回:
+            成功: 对话内容列表
+            失败: (错误信息, 状态码)
+        """
+        from agent.llm import global_llm
+
+        try:
+            dialogue_content = global_llm.parse_items(dialogue_response, 'dialogue_list')
+
+            # 验证对话内容格式
+            if not isinstance(dialogue_content, list):
+                return ("Generated dialogue content must be a list of items with 'character' and 'content' fields", 500)
+
+            return dialogue_content
+
+        except Exception as e:
+            return (f"Failed to parse generated dialogue: {str(e)}", 500)
+
+    @staticmethod
+    def generate_dialogues_for_storyline_core(user_id, storyline_id, concurrency=None, use_cache=True):
+        """
+        为故事概要下的所有情节并发生成对话，并在一个事务中统一保存
+
+        参数:
+            user_id: 用户ID
+            storyline_id: 故事概要ID（必填）
+            concurrency: 同时进行的模型调用数上限（可选，默认读取环境变量 DIALOGUE_GEN_CONCURRENCY）
+            use_cache: 是否使用模型回答缓存（可选，默认True）
+
+        返回:
+            成功: {"storyline": 故事概要对象, "plots": 情节列表,
+                   "generated": [(plot, 对话对象), ...], "failed": [{"plot_id", "error"}, ...]}
+                   （generated 与 plots 顺序一致）
+            失败: (错误信息, 状态码)
+        """
+        try:
+            # 运行时导入避免循环导入
+            from sql import Plot, Character
+            from sql.ownership import resolve_owned
+            from agent.llm import global_llm
+
+            if not storyline_id:
+                return ("Missing required field: storyline_id", 400)
+
+            # 一次联表查询获取故事概要并验证权限
+            owned = resolve_owned('storyline', storyline_id, user_id)
+            if isinstance(owned, tuple):
+                return owned
+            storyline = owned.storyline
+
+            # 获取该故事概要下的所有剧情和角色（只查询一次）
+            plots = Plot.query.filter_by(storyline_id=storyline_id).order_by(Plot.plot_id.asc()).all()
+            if not plots:
+                return {"storyline": storyline, "plots": [], "generated": [], "failed": []}
+            characters = Character.query.filter_by(storyline_id=storyline_id).all()
+
+            if concurrency is None:
+                concurrency = int(os.environ.get('DIALOGUE_GEN_CONCURRENCY', 5))
+            concurrency = max(1, concurrency)
+
+            dialogue_prompt = global_llm.setting_dialogue_create
+            user_inputs = [Dialogue._build_dialogue_input(plot, storyline, characters) for plot in plots]
+
+            async def generate_all():
+                # 单个请求内的并发上限，防止一个故事占满进程级信号量
+                semaphore = asyncio.Semaphore(concurrency)
+
+                async def generate_one(user_input):
+                    async with semaphore:
+                        return await global_llm.achat(user_input, dialogue_prompt, use_cache,
+                                                      schema='dialogue_list', task='dialogue', user_id=user_id)
+
+                return await asyncio.gather(
+                    *[generate_one(user_input) for user_input in user_inputs],
+                    return_exceptions=True
+                )
+
+            print(f"正在为 {len(plots)} 个情节并发生成对话（并发上限 {concurrency}）...")
+            responses = global_llm.run_async(generate_all())
+
+            # gather 保证结果顺序与 plots 一致
+            generated = []
+            failed = []
+            for plot, response in zip(plots, responses):
+                if isinstance(response, Exception):
+                    failed.append({"plot_id": plot.plot_id, "error": str(response)})
+                    continue
+
+                dialogue_content = Dialogue._parse_dialogue_response(response)
+                if isinstance(dialogue_content, tuple):
+                    failed.append({"plot_id": plot.plot_id, "error": dialogue_content[0]})
+                    continue
+
+                generated.append((plot, Dialogue(
+                    user_id=user_id,
+                    storyline_id=storyline_id,
+                    plot_id=plot.plot_id,
+                    dialogue_content=dialogue_content
+                )))
+
+            # 一条对话都没有生成且原因是模型不可用或限流时，抛出第一个这样的异常，由接口层返回 503 / 429
+            if not generated:
+                for response in responses:
+                    if isinstance(response, (ModelUnavailableError, RateLimitExceeded)):
+                        raise response
+
+            # 所有对话在一个事务中提交
+            if generated:
+                db.session.add_all([dialogue for _, dialogue in generated])
+                db.session.commit()
+
+            return {"storyline": storyline, "plots": plots, "generated": generated, "failed": failed}
+
+        except (ModelUnavailableError, RateLimitExceeded):
+            raise
         except SQLAlchemyError as e:
             db.session.rollback()
             return (f'Database error: {str(e)}', 500)
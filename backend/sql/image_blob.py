@@ -0,0 +1,96 @@
+from sqlalchemy import inspect, text
+from sql import db
+from sql.user_db import User
+from sql.opera_db import Opera
+from utils.blob_store import blob_store
+from utils.image_response import image_bytes_from_column, sniff_image_type
+
+# 保存在图片存储中的实体图片：(模型, URL 字段, 旧版行内二进制字段)
+IMAGE_COLUMNS = [
+    (User, 'user_image_url', 'user_image'),
+    (Opera, 'opera_image_url', 'opera_image'),
+]
+
+
+def store_image(value):
+    """
+    将请求中的图片（base64 字符串，可带 dataURL 前缀）保存到图片存储
+
+    返回:
+        (True, 图片 URL) 或 (False, 错误信息)
+    """
+    data = image_bytes_from_column(value)
+    if not data:
+        return (False, 'Invalid image data')
+    return blob_store.put_bytes(data, sniff_image_type(data))
+
+
+def image_url_for(entity, url_attr, blob_attr):
+    """
+    获取实体图片的 URL；旧数据仍保存在行内二进制字段时，先迁移到图片存储再返回
+
+    参数:
+        entity: User / Opera 对象
+        url_attr: URL 字段名
+        blob_attr: 旧版二进制字段名（延迟加载，只有 URL 为空时才会读取）
+
+    返回:
+        图片 URL，没有图片时返回 None；迁移失败时抛出 RuntimeError
+    """
+    url = getattr(entity, url_attr)
+    if url:
+        return url
+    if getattr(entity, blob_attr) is None:
+        return None
+
+    _migrate_entity(entity, url_attr, blob_attr)
+    db.session.commit()
+    return getattr(entity, url_attr)
+
+
+def _migrate_entity(entity, url_attr, blob_attr):
+    """
+    把一个实体的行内图片写入图片存储并清空行内字段（不提交事务）
+    """
+    data = image_bytes_from_column(getattr(entity, blob_attr))
+    if data:
+        ok, url_or_err = blob_store.put_bytes(data, sniff_image_type(data))
+        if not ok:
+            raise RuntimeError(url_or_err)
+        setattr(entity, url_attr, url_or_err)
+    setattr(entity, blob_attr, None)
+
+
+def ensure_image_url_columns():
+    """
+    为已有数据库补充 user_image_url / opera_image_url 字段（create_all 不会修改已存在的表，可重复执行）
+    """
+    inspector = inspect(db.engine)
+    quote = db.engine.dialect.identifier_preparer.quote
+    with db.engine.begin() as conn:
+        for model, url_attr, _ in IMAGE_COLUMNS:
+            table = model.__tablename__
+            columns = {column['name'] for column in inspector.get_columns(table)}
+            if url_attr not in columns:
+                conn.execute(text(f"ALTER TABLE {quote(table)} ADD COLUMN {quote(url_attr)} VARCHAR(500)"))
+
+
+def migrate_all_image_blobs(batch_size=50):
+    """
+    将所有仍保存在行内的用户头像和剧本封面迁移到图片存储（需要在应用上下文中调用）
+
+    返回:
+        迁移的记录数量
+    """
+    migrated = 0
+    for model, url_attr, blob_attr in IMAGE_COLUMNS:
+        while True:
+            rows = model.query.filter(getattr(model, blob_attr).isnot(None)).limit(batch_size).all()
+            if not rows:
+                break
+            for row in rows:
+                # 迁移后行内字段置为 NULL，下一批不会再查到
+                _migrate_entity(row, url_attr, blob_attr)
+            db.session.commit()
+            migrated += len(rows)
+    return migrated
@@ -0,0 +1,139 @@
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy import DateTime
+from datetime import datetime
+import uuid
+from sql import db
+
+
+class Job(db.Model):
+    __tablename__ = 'job'
+
+    # 任务状态
+    PENDING = 'pending'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+
+    job_id = db.Column(db.String(32), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.user_id'), nullable=False)
+    job_type = db.Column(db.String(100), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default=PENDING, index=True)
+    params = db.Column(db.JSON)
+    # 任务结果：与同步接口相同的响应体及状态码
+    result = db.Column(db.JSON)
+    status_code = db.Column(db.Integer)
+    error = db.Column(db.Text)
+    created_at = db.Column(DateTime, default=datetime.utcnow, nullable=False)
+    updated_at = db.Column(DateTime, default=datetime.utcnow, nullable=False)
+
+    def __repr__(self):
+        return f"<Job {self.job_id} {self.job_type} {self.status}>"
+
+    def to_dict(self):
+        return {
+            'job_id': self.job_id,
+            'job_type': self.job_type,
+            'status': self.status,
+            'status_code': self.status_code,
+            'result': self.result,
+            'error': self.error,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
+
+    @staticmethod
+    def create_job_core(user_id, job_type, params):
+        """
+        创建一条待执行的任务记录
+
+        参数:
+            user_id: 提交任务的用户ID
+            job_type: 任务类型（对应已注册的任务处理函数）
+            params: 任务参数（JSON）
+
+        返回:
+            成功: 新创建的任务对象
+            失败: (错误信息, 状态码)
+        """
+        try:
+            job = Job(
+                job_id=uuid.uuid4().hex,
+                user_id=user_id,
+                job_type=job_type,
+                status=Job.PENDING,
+                params=params or {}
+            )
+            db.session.add(job)
+            db.session.commit()
+            return job
+
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            return (f'Database error: {str(e)}', 500)
+        except Exception as e:
+            return (f'Server error: {str(e)}', 500)
+
+    @staticmethod
+    def get_job_core(user_id, job_id):
+        """
+        获取任务状态，并验证权限
+
+        返回:
+            成功: 任务对象
+            失败: (错误信息, 状态码)
+        """
+        try:
+            job = Job.query.get(job_id)
+            if not job:
+                return ("Job not found", 404)
+            if job.user_id != user_id:
+                return ("Permission denied: You do not own this job", 403)
+            return job
+
+        except SQLAlchemyError as e:
+            return (f'Database error: {str(e)}', 500)
+        except Exception as e:
+            return (f'Server error: {str(e)}', 500)
+
+    @staticmethod
+    def get_active_jobs(user_id, job_type, since):
+        """
+        用户某类型在 since 之后创建、尚未结束（pending / running）的任务
+        """
+        return Job.query.filter(
+            Job.user_id == user_id,
+            Job.job_type == job_type,
+            Job.status.in_([Job.PENDING, Job.RUNNING]),
+            Job.created_at >= since
+        ).all()
+
+    @staticmethod
+    def claim_job(job_id):
+        """
+        将 pending 状态的任务原子地标记为 running，多个执行者同时认领时只有一个成功
+
+        返回:
+            认领成功返回 True，否则 False
+        """
+        claimed = Job.query.filter_by(job_id=job_id, status=Job.PENDING).update(
+            {'status': Job.RUNNING, 'updated_at': datetime.utcnow()},
+            synchronize_session=False
+        )
+        db.session.commit()
+        return claimed == 1
+
+    @staticmethod
+    def finish_job(job_id, result=None, status_code=None, error=None):
+        """
+        记录任务执行结果；status_code 为 2xx 视为成功
+        """
+        job = Job.query.get(job_id)
+        if not job:
+            return
+        succeeded = error is None and status_code is not None and 200 <= status_code < 300
+        job.status = Job.SUCCEEDED if succeeded else Job.FAILED
+        job.result = result
+        job.status_code = status_code
+        job.error = error
+        job.updated_at = datetime.utcnow()
+        db.session.commit()
@@ -1,4 +1,4 @@
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import relationship, deferred
 from sqlalchemy.types import Date
 from sql import db
 
@@ -8,7 +8,10 @@ class Opera(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey('user.user_id'), nullable=False)
     opera_name = db.Column(db.String(50), nullable=False)
     create_time = db.Column(Date, nullable=False)
-    opera_image = db.Column(db.LargeBinary, nullable=True)
+    # 封面图片在图片存储中的 URL
+    opera_image_url = db.Column(db.String(500), nullable=True)
+    # 旧版直接保存在行内的封面图片：延迟加载，查询剧本时不再读取，只用于迁移旧数据
+    opera_image = deferred(db.Column(db.LargeBinary, nullable=True))
 
     # 关系：每个剧本属于一个用户
     user = relationship('User', backref='operas')
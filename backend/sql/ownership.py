@@ -0,0 +1,153 @@
+from sql import db
+
+# 实体名称 -> 错误信息中使用的名称
+_LABELS = {
+    'opera': 'opera',
+    'storyline': 'storyline',
+    'character': 'character',
+    'character_image': 'character image',
+    'plot': 'plot',
+    'scene': 'scene',
+    'scene_image': 'scene image',
+    'dialogue': 'dialogue',
+}
+
+_chains = None
+
+
+def _get_chains():
+    """
+    各实体到剧本（Opera）的关联链：[(实体名称, 模型, 指向下一环的外键字段), ...]
+
+    下一环模型的主键字段与该外键同名，最后一环通过 opera_id 关联到 Opera
+    """
+    global _chains
+    if _chains is None:
+        # 运行时导入避免循环导入
+        from sql import Storyline, Character, CharacterImage, Plot, Scene, SceneImage, Dialogue
+
+        storyline = ('storyline', Storyline, 'opera_id')
+        character = ('character', Character, 'storyline_id')
+        plot = ('plot', Plot, 'storyline_id')
+        scene = ('scene', Scene, 'plot_id')
+        _chains = {
+            'opera': [],
+            'storyline': [storyline],
+            'character': [character, storyline],
+            'character_image': [('character_image', CharacterImage, 'character_id'), character, storyline],
+            'plot': [plot, storyline],
+            'scene': [scene, plot, storyline],
+            'scene_image': [('scene_image', SceneImage, 'scene_id'), scene, plot, storyline],
+            'dialogue': [('dialogue', Dialogue, 'storyline_id'), storyline],
+        }
+    return _chains
+
+
+class Ownership(object):
+    """
+    所有权解析结果
+
+    关联链上的每个对象都可以按实体名称访问，例如解析 scene_image 后可使用
+    result.scene_image / result.scene / result.plot / result.storyline；
+    opera_id 为所属剧本ID，entity 为被解析的实体本身。
+    """
+
+    def __init__(self, kind, objects, opera_id):
+        self.kind = kind
+        self.opera_id = opera_id
+        for name, obj in objects.items():
+            setattr(self, name, obj)
+
+    @property
+    def entity(self):
+        return getattr(self, self.kind)
+
+
+def _build_query(kind):
+    from sql import Opera
+
+    chain = _get_chains()[kind]
+    if not chain:
+        return db.session.query(Opera, Opera.opera_id, Opera.user_id), Opera.opera_id
+
+    models = [model for _, model, _ in chain]
+    query = db.session.query(*models, Opera.opera_id, Opera.user_id).select_from(models[0])
+    for (_, model, fk), (_, next_model, _) in zip(chain, chain[1:]):
+        query = query.outerjoin(next_model, getattr(model, fk) == getattr(next_model, fk))
+    last_model = models[-1]
+    query = query.outerjoin(Opera, last_model.opera_id == Opera.opera_id)
+    pk = models[0].__mapper__.primary_key[0]
+    return query, pk
+
+
+def _check_row(kind, row, user_id):
+    label = _LABELS[kind]
+    names = [name for name, _, _ in _get_chains()[kind]] or ['opera']
+    objects = dict(zip(names, row[:-2]))
+    opera_id, owner_id = row[-2], row[-1]
+
+    # 关联链断开时，报告第一个缺失的上级实体
+    for name in names[1:]:
+        if objects[name] is None:
+            return (f"{_LABELS[name].capitalize()} not found", 404)
+    if owner_id is None or owner_id != user_id:
+        return (f"Permission denied: You do not own this {label}", 403)
+    return Ownership(kind, objects, opera_id)
+
+
+def resolve_owned(kind, entity_id, user_id):
+    """
+    用一次联表查询解析实体及其所属剧本，并验证当前用户是否为剧本所有者
+
+    参数:
+        kind: 实体名称（opera/storyline/character/character_image/plot/scene/scene_image/dialogue）
+        entity_id: 实体ID
+        user_id: 当前用户ID
+
+    返回:
+        成功: Ownership 对象
+        失败: (错误信息, 状态码)
+    """
+    # 运行时导入避免循环导入
+    from sql.request_cache import remember
+
+    label = _LABELS[kind]
+    if not entity_id:
+        return (f"Missing required field: {kind}_id", 400)
+
+    def load():
+        query, pk = _build_query(kind)
+        row = query.filter(pk == entity_id).first()
+        if row is None:
+            return (f"{label.capitalize()} not found", 404)
+        return _check_row(kind, row, user_id)
+
+    # 同一请求内（如路由与 *_core 方法）重复解析同一实体时只查询一次
+    return remember(('ownership', kind, entity_id, user_id), load)
+
+
+def check_owned_ids(kind, entity_ids, user_id, allow_missing=True):
+    """
+    用一次联表查询验证一组实体都属于当前用户
+
+    参数:
+        allow_missing: 为 True 时不存在的ID被忽略（如批量删除）；为 False 时任一ID不存在即返回 404（如批量创建下级实体）
+
+    返回:
+        成功: True
+        失败: (错误信息, 状态码)
+    """
+    if not entity_ids:
+        return True
+
+    requested = set(entity_ids)
+    query, pk = _build_query(kind)
+    found = set()
+    for row in query.filter(pk.in_(list(requested))).all():
+        result = _check_row(kind, row, user_id)
+        if isinstance(result, tuple):
+            return result
+        found.add(getattr(row[0], pk.key))
+    if not allow_missing and found != requested:
+        return (f"{_LABELS[kind].capitalize()} not found", 404)
+    return True
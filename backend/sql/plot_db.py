@@ -44,38 +44,27 @@ class Plot(db.Model):
         """
         try:
             # 运行时导入避免循环导入
-            from sql import User, Storyline, Opera
+            from sql.ownership import resolve_owned
             
             # 处理character默认值
             if characters is None:
                 characters = []
 
-            # 验证用户是否存在
-            user = User.query.get(user_id)
-            if not user:
-                return ("User not found", 404)
-
             # 验证必填参数
             if not storyline_id:
                 return ("Missing required field: storyline_id", 400)
             if not plot_name:
                 return ("Missing required field: plot_name", 400)
 
-            # 验证故事概要是否存在
-            storyline = Storyline.query.get(storyline_id)
-            if not storyline:
-                return ("Storyline not found", 404)
-
-            # 验证所有权（通过故事概要关联的剧本）
-            opera = Opera.query.get(storyline.opera_id)
-            if not opera or opera.user_id != user_id:
-                return ("Permission denied: You do not own this storyline", 403)
+            # 一次联表查询验证故事概要是否存在及所有权（故事概要 -> 剧本）
+            owned = resolve_owned('storyline', storyline_id, user_id)
+            if isinstance(owned, tuple):
+                return owned
 
             # 字段长度校验
-            if len(plot_name) > 50:
-                return ("Plot name must be less than 50 characters", 400)
-            if len(abstract) > 200:
-                return ("Abstract must be less than 200 characters", 400)
+            error = Plot._validate_fields(plot_name, abstract)
+            if error:
+                return error
 
             # 创建新剧情大纲
             new_plot = Plot(
@@ -98,6 +87,86 @@ class Plot(db.Model):
         except Exception as e:
             return (f'Server error: {str(e)}', 500)
 
+    @staticmethod
+    def _validate_fields(plot_name, abstract):
+        """
+        字段长度校验
+
+        返回:
+            通过: None
+            失败: (错误信息, 状态码)
+        """
+        if len(plot_name) > 50:
+            return ("Plot name must be less than 50 characters", 400)
+        if len(abstract) > 200:
+            return ("Abstract must be less than 200 characters", 400)
+        return None
+
+    @staticmethod
+    # 核心业务逻辑函数：批量创建剧情大纲
+    def create_plots_bulk_core(user_id, storyline_id, plots, commit=True):
+        """
+        在一个事务中批量创建同一故事概要下的剧情大纲（用于生成结果入库）
+
+        故事概要的所有权只验证一次；逐条做必填和长度校验，不合格的条目记入 failed，其余一次性插入。
+
+        参数:
+            user_id: 用户ID
+            storyline_id: 关联的故事概要ID（必填）
+            plots: 剧情列表 [{"plot_name", "abstract", "characters"}, ...]
+            commit: 是否提交事务（为 False 时只 flush 以获得剧情ID，由调用方统一提交）
+
+        返回:
+            成功: {"created": [(输入序号, 剧情对象), ...], "failed": [{"plot_name", "error"}, ...]}
+            失败: (错误信息, 状态码)
+        """
+        try:
+            # 运行时导入避免循环导入
+            from sql.ownership import resolve_owned
+
+            if not storyline_id:
+                return ("Missing required field: storyline_id", 400)
+
+            # 一次联表查询验证故事概要是否存在及所有权（故事概要 -> 剧本）
+            owned = resolve_owned('storyline', storyline_id, user_id)
+            if isinstance(owned, tuple):
+                return owned
+
+            created = []
+            failed = []
+            for idx, item in enumerate(plots):
+                plot_name = item.get("plot_name")
+                abstract = item.get("abstract") or ""
+                if not plot_name:
+                    failed.append({"plot_name": plot_name, "error": "Missing required field: plot_name"})
+                    continue
+                error = Plot._validate_fields(plot_name, abstract)
+                if error:
+                    failed.append({"plot_name": plot_name, "error": error[0]})
+                    continue
+                created.append((idx, Plot(
+                    user_id=user_id,
+                    storyline_id=storyline_id,
+                    plot_name=plot_name,
+                    abstract=abstract,
+                    characters=item.get("characters") or []
+                )))
+
+            if created:
+                db.session.add_all([plot for _, plot in created])
+                db.session.flush()
+            if commit:
+                db.session.commit()
+
+            return {"created": created, "failed": failed}
+
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            return (f'Database error: {str(e)}', 500)
+        except Exception as e:
+            db.session.rollback()
+            return (f'Server error: {str(e)}', 500)
+
     @staticmethod
     def get_plots_by_storyline(user_id, storyline_id):
         """
@@ -113,26 +182,16 @@ class Plot(db.Model):
         """
         try:
             # 运行时导入避免循环导入
-            from sql import User, Storyline, Opera
-            
-            # 验证用户是否存在
-            user = User.query.get(user_id)
-            if not user:
-                return ("User not found", 404)
-                
+            from sql.ownership import resolve_owned
+
             # 验证必填参数
             if not storyline_id:
                 return ("Missing required field: storyline_id", 400)
                 
-            # 验证故事概要是否存在
-            storyline = Storyline.query.get(storyline_id)
-            if not storyline:
-                return ("Storyline not found", 404)
-                
-            # 验证所有权（通过故事概要关联的剧本）
-            opera = Opera.query.get(storyline.opera_id)
-            if not opera or opera.user_id != user_id:
-                return ("Permission denied: You do not own this storyline", 403)
+            # 一次联表查询验证故事概要是否存在及所有权（故事概要 -> 剧本）
+            owned = resolve_owned('storyline', storyline_id, user_id)
+            if isinstance(owned, tuple):
+                return owned
                 
             # 查询该storyline下的所有剧情大纲
             plots = Plot.query.filter_by(storyline_id=storyline_id).order_by(Plot.plot_id.asc()).all()
@@ -175,25 +234,17 @@ class Plot(db.Model):
         """
         try:
             # 运行时导入避免循环导入
-            from sql import User, Storyline, Opera
-            
-            # 验证用户是否存在
-            user = User.query.get(user_id)
-            if not user:
-                return ("User not found", 404)
-                
+            from sql.ownership import resolve_owned
+
             # 验证必填参数
             if not plot_id:
                 return ("Missing required field: plot_id", 400)
                 
-            # 查询指定的剧情大纲
-            plot = Plot.query.get(plot_id)
-            if not plot:
-                return ("Plot not found", 404)
-                
-            # 验证所有权（直接检查plot的user_id）
-            if plot.user_id != user_id:
-                return ("Permission denied: You do not own this plot", 403)
+            # 一次联表查询获取剧情大纲并验证所有权（剧情 -> 故事概要 -> 剧本）
+            owned = resolve_owned('plot', plot_id, user_id)
+            if isinstance(owned, tuple):
+                return owned
+            plot = owned.plot
                 
             # 字段长度校验
             if plot_name is not None:
@@ -239,25 +290,16 @@ class Plot(db.Model):
             失败: (False, 错误信息)
         """
         try:
-            from sql import User, Storyline, Opera
-            # 验证用户是否存在
-            user = User.query.get(user_id)
-            if not user:
-                return (False, "User not found")
+            from sql.ownership import resolve_owned
 
             # 验证必填参数
             if not storyline_id:
                 return (False, "Missing required field: storyline_id")
 
-            # 验证故事概要是否存在
-            storyline = Storyline.query.get(storyline_id)
-            if not storyline:
-                return (False, "Storyline not found")
-
-            # 验证所有权
-            opera = Opera.query.get(storyline.opera_id)
-            if not opera or opera.user_id != user_id:
-                return (False, "Permission denied: You do not own this storyline")
+            # 一次联表查询验证故事概要是否存在及所有权
+            owned = resolve_owned('storyline', storyline_id, user_id)
+            if isinstance(owned, tuple):
+                return (False, owned[0])
 
             # 找到所有相关的 plot_id
             plots_to_delete = Plot.query.filter_by(storyline_id=storyline_id).all()
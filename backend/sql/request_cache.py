@@ -0,0 +1,110 @@
+import os
+from flask import g, has_app_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sql import db
+
+# 在响应头中返回本次请求的 SQL 语句数（便于压测时确认查询次数）
+QUERY_COUNT_HEADER = os.environ.get('DB_QUERY_COUNT_HEADER', '0') == '1'
+
+
+def _cache():
+    """
+    当前应用上下文（每个请求 / 每个后台任务各自一个）内的实体缓存；不在上下文中时返回 None
+    """
+    if not has_app_context():
+        return None
+    cache = getattr(g, '_entity_cache', None)
+    if cache is None:
+        cache = g._entity_cache = {}
+    return cache
+
+
+def get_cached(model, entity_id):
+    """
+    按主键获取实体，同一请求内重复获取同一实体只查询一次数据库
+
+    参数:
+        model: 模型类
+        entity_id: 主键值
+
+    返回:
+        实体对象，不存在时返回 None（不存在的结果同样会被缓存）
+    """
+    cache = _cache()
+    if cache is None:
+        return model.query.get(entity_id)
+
+    key = (model.__name__, entity_id)
+    if key not in cache:
+        cache[key] = model.query.get(entity_id)
+    return cache[key]
+
+
+def get_current_user(user_id):
+    """
+    获取当前登录用户（请求内缓存）
+    """
+    from sql import User
+    return get_cached(User, user_id)
+
+
+def remember(key, loader):
+    """
+    缓存任意请求内可复用的查询结果，例如所有权解析结果
+
+    参数:
+        key: 缓存键（可哈希）
+        loader: 缓存未命中时调用的无参函数
+
+    返回:
+        loader 的返回值
+    """
+    cache = _cache()
+    if cache is None:
+        return loader()
+
+    if key not in cache:
+        cache[key] = loader()
+    return cache[key]
+
+
+def clear_request_cache():
+    cache = _cache()
+    if cache:
+        cache.clear()
+
+
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    if has_app_context():
+        g._db_query_count = getattr(g, '_db_query_count', 0) + 1
+
+
+def _after_flush(session, flush_context):
+    # 有实体被删除时清空请求缓存，避免后续读到已删除的对象
+    if session.deleted:
+        clear_request_cache()
+
+
+def _after_rollback(session, previous_transaction):
+    clear_request_cache()
+
+
+def init_request_cache(app):
+    """
+    注册 SQL 计数与缓存失效的事件监听，并在每个请求结束时记录本次请求的查询次数
+    """
+    from utils.metrics import metrics
+
+    event.listen(Engine, 'before_cursor_execute', _count_query)
+    event.listen(db.session, 'after_flush', _after_flush)
+    event.listen(db.session, 'after_soft_rollback', _after_rollback)
+
+    @app.after_request
+    def record_query_count(response):
+        count = getattr(g, '_db_query_count', 0)
+        metrics.incr('db.requests')
+        metrics.observe('db.queries_per_request', count)
+        if QUERY_COUNT_HEADER:
+            response.headers['X-DB-Query-Count'] = str(count)
+        return response
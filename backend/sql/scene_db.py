@@ -41,43 +41,27 @@ class Scene(db.Model):
         """
         try:
             # 运行时导入避免循环导入
-            from sql import User, Plot, Storyline, Opera
+            from sql.ownership import resolve_owned
 
             # 默认值
             if scene_object is None:
                 scene_object = {}
 
-            # 校验用户
-            user = User.query.get(user_id)
-            if not user:
-                return ("User not found", 404)
-
             # 校验必填
             if not plot_id:
                 return ("Missing required field: plot_id", 400)
             if not scene_name:
                 return ("Missing required field: scene_name", 400)
 
-            # 校验关联与权限
-            plot = Plot.query.get(plot_id)
-            if not plot:
-                return ("Plot not found", 404)
-
-            storyline = Storyline.query.get(plot.storyline_id)
-            if not storyline:
-                return ("Storyline not found", 404)
-
-            opera = Opera.query.get(storyline.opera_id)
-            if not opera or opera.user_id != user_id:
-                return ("Permission denied: You do not own this plot", 403)
+            # 一次联表查询校验关联与权限（剧情 -> 故事概要 -> 剧本）
+            owned = resolve_owned('plot', plot_id, user_id)
+            if isinstance(owned, tuple):
+                return owned
 
             # 字段长度校验
-            if len(scene_name) > 255:
-                return ("Scene name must be less than 255 characters", 400)
-            if scene_content is not None and len(scene_content) > 500:
-                return ("Scene content must be less than 500 characters", 400)
-            if location is not None and len(location) > 255:
-                return ("Location must be less than 255 characters", 400)
+            error = Scene._validate_fields(scene_name, scene_content, location)
+            if error:
+                return error
 
             new_scene = Scene(
                 user_id=user_id,
@@ -100,6 +84,89 @@ class Scene(db.Model):
             db.session.rollback()
             return (f'Server error: {str(e)}', 500)
 
+    @staticmethod
+    def _validate_fields(scene_name, scene_content, location):
+        """
+        字段长度校验
+
+        返回:
+            通过: None
+            失败: (错误信息, 状态码)
+        """
+        if len(scene_name) > 255:
+            return ("Scene name must be less than 255 characters", 400)
+        if scene_content is not None and len(scene_content) > 500:
+            return ("Scene content must be less than 500 characters", 400)
+        if location is not None and len(location) > 255:
+            return ("Location must be less than 255 characters", 400)
+        return None
+
+    @staticmethod
+    def create_scenes_bulk_core(user_id, scenes, commit=True):
+        """
+        在一个事务中批量创建场景（用于生成结果入库）
+
+        所有涉及的剧情用一次联表查询验证所有权；逐条做必填和长度校验，不合格的条目记入 failed，其余一次性插入。
+
+        参数:
+            user_id: 用户ID
+            scenes: 场景列表 [{"plot_id", "scene_name", "scene_content", "scene_object", "location"}, ...]
+            commit: 是否提交事务（为 False 时只 flush，由调用方统一提交）
+
+        返回:
+            成功: {"created": [Scene 对象, ...], "failed": [{"scene_name", "error"}, ...]}
+            失败: (错误信息, 状态码)
+        """
+        try:
+            # 运行时导入避免循环导入
+            from sql.ownership import check_owned_ids
+
+            # 一次联表查询校验所有剧情都存在且属于当前用户（剧情 -> 故事概要 -> 剧本）
+            plot_ids = {item.get("plot_id") for item in scenes if item.get("plot_id")}
+            owned = check_owned_ids('plot', plot_ids, user_id, allow_missing=False)
+            if isinstance(owned, tuple):
+                return owned
+
+            created = []
+            failed = []
+            for item in scenes:
+                scene_name = item.get("scene_name")
+                scene_content = item.get("scene_content", "")
+                location = item.get("location", "")
+                if not item.get("plot_id"):
+                    failed.append({"scene_name": scene_name, "error": "Missing required field: plot_id"})
+                    continue
+                if not scene_name:
+                    failed.append({"scene_name": scene_name, "error": "Missing required field: scene_name"})
+                    continue
+                error = Scene._validate_fields(scene_name, scene_content, location)
+                if error:
+                    failed.append({"scene_name": scene_name, "error": error[0]})
+                    continue
+                created.append(Scene(
+                    user_id=user_id,
+                    plot_id=item["plot_id"],
+                    scene_name=scene_name,
+                    scene_content=scene_content,
+                    scene_object=item.get("scene_object") or {},
+                    location=location
+                ))
+
+            if created:
+                db.session.add_all(created)
+                db.session.flush()
+            if commit:
+                db.session.commit()
+
+            return {"created": created, "failed": failed}
+
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            return (f'Database error: {str(e)}', 500)
+        except Exception as e:
+            db.session.rollback()
+            return (f'Server error: {str(e)}', 500)
+
     @staticmethod
     def update_scene_core(
         user_id,
@@ -122,30 +189,16 @@ class Scene(db.Model):
             失败: (错误信息, 状态码)
         """
         try:
-            from sql import User, Plot, Storyline, Opera
-
-            user = User.query.get(user_id)
-            if not user:
-                return ("User not found", 404)
+            from sql.ownership import resolve_owned
 
             if not scene_id:
                 return ("Missing required field: scene_id", 400)
 
-            scene = Scene.query.get(scene_id)
-            if not scene:
-                return ("Scene not found", 404)
-
-            # 权限校验（通过剧情链或直接比较所有者）
-            if scene.user_id != user_id:
-                plot = Plot.query.get(scene.plot_id)
-                if not plot:
-                    return ("Plot not found", 404)
-                storyline = Storyline.query.get(plot.storyline_id)
-                if not storyline:
-                    return ("Storyline not found", 404)
-                opera = Opera.query.get(storyline.opera_id)
-                if not opera or opera.user_id != user_id:
-                    return ("Permission denied: You do not own this scene", 403)
+            # 一次联表查询获取场景并校验权限（场景 -> 剧情 -> 故事概要 -> 剧本）
+            owned = resolve_owned('scene', scene_id, user_id)
+            if isinstance(owned, tuple):
+                return owned
+            scene = owned.scene
 
             # 校验长度
             if scene_name is not None:
@@ -192,31 +245,17 @@ class Scene(db.Model):
             失败: (错误信息, 状态码)
         """
         try:
-            from sql import User, Plot, Storyline, Opera
+            from sql.ownership import resolve_owned
             from sql.scene_image_db import SceneImage
 
             if not scene_id:
                 return ("Missing required field: scene_id", 400)
 
-            user = User.query.get(user_id)
-            if not user:
-                return ("User not found", 404)
-
-            scene = Scene.query.get(scene_id)
-            if not scene:
-                return ("Scene not found", 404)
-
-            # 权限校验
-            if scene.user_id != user_id:
-                plot = Plot.query.get(scene.plot_id)
-                if not plot:
-                    return ("Plot not found", 404)
-                storyline = Storyline.query.get(plot.storyline_id)
-                if not storyline:
-                    return ("Storyline not found", 404)
-                opera = Opera.query.get(storyline.opera_id)
-                if not opera or opera.user_id != user_id:
-                    return ("Permission denied: You do not own this scene", 403)
+            # 一次联表查询获取场景并校验权限（场景 -> 剧情 -> 故事概要 -> 剧本）
+            owned = resolve_owned('scene', scene_id, user_id)
+            if isinstance(owned, tuple):
+                return owned
+            scene = owned.scene
 
             deleted_scene = scene
 
@@ -252,27 +291,16 @@ class Scene(db.Model):
             失败: (错误信息, 状态码)
         """
         try:
-            from sql import User, Plot, Storyline, Opera
+            from sql.ownership import resolve_owned
 
             # 校验入参
             if not plot_id:
                 return ("Missing required field: plot_id", 400)
 
-            # 用户存在性
-            user = User.query.get(user_id)
-            if not user:
-                return ("User not found", 404)
-
-            # 权限链路
-            plot = Plot.query.get(plot_id)
-            if not plot:
-                return ("Plot not found", 404)
-            storyline = Storyline.query.get(plot.storyline_id)
-            if not storyline:
-                return ("Storyline not found", 404)
-            opera = Opera.query.get(storyline.opera_id)
-            if not opera or opera.user_id != user_id:
-                return ("Permission denied: You do not own this plot", 403)
+            # 一次联表查询校验权限链路（剧情 -> 故事概要 -> 剧本）
+            owned = resolve_owned('plot', plot_id, user_id)
+            if isinstance(owned, tuple):
+                return owned
 
             # 查询场景
             scenes = Scene.query.filter_by(plot_id=plot_id).order_by(Scene.scene_id.asc()).all()
@@ -309,30 +337,16 @@ class Scene(db.Model):
             失败: (错误信息, 状态码)
         """
         try:
-            from sql import User, Plot, Storyline, Opera
+            from sql.ownership import resolve_owned
 
             if not scene_id:
                 return ("Missing required field: scene_id", 400)
 
-            user = User.query.get(user_id)
-            if not user:
-                return ("User not found", 404)
-
-            scene = Scene.query.get(scene_id)
-            if not scene:
-                return ("Scene not found", 404)
-
-            # 权限校验（链路）
-            if scene.user_id != user_id:
-                plot = Plot.query.get(scene.plot_id)
-                if not plot:
-                    return ("Plot not found", 404)
-                storyline = Storyline.query.get(plot.storyline_id)
-                if not storyline:
-                    return ("Storyline not found", 404)
-                opera = Opera.query.get(storyline.opera_id)
-                if not opera or opera.user_id != user_id:
-                    return ("Permission denied: You do not own this scene", 403)
+            # 一次联表查询获取场景并校验权限（场景 -> 剧情 -> 故事概要 -> 剧本）
+            owned = resolve_owned('scene', scene_id, user_id)
+            if isinstance(owned, tuple):
+                return owned
+            scene = owned.scene
 
             return scene
 
@@ -355,23 +369,17 @@ class Scene(db.Model):
             失败: (False, 错误信息)
         """
         try:
-            from sql import User, Plot, Storyline, Opera
+            from sql.ownership import check_owned_ids
             from sql.scene_image_db import SceneImage
-            
-            # 验证用户是否存在
-            user = User.query.get(user_id)
-            if not user:
-                return (False, "User not found")
 
             # 验证必填参数
             if not plot_ids:
                 return (True, "No plot_ids provided")
 
-            # 验证所有权
-            plots = Plot.query.filter(Plot.plot_id.in_(plot_ids)).all()
-            for plot in plots:
-                if plot.user_id != user_id:
-                    return (False, f"Permission denied: You do not own plot {plot.plot_id}")
+            # 一次联表查询验证所有剧情的所有权
+            owned = check_owned_ids('plot', plot_ids, user_id)
+            if isinstance(owned, tuple):
+                return (False, owned[0])
 
             # 找到所有相关的 scene_id
             scenes_to_delete = Scene.query.filter(Scene.plot_id.in_(plot_ids)).all()
@@ -1,12 +1,7 @@
 from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.orm import relationship
-import requests
-import base64
-import os
-import uuid
-import time
 
-from sql import db, User, Scene
+from sql import db
 
 class SceneImage(db.Model):
     __tablename__ = 'scene_image'
@@ -49,34 +44,16 @@ class SceneImage(db.Model):
         """
         try:
             # 运行时导入避免循环导入
-            from sql import Plot, Storyline, Opera
-            
-            # 验证用户是否存在
-            user = User.query.get(user_id)
-            if not user:
-                return ("User not found", 404)
+            from sql.ownership import resolve_owned
 
             # 验证必填参数
             if not scene_id:
                 return ("Missing required field: scene_id", 400)
 
-            # 验证场景是否存在
-            scene = Scene.query.get(scene_id)
-            if not scene:
-                return ("Scene not found", 404)
-
-            # 验证所有权（通过场景->情节->故事概要->剧本的关联链验证）
-            plot = Plot.query.get(scene.plot_id)
-            if not plot:
-                return ("Plot not found", 404)
-                
-            storyline = Storyline.query.get(plot.storyline_id)
-            if not storyline:
-                return ("Storyline not found", 404)
-                
-            opera = Opera.query.get(storyline.opera_id)
-            if not opera or opera.user_id != user_id:
-                return ("Permission denied: You do not own this scene", 403)
+            # 一次联表查询验证场景及所有权（场景->情节->故事概要->剧本）
+            owned = resolve_owned('scene', scene_id, user_id)
+            if isinstance(owned, tuple):
+                return owned
 
             # 字段长度校验
             if len(scene_prompt) > 500:
@@ -122,7 +99,7 @@ class SceneImage(db.Model):
             scene_image_id: 场景图片ID（必填）
             scene_prompt: 新的场景描述提示词（可选）
             style: 新的图片风格（可选）
-            scene_image: 新的图片二进制数据（可选）
+            scene_image: 新的图片 URL（可选）
 
         返回:
             成功: 更新后的场景图片对象
@@ -130,38 +107,17 @@ class SceneImage(db.Model):
         """
         try:
             # 运行时导入避免循环导入
-            from sql import Plot, Storyline, Opera
-            
-            # 验证用户是否存在
-            user = User.query.get(user_id)
-            if not user:
-                return ("User not found", 404)
+            from sql.ownership import resolve_owned
 
             # 验证必填参数
             if not scene_image_id:
                 return ("Missing required field: scene_image_id", 400)
 
-            # 查询指定的场景图片
-            scene_image = SceneImage.query.get(scene_image_id)
-            if not scene_image:
-                return ("Scene image not found", 404)
-
-            # 验证所有权（通过场景->情节->故事概要->剧本的关联链验证）
-            scene = Scene.query.get(scene_image.scene_id)
-            if not scene:
-                return ("Scene not found", 404)
-                
-            plot = Plot.query.get(scene.plot_id)
-            if not plot:
-                return ("Plot not found", 404)
-                
-            storyline = Storyline.query.get(plot.storyline_id)
-            if not storyline:
-                return ("Storyline not found", 404)
-                
-            opera = Opera.query.get(storyline.opera_id)
-            if not opera or opera.user_id != user_id:
-                return ("Permission denied: You do not own this scene image", 403)
+            # 一次联表查询获取场景图片并验证所有权（场景图片->场景->情节->故事概要->剧本）
+            owned = resolve_owned('scene_image', scene_image_id, user_id)
+            if isinstance(owned, tuple):
+                return owned
+            scene_image_obj = owned.scene_image
 
             # 字段长度校验
             if scene_prompt is not None and len(scene_prompt) > 500:
@@ -171,16 +127,16 @@ class SceneImage(db.Model):
 
             # 更新字段（只更新提供的字段）
             if scene_prompt is not None:
-                scene_image.scene_prompt = scene_prompt
+                scene_image_obj.scene_prompt = scene_prompt
             if style is not None:
-                scene_image.style = style
+                scene_image_obj.style = style
             if scene_image is not None:
-                scene_image.scene_image = scene_image
+                scene_image_obj.scene_image = scene_image
 
             # 保存到数据库
             db.session.commit()
 
-            return scene_image  # 成功时返回更新后的场景图片对象
+            return scene_image_obj  # 成功时返回更新后的场景图片对象
 
         except SQLAlchemyError as e:
             db.session.rollback()
@@ -204,44 +160,23 @@ class SceneImage(db.Model):
         """
         try:
             # 运行时导入避免循环导入
-            from sql import Plot, Storyline, Opera
-            
+            from sql.ownership import resolve_owned
+
             # 验证必填参数
             if not scene_image_id:
                 return ("Missing required field: scene_image_id", 400)
 
-            # 查找要删除的场景图片
-            scene_image = SceneImage.query.get(scene_image_id)
-            if not scene_image:
-                return ("Scene image not found", 404)
-
-            # 验证用户是否存在
-            user = User.query.get(user_id)
-            if not user:
-                return ("User not found", 404)
-
-            # 验证所有权（通过场景->情节->故事概要->剧本的关联链验证）
-            scene = Scene.query.get(scene_image.scene_id)
-            if not scene:
-                return ("Scene not found", 404)
-                
-            plot = Plot.query.get(scene.plot_id)
-            if not plot:
-                return ("Plot not found", 404)
-                
-            storyline = Storyline.query.get(plot.storyline_id)
-            if not storyline:
-                return ("Storyline not found", 404)
-                
-            opera = Opera.query.get(storyline.opera_id)
-            if not opera or opera.user_id != user_id:
-                return ("Permission denied: You do not own this scene image", 403)
+            # 一次联表查询获取场景图片并验证所有权（场景图片->场景->情节->故事概要->剧本）
+            owned = resolve_owned('scene_image', scene_image_id, user_id)
+            if isinstance(owned, tuple):
+                return owned
+            scene_image_obj = owned.scene_image
 
             # 保存场景图片信息用于返回
-            deleted_scene_image = scene_image
+            deleted_scene_image = scene_image_obj
 
             # 从数据库删除场景图片
-            db.session.delete(scene_image)
+            db.session.delete(scene_image_obj)
             db.session.commit()
 
             return deleted_scene_image  # 成功时返回被删除的场景图片对象
@@ -255,76 +190,24 @@ class SceneImage(db.Model):
     @staticmethod
     def upload_picture(image_url, file_name=None, target_dir=None, branch=None):
         """
-        从给定的 image_url 下载图片，上传到指定的 GitHub 仓库路径下，并返回上传后的下载链接。
+        从给定的 image_url 下载图片，保存到图片存储（见 utils/blob_store.py），并返回可访问的链接。
 
         参数:
             image_url: 需要上传的图片 URL
-            file_name: 目标文件名（可选；若不传将自动生成唯一名）
-            branch: 分支名（可选，默认从环境变量读取，否则 'main'）
+            file_name: 目标文件名（仅 GitHub 存储使用；若不传将自动生成唯一名）
+            target_dir: 目标目录（仅 GitHub 存储使用）
+            branch: 分支名（仅 GitHub 存储使用，默认从环境变量读取，否则 'main'）
 
         返回:
             (True, download_url) 或 (False, error_message)
         """
-        try:
-            # 0) 从环境变量读取目标仓库配置
-            repo_owner = os.getenv("GITHUB_REPO_OWNER")
-            repo_name = os.getenv("GITHUB_REPO_NAME")
-            token = os.getenv("GITHUB_TOKEN")
-            branch = branch or os.getenv("GITHUB_BRANCH", "main")
-
-            if not repo_owner or not repo_name or not token:
-                return (False, "Missing required env: GITHUB_REPO_OWNER/GITHUB_REPO_NAME/GITHUB_TOKEN")
-
-            # 1) 下载图片
-            resp = requests.get(image_url, timeout=30)
-            resp.raise_for_status()
-            file_data = resp.content
-
-            # 2) 生成唯一文件名（固定使用 .png 扩展名）
-            if not file_name:
-                file_name = f"{int(time.time()*1000)}_{uuid.uuid4().hex}.png"
-
-            # 3) 目标路径拼接
-            target_dir = target_dir.strip("/") if target_dir else None
-            remote_path = f"{target_dir}/{file_name}" if target_dir else file_name
-
-            # 4) GitHub API URL
-            api_base = "https://api.github.com"
-            contents_url = f"{api_base}/repos/{repo_owner}/{repo_name}/contents/{remote_path}"
-
-            headers = {
-                "Authorization": f"token {token}",
-                "Accept": "application/vnd.github+json",
-            }
-
-            # 5) 读取现有文件（若存在则需要 sha）
-            sha = None
-            get_params = {"ref": branch}
-            get_resp = requests.get(contents_url, headers=headers, params=get_params)
-            if get_resp.status_code == 200:
-                sha = get_resp.json().get("sha")
-
-            # 6) 组装上传数据
-            content_b64 = base64.b64encode(file_data).decode("utf-8")
-            payload = {
-                "message": f"upload {remote_path}",
-                "content": content_b64,
-                "branch": branch,
-            }
-            if sha:
-                payload["sha"] = sha
-
-            put_resp = requests.put(contents_url, headers=headers, json=payload)
-            if put_resp.status_code not in (200, 201):
-                return (False, f"GitHub upload failed: {put_resp.status_code} {put_resp.text}")
-
-            content_obj = put_resp.json().get("content") or {}
-            download_url = content_obj.get("download_url")
-            if not download_url:
-                # 兜底用 raw 链接
-                download_url = f"https://raw.githubusercontent.com/{repo_owner}/{repo_name}/{branch}/{remote_path}"
-
-            return (True, download_url)
-
-        except Exception as e:
-            return (False, f"upload_picture error: {str(e)}")
\ No newline at end of file
+        # 运行时导入避免循环导入
+        from utils.blob_store import blob_store
+        from utils.image_derivatives import derivatives_enabled, generate_derivatives
+        from utils.job_queue import job_queue
+
+        result = blob_store.put_url(image_url, target_dir=target_dir, file_name=file_name, branch=branch)
+        # 上传成功后在后台生成缩略图等派生图片，不影响本次请求的耗时
+        if result[0] and derivatives_enabled():
+            job_queue.submit_background(generate_derivatives, result[1])
+        return result
@@ -36,14 +36,6 @@ class Storyline(db.Model):
             失败: (错误信息, 状态码)
         """
         try:
-            # 运行时导入避免循环导入
-            from sql import User
-            
-            # 验证用户是否存在
-            user = User.query.get(user_id)
-            if not user:
-                return ("User not found", 404)
-
             # 查询指定ID的故事概要
             storyline = Storyline.query.get(storyline_id)
 
@@ -1,3 +1,4 @@
+from sqlalchemy.orm import deferred
 from sql import db
 
 class User(db.Model):
@@ -7,7 +8,10 @@ class User(db.Model):
     email = db.Column(db.String(255), nullable=False, unique=True)
     password = db.Column(db.String(255), nullable=False)
     identity = db.Column(db.String(255), nullable=False)
-    user_image = db.Column(db.LargeBinary, nullable=True)
+    # 头像在图片存储中的 URL
+    user_image_url = db.Column(db.String(500), nullable=True)
+    # 旧版直接保存在行内的头像：延迟加载，每次请求获取当前用户时不再读取，只用于迁移旧数据
+    user_image = deferred(db.Column(db.LargeBinary, nullable=True))
     WebURL = db.Column(db.String(200), nullable=True)
 
     def __repr__(self):
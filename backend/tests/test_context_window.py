@@ -0,0 +1,87 @@
+from agent.context_window import ContextWindow, message_tokens, estimate_tokens
+
+
+def _msg(role, content):
+    return {"role": role, "content": content}
+
+
+def _window_for(messages, extra=0, reserved=0):
+    """
+    预算恰好容纳 messages 中的全部消息再多 extra 个 token
+    """
+    return ContextWindow(max_tokens=sum(message_tokens(m) for m in messages) + extra + reserved,
+                         reserved_output_tokens=reserved)
+
+
+def test_estimate_tokens():
+    assert estimate_tokens('') == 0
+    assert estimate_tokens('abcd') == 1
+    assert estimate_tokens('你好') == 2
+
+
+def test_fit_keeps_everything_in_order_when_budget_allows():
+    head = [_msg('system', 'sys')]
+    history = [_msg('user', 'q1'), _msg('assistant', 'a1'), _msg('user', 'q2'), _msg('assistant', 'a2')]
+    tail = [_msg('user', 'now')]
+    window = _window_for(head + history + tail, reserved=100)
+
+    messages, truncated = window.fit(head, reversed(history), tail)
+
+    assert messages == head + history + tail
+    assert truncated is False
+
+
+def test_fit_drops_oldest_history_first():
+    head = [_msg('system', 'sys')]
+    history = [_msg('user', 'q1' * 40), _msg('assistant', 'a1'), _msg('user', 'q2'), _msg('assistant', 'a2')]
+    tail = [_msg('user', 'now')]
+    # 只能再放下最近的两条
+    window = _window_for(head + history[2:] + tail, reserved=50)
+
+    messages, truncated = window.fit(head, reversed(history), tail)
+
+    assert messages == head + history[2:] + tail
+    assert truncated is True
+
+
+def test_fit_does_not_start_history_with_assistant_after_truncation():
+    head = [_msg('system', 'sys')]
+    history = [_msg('user', 'q1' * 40), _msg('assistant', 'a1'), _msg('user', 'q2'), _msg('assistant', 'a2')]
+    tail = [_msg('user', 'now')]
+    # 预算能放下最近三条，但第三条是模型回答，应一并丢弃
+    window = _window_for(head + history[1:] + tail)
+
+    messages, truncated = window.fit(head, reversed(history), tail)
+
+    assert messages == head + history[2:] + tail
+    assert truncated is True
+
+
+def test_fit_always_keeps_head_and_tail():
+    head = [_msg('system', 'sys' * 100)]
+    tail = [_msg('user', 'now' * 100)]
+    window = ContextWindow(max_tokens=10, reserved_output_tokens=5)
+
+    messages, truncated = window.fit(head, iter([_msg('user', 'old')]), tail)
+
+    assert messages == head + tail
+    assert truncated is True
+
+
+def test_fit_stops_reading_history_once_budget_is_spent():
+    read = []
+
+    def newest_first():
+        for i in range(100, 0, -1):
+            read.append(i)
+            yield _msg('user', f'message {i}')
+
+    window = ContextWindow(max_tokens=60, reserved_output_tokens=0)
+    window.fit([], newest_first(), [])
+
+    assert len(read) < 100
+
+
+def test_from_model_config():
+    window = ContextWindow.from_model_config({'context_tokens': 32000, 'max_output_tokens': 2000})
+    assert (window.max_tokens, window.reserved_output_tokens) == (32000, 2000)
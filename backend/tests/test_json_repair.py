@@ -0,0 +1,74 @@
+import json
+from agent.json_repair import is_object_items, repair_json, repair_json_text, strip_code_fences
+
+
+def test_valid_json_is_unchanged():
+    text = '[{"name": "Ann", "tags": ["a", "b"]}]'
+    assert json.loads(repair_json_text(text)) == json.loads(text)
+
+
+def test_trailing_commas():
+    assert repair_json('[{"a": 1, "b": [1, 2,],},]') == [{"a": 1, "b": [1, 2]}]
+
+
+def test_code_fence_and_surrounding_prose():
+    text = 'Sure, here you go:\n```json\n[{"name": "Ann"}]\n```\nLet me know if you need more.'
+    assert repair_json(text) == [{"name": "Ann"}]
+
+
+def test_unterminated_code_fence():
+    assert strip_code_fences('```json\n[{"a": 1}]') == '[{"a": 1}]'
+
+
+def test_brackets_in_prose_before_array_are_skipped():
+    text = 'Here are [3] characters: [{"name": "A"}, {"name": "B"},]'
+    assert repair_json(text) == [{"name": "A"}, {"name": "B"}]
+
+
+def test_is_object_items():
+    assert is_object_items([{"name": "A"}])
+    assert is_object_items({"items": []})
+    assert not is_object_items([3])
+    assert not is_object_items([])
+    assert not is_object_items(None)
+
+
+def test_truncated_array_drops_incomplete_last_item():
+    text = '[{"name": "Ann", "age": 1}, {"name": "Bob", "age": 2}, {"name": "Ca'
+    assert repair_json(text) == [{"name": "Ann", "age": 1}, {"name": "Bob", "age": 2}]
+
+
+def test_truncated_array_without_complete_item():
+    assert repair_json('[{"name": "Ann", "bio": "tall an') == []
+
+
+def test_truncated_object_closes_string_and_braces():
+    assert repair_json('{"name": "Ann", "info": {"role": "le') == {"name": "Ann", "info": {"role": "le"}}
+
+
+def test_truncated_object_after_key():
+    assert repair_json('{"name": "Ann", "role":') == {"name": "Ann", "role": None}
+
+
+def test_python_literals():
+    assert repair_json("[{'name': 'Ann', 'main': True, 'pet': None, 'dead': False}]") == [
+        {"name": "Ann", "main": True, "pet": None, "dead": False}
+    ]
+
+
+def test_python_literals_inside_strings_are_kept():
+    assert repair_json('[{"line": "None of True things"}]') == [{"line": "None of True things"}]
+
+
+def test_unquoted_keys():
+    assert repair_json('[{name: "Ann", role: "lead"}]') == [{"name": "Ann", "role": "lead"}]
+
+
+def test_unescaped_quotes_and_newlines_in_strings():
+    assert repair_json('[{"content": "She said "hi"\nand left"}]') == [{"content": 'She said "hi"\nand left'}]
+
+
+def test_no_json_returns_none():
+    assert repair_json('no structured output here') is None
+    assert repair_json('') is None
+    assert repair_json(None) is None
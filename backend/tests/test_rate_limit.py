@@ -0,0 +1,166 @@
+import pytest
+from agent import rate_limit as rate_limit_module
+from agent.rate_limit import MemoryBucketBackend, RateLimiter, RateLimitExceeded, _ModelQueue, _Waiter
+
+
+class _Clock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class _CountingBackend(object):
+    """
+    模型桶中有 tokens 个令牌，用户桶由 empty_users 控制；记录每次成功取令牌的用户
+    """
+
+    def __init__(self, tokens, empty_users=()):
+        self.tokens = tokens
+        self.empty_users = set(empty_users)
+        self.granted = []
+
+    def try_acquire(self, limits):
+        keys = [key for key, _, _ in limits]
+        user_key = next((key for key in keys if key.startswith('user:')), None)
+        if user_key and int(user_key.split(':')[1]) in self.empty_users:
+            return False, 5, user_key
+        if self.tokens <= 0:
+            return False, 1, 'model:m'
+        self.tokens -= 1
+        self.granted.append(int(user_key.split(':')[1]))
+        return True, 0, None
+
+
+def _queue(*user_ids):
+    queue = _ModelQueue()
+    for user_id in user_ids:
+        queue.add(_Waiter(user_id))
+    return queue
+
+
+def _pump(limiter, queue):
+    with limiter._cond:
+        return limiter._pump('m', queue)
+
+
+def test_bucket_allows_burst_then_refills(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(rate_limit_module.time, 'time', clock)
+    backend = MemoryBucketBackend()
+    limits = [('model:m', 1.0, 2)]
+
+    assert backend.try_acquire(limits)[0]
+    assert backend.try_acquire(limits)[0]
+    ok, wait, key = backend.try_acquire(limits)
+    assert not ok and key == 'model:m' and wait == pytest.approx(1.0)
+
+    clock.now += 0.5
+    assert not backend.try_acquire(limits)[0]
+    clock.now += 0.5
+    assert backend.try_acquire(limits)[0]
+
+
+def test_bucket_refill_is_capped_at_burst(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(rate_limit_module.time, 'time', clock)
+    backend = MemoryBucketBackend()
+    limits = [('model:m', 1.0, 2)]
+    backend.try_acquire(limits)
+    clock.now += 3600
+
+    assert backend.try_acquire(limits)[0]
+    assert backend.try_acquire(limits)[0]
+    assert not backend.try_acquire(limits)[0]
+
+
+def test_bucket_takes_from_all_limits_or_none(monkeypatch):
+    monkeypatch.setattr(rate_limit_module.time, 'time', _Clock())
+    backend = MemoryBucketBackend()
+    assert backend.try_acquire([('user:1', 1.0, 1), ('model:m', 1.0, 5)])[0]
+
+    ok, _, key = backend.try_acquire([('user:1', 1.0, 1), ('model:m', 1.0, 5)])
+    assert not ok and key == 'user:1'
+    # 用户桶不足时模型桶不被扣除：模型桶还剩 4 个令牌
+    for _ in range(4):
+        assert backend.try_acquire([('model:m', 1.0, 5)])[0]
+    assert not backend.try_acquire([('model:m', 1.0, 5)])[0]
+
+
+def test_queued_users_are_served_round_robin():
+    backend = _CountingBackend(tokens=6)
+    limiter = RateLimiter(backend, user_rate=6000, user_burst=100, model_rate=60)
+    queue = _queue(1, 1, 1, 2, 2, 3)
+
+    _pump(limiter, queue)
+
+    assert backend.granted == [1, 2, 3, 1, 2, 1]
+    assert not queue.users
+
+
+def test_user_weights():
+    backend = _CountingBackend(tokens=7)
+    limiter = RateLimiter(backend, user_rate=6000, user_burst=100, model_rate=60, user_weights={1: 2})
+    queue = _queue(1, 1, 1, 2, 2, 2, 3)
+
+    _pump(limiter, queue)
+
+    assert backend.granted == [1, 1, 2, 3, 1, 2, 2]
+
+
+def test_model_tokens_are_shared_fairly_across_pumps():
+    backend = _CountingBackend(tokens=0)
+    limiter = RateLimiter(backend, user_rate=6000, user_burst=100, model_rate=60)
+    queue = _queue(1, 1, 1, 1, 2, 2)
+
+    # 每次只补充一个模型令牌
+    for _ in range(4):
+        backend.tokens += 1
+        _pump(limiter, queue)
+
+    assert backend.granted == [1, 2, 1, 2]
+
+
+def test_user_out_of_tokens_does_not_block_others():
+    backend = _CountingBackend(tokens=10, empty_users={1})
+    limiter = RateLimiter(backend, user_rate=6000, user_burst=100, model_rate=60)
+    queue = _queue(1, 1, 2, 3)
+
+    wait = _pump(limiter, queue)
+
+    assert backend.granted == [2, 3]
+    assert queue.queued(1) == 2
+    assert wait == 5
+
+
+def test_acquire_without_limits_returns_immediately():
+    limiter = RateLimiter(MemoryBucketBackend())
+    limiter.acquire(1, 'm')
+    limiter.acquire(None, 'm')
+
+
+def test_acquire_times_out_when_queue_does_not_move():
+    limiter = RateLimiter(MemoryBucketBackend(), model_rate=0.6, model_burst=1, max_wait=0.2)
+    limiter.acquire(1, 'm')
+
+    with pytest.raises(RateLimitExceeded) as excinfo:
+        limiter.acquire(1, 'm')
+    assert excinfo.value.retry_after == 0.2
+    assert not limiter._queues['m'].users
+
+
+def test_too_many_queued_requests_are_rejected():
+    limiter = RateLimiter(MemoryBucketBackend(), model_rate=0.6, model_burst=1, max_queued_per_user=0)
+    limiter.acquire(1, 'm')
+
+    with pytest.raises(RateLimitExceeded):
+        limiter.acquire(1, 'm')
+
+
+def test_model_limit_from_config():
+    backend = _CountingBackend(tokens=1)
+    limiter = RateLimiter(backend, user_rate=6000)
+    limiter.set_model_limit('m', 30, 3)
+    assert limiter._limits(1, 'm') == [('user:1', 100.0, 5), ('model:m', 0.5, 3)]
+    assert limiter._limits(None, 'other') == []
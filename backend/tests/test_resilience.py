@@ -0,0 +1,167 @@
+import httpx2 as httpx
+import openai
+import pytest
+from agent import resilience as resilience_module
+from agent.resilience import CircuitBreaker, ModelUnavailableError, Resilience, is_retryable
+
+_REQUEST = httpx.Request('POST', 'http://model.test/v1/chat/completions')
+
+
+def _connection_error():
+    return openai.APIConnectionError(request=_REQUEST)
+
+
+def _bad_request():
+    return openai.BadRequestError('bad request', response=httpx.Response(400, request=_REQUEST), body=None)
+
+
+def _raising(make_error):
+    def func():
+        raise make_error()
+    return func
+
+
+class _Clock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(resilience_module.time, 'time', clock)
+    monkeypatch.setattr(resilience_module.time, 'sleep', lambda seconds: None)
+    return clock
+
+
+def test_is_retryable():
+    assert is_retryable(_connection_error())
+    assert is_retryable(openai.InternalServerError('boom', response=httpx.Response(503, request=_REQUEST), body=None))
+    assert not is_retryable(_bad_request())
+    assert not is_retryable(ValueError('not an API error'))
+
+
+def test_breaker_opens_after_threshold(clock):
+    breaker = CircuitBreaker('m', failure_threshold=3, reset_seconds=30)
+    for _ in range(2):
+        assert breaker.allow()
+        breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+    assert breaker.retry_after() == 30
+
+
+def test_success_resets_consecutive_failures(clock):
+    breaker = CircuitBreaker('m', failure_threshold=2, reset_seconds=30)
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_half_open_allows_a_single_probe(clock):
+    breaker = CircuitBreaker('m', failure_threshold=1, reset_seconds=30)
+    breaker.record_failure()
+    clock.now += 30
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+
+    assert breaker.allow()
+    assert not breaker.allow()
+
+
+def test_half_open_probe_success_closes(clock):
+    breaker = CircuitBreaker('m', failure_threshold=1, reset_seconds=30)
+    breaker.record_failure()
+    clock.now += 30
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow()
+
+
+def test_half_open_probe_failure_reopens(clock):
+    breaker = CircuitBreaker('m', failure_threshold=5, reset_seconds=30)
+    for _ in range(5):
+        breaker.record_failure()
+    clock.now += 30
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+
+
+def test_release_keeps_half_open(clock):
+    breaker = CircuitBreaker('m', failure_threshold=1, reset_seconds=30)
+    breaker.record_failure()
+    clock.now += 30
+    assert breaker.allow()
+    breaker.release()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    # 试探名额已释放，下一个请求可以继续试探
+    assert breaker.allow()
+
+
+def test_call_retries_transient_errors(clock):
+    attempts = []
+
+    def flaky():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise _connection_error()
+        return 'ok'
+
+    assert Resilience(retries=2, failure_threshold=10).call('m', flaky) == 'ok'
+    assert len(attempts) == 3
+
+
+def test_call_gives_up_after_retries(clock):
+    attempts = []
+
+    def down():
+        attempts.append(1)
+        raise _connection_error()
+
+    with pytest.raises(ModelUnavailableError):
+        Resilience(retries=1, failure_threshold=10).call('m', down)
+    assert len(attempts) == 2
+
+
+def test_call_does_not_retry_request_errors(clock):
+    attempts = []
+
+    def bad():
+        attempts.append(1)
+        raise _bad_request()
+
+    with pytest.raises(openai.BadRequestError):
+        Resilience(retries=3).call('m', bad)
+    assert len(attempts) == 1
+
+
+def test_request_error_does_not_close_half_open_breaker(clock):
+    resilience = Resilience(retries=0, failure_threshold=1, reset_seconds=30)
+    with pytest.raises(ModelUnavailableError):
+        resilience.call('m', _raising(_connection_error))
+    clock.now += 30
+
+    with pytest.raises(openai.BadRequestError):
+        resilience.call('m', _raising(_bad_request))
+    assert resilience.breaker('m').state == CircuitBreaker.HALF_OPEN
+
+
+def test_open_breaker_fails_fast(clock):
+    resilience = Resilience(retries=0, failure_threshold=1, reset_seconds=30)
+    with pytest.raises(ModelUnavailableError):
+        resilience.call('m', _raising(_connection_error))
+
+    called = []
+    with pytest.raises(ModelUnavailableError) as excinfo:
+        resilience.call('m', lambda: called.append(1))
+    assert not called
+    assert excinfo.value.retry_after == 30
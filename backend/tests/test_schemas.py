@@ -0,0 +1,23 @@
+from agent.schemas import validate_items
+
+
+def test_null_and_scalar_fields_are_coerced():
+    items = validate_items('character_list', [{"name": None, "personality": 3, "image": "a.png"}])
+    assert items == [{"name": "", "personality": "3", "image": ["a.png"]}]
+
+
+def test_bare_scene_name_and_single_character():
+    items = validate_items('outline', [{"plotName": "Opening", "scene": "Harbor", "characters": "Ann"}])
+    assert items == [{"plotName": "Opening", "scene": {"name": "Harbor"}, "characters": ["Ann"]}]
+
+
+def test_items_missing_required_keys_are_dropped():
+    assert validate_items('dialogue_list', [{}, {"foo": 1}]) is None
+    assert validate_items('character_list', [{}, {"foo": 1}]) is None
+    assert validate_items('outline', [{}, {"foo": 1}]) is None
+    assert validate_items('dialogue_list', [{"character": "Ann"}]) is None
+
+
+def test_valid_items_are_kept_alongside_invalid_ones():
+    data = {"items": [{"character": "Ann", "content": "Hi"}, {"foo": 1}]}
+    assert validate_items('dialogue_list', data) == [{"character": "Ann", "content": "Hi"}]
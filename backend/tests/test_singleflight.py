@@ -0,0 +1,113 @@
+import threading
+import time
+import pytest
+from utils.metrics import metrics
+from utils.singleflight import SingleFlight
+
+
+def _run_concurrently(flight, key, func, callers):
+    """
+    callers 个线程同时以同一个键调用 flight.do，返回 [(结果, 异常), ...]
+    """
+    results = []
+    lock = threading.Lock()
+
+    def call():
+        try:
+            value, error = flight.do(key, func), None
+        except Exception as e:
+            value, error = None, e
+        with lock:
+            results.append((value, error))
+
+    threads = [threading.Thread(target=call) for _ in range(callers)]
+    for thread in threads:
+        thread.start()
+    return threads, results
+
+
+def _blocking(release, calls, outcome):
+    def func():
+        calls.append(1)
+        release.wait(5)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+    return func
+
+
+def _shared_count():
+    return metrics.snapshot()['counters'].get('singleflight.shared', 0)
+
+
+def _wait_until(condition):
+    for _ in range(500):
+        if condition():
+            return
+        time.sleep(0.01)
+    raise AssertionError('timed out')
+
+
+def test_concurrent_callers_share_one_result():
+    flight = SingleFlight()
+    release, calls = threading.Event(), []
+    shared = _shared_count()
+    result = object()
+
+    threads, results = _run_concurrently(flight, 'k', _blocking(release, calls, result), 5)
+    # 领头调用执行期间，其余 4 个调用都在等待它的结果
+    _wait_until(lambda: len(calls) == 1 and _shared_count() - shared == 4)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(calls) == 1
+    assert len(results) == 5
+    assert all(value is result and error is None for value, error in results)
+
+
+def test_concurrent_callers_share_one_exception():
+    flight = SingleFlight()
+    release, calls = threading.Event(), []
+    shared = _shared_count()
+    failure = RuntimeError('model down')
+
+    threads, results = _run_concurrently(flight, 'k', _blocking(release, calls, failure), 4)
+    # 领头调用执行期间，其余 3 个调用都在等待它的结果
+    _wait_until(lambda: len(calls) == 1 and _shared_count() - shared == 3)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(calls) == 1
+    assert [error for _, error in results] == [failure] * 4
+
+
+def test_different_keys_run_separately():
+    flight = SingleFlight()
+    assert flight.do('a', lambda: 1) == 1
+    assert flight.do('b', lambda: 2) == 2
+
+
+def test_finished_call_is_not_reused():
+    flight = SingleFlight()
+    calls = []
+
+    def func():
+        calls.append(1)
+        return len(calls)
+
+    assert flight.do('k', func) == 1
+    assert flight.do('k', func) == 2
+    assert not flight._calls
+
+
+def test_failed_call_is_removed():
+    flight = SingleFlight()
+
+    def fail():
+        raise ValueError('bad')
+
+    with pytest.raises(ValueError):
+        flight.do('k', fail)
+    assert flight.do('k', lambda: 'ok') == 'ok'
@@ -0,0 +1,74 @@
+from agent.stream_json import JsonArrayStream
+
+TEXT = '[{"character": "Ann", "content": "Hi {there}"}, {"character": "Bob", "content": "a \\"quoted\\" ]word"}]'
+EXPECTED = [
+    {"character": "Ann", "content": "Hi {there}"},
+    {"character": "Bob", "content": 'a "quoted" ]word'},
+]
+
+
+def _feed_all(parser, chunks):
+    items = []
+    for chunk in chunks:
+        items.extend(parser.feed(chunk))
+    return items
+
+
+def test_whole_text():
+    parser = JsonArrayStream()
+    assert _feed_all(parser, [TEXT]) == EXPECTED
+    assert parser.finished
+    assert parser.count == 2
+
+
+def test_items_arrive_as_soon_as_they_are_complete():
+    parser = JsonArrayStream()
+    first_end = TEXT.index('}, {') + 1
+    assert parser.feed(TEXT[:first_end]) == EXPECTED[:1]
+    assert parser.feed(TEXT[first_end:]) == EXPECTED[1:]
+
+
+def test_split_into_single_characters():
+    parser = JsonArrayStream()
+    assert _feed_all(parser, list(TEXT)) == EXPECTED
+    assert parser.finished
+
+
+def test_split_inside_escape_sequence():
+    parser = JsonArrayStream()
+    split = TEXT.index('\\"') + 1
+    assert _feed_all(parser, [TEXT[:split], TEXT[split:]]) == EXPECTED
+
+
+def test_code_fence_and_prose_before_array():
+    parser = JsonArrayStream()
+    assert _feed_all(parser, ['Sure!\n```json\n', TEXT, '\n```']) == EXPECTED
+
+
+def test_bracketed_prose_before_array_does_not_end_stream():
+    parser = JsonArrayStream()
+    chunks = ['Here are [15', '] lines of dialogue, see [notes] below:\n[', '\n  ', TEXT[1:]]
+    assert _feed_all(parser, chunks) == EXPECTED
+    assert parser.finished
+
+
+def test_structured_output_wrapper():
+    parser = JsonArrayStream()
+    assert _feed_all(parser, ['{"items": ', TEXT, '}']) == EXPECTED
+
+
+def test_text_after_array_is_ignored():
+    parser = JsonArrayStream()
+    assert _feed_all(parser, [TEXT, ' and [{"character": "extra"}]']) == EXPECTED
+
+
+def test_malformed_item_is_repaired():
+    parser = JsonArrayStream()
+    assert _feed_all(parser, ["[{'character': 'Ann', 'content': 'hi',}]"]) == [{"character": "Ann", "content": "hi"}]
+
+
+def test_truncated_stream_keeps_complete_items():
+    parser = JsonArrayStream()
+    cut = TEXT.index('"a \\"')
+    assert _feed_all(parser, [TEXT[:cut]]) == EXPECTED[:1]
+    assert not parser.finished
@@ -0,0 +1,341 @@
+import base64
+import hashlib
+import os
+import re
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from utils.http_client import http_session
+from utils.image_cache import image_cache
+
+# 下载 / 写入时每次处理的字节数
+CHUNK_SIZE = 64 * 1024
+
+_CONTENT_TYPE_EXTENSIONS = {
+    'image/png': 'png',
+    'image/jpeg': 'jpg',
+    'image/jpg': 'jpg',
+    'image/webp': 'webp',
+    'image/gif': 'gif',
+    'image/avif': 'avif',
+}
+
+# 本地存储的对象键：<sha256 前两位>/<sha256>.<扩展名>
+# 缩略图等派生图片与原图放在一起：<sha256 前两位>/<sha256>.w<尺寸>.<扩展名>（见 utils/image_derivatives.py）
+_LOCAL_KEY_PATTERN = re.compile(r'^[0-9a-f]{2}/[0-9a-f]{64}(\.w\d{1,4})?\.(png|jpg|webp|gif|avif)$')
+
+
+def _extension_for(content_type):
+    content_type = (content_type or '').split(';')[0].strip().lower()
+    return _CONTENT_TYPE_EXTENSIONS.get(content_type, 'png')
+
+
+class BlobStore(object):
+    """
+    图片等二进制对象的存储后端
+
+    put_url() 下载远程图片并保存，返回 (True, 可访问的 URL) 或 (False, 错误信息)，
+    与原先 upload_picture 的返回约定一致。
+    """
+
+    def put_url(self, image_url, target_dir=None, file_name=None, branch=None):
+        raise NotImplementedError
+
+    def put_bytes(self, data, content_type=None, target_dir=None):
+        """
+        保存内存中的图片内容（如用户头像、剧本封面），返回值约定与 put_url 相同
+        """
+        raise NotImplementedError
+
+    def read(self, url):
+        """
+        读取本存储中对象的内容；不属于本存储的 URL 返回 None
+        """
+        return None
+
+
+class LocalBlobStore(BlobStore):
+    """
+    本地文件系统存储，按内容的 SHA-256 寻址
+
+    相同内容的图片只保存一份；下载时边读边写入临时文件并计算哈希，不在内存中保存整张图片。
+    目录结构与 URL 一一对应（<url_prefix>/<sha前两位>/<sha>.<扩展名>），
+    既可以由应用的 /api/blob 路由提供，也可以让 Nginx 等静态服务器直接指向存储目录。
+    """
+
+    def __init__(self, root, url_prefix='/api/blob'):
+        self.root = os.path.abspath(root)
+        self.url_prefix = url_prefix.rstrip('/')
+
+    def path_for(self, key):
+        """
+        对象键对应的本地路径；键不合法时返回 None（防止路径穿越）
+        """
+        if not _LOCAL_KEY_PATTERN.match(key or ''):
+            return None
+        return os.path.join(self.root, *key.split('/'))
+
+    def url_for(self, key):
+        return f"{self.url_prefix}/{key}"
+
+    def key_for_url(self, url):
+        url = (url or '').strip()
+        prefix = self.url_prefix + '/'
+        if url.startswith(prefix):
+            key = url[len(prefix):]
+            if _LOCAL_KEY_PATTERN.match(key):
+                return key
+        return None
+
+    def exists(self, key):
+        path = self.path_for(key)
+        return path is not None and os.path.isfile(path)
+
+    def _write_temp(self, directory, chunks, hasher=None):
+        """
+        将字节块写入 directory 下的临时文件，返回临时文件路径（失败时删除临时文件并抛出异常）
+        """
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.upload-')
+        try:
+            with os.fdopen(fd, 'wb') as tmp:
+                for chunk in chunks:
+                    if chunk:
+                        if hasher is not None:
+                            hasher.update(chunk)
+                        tmp.write(chunk)
+            return tmp_path
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def put_key(self, key, data):
+        """
+        以指定的对象键写入内容（用于由原图键推导出的派生图片），写入是原子的
+        """
+        path = self.path_for(key)
+        if path is None:
+            raise ValueError(f'Invalid blob key: {key}')
+        tmp_path = self._write_temp(os.path.dirname(path), [data])
+        os.replace(tmp_path, path)
+        return key
+
+    def put_stream(self, chunks, content_type=None):
+        """
+        将字节块流写入存储
+
+        参数:
+            chunks: 可迭代的 bytes 块
+            content_type: 内容类型，用于决定扩展名（缺省为 png）
+
+        返回:
+            对象键
+        """
+        hasher = hashlib.sha256()
+        tmp_path = self._write_temp(self.root, chunks, hasher)
+        try:
+            digest = hasher.hexdigest()
+            key = f"{digest[:2]}/{digest}.{_extension_for(content_type)}"
+            final_path = self.path_for(key)
+            if os.path.exists(final_path):
+                # 相同内容已存在，直接复用
+                os.remove(tmp_path)
+            else:
+                os.makedirs(os.path.dirname(final_path), exist_ok=True)
+                os.replace(tmp_path, final_path)
+            return key
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def put_url(self, image_url, target_dir=None, file_name=None, branch=None):
+        # 内容寻址存储的对象键只由内容决定，target_dir / file_name / branch 仅为与其他后端保持接口一致
+        try:
+            with http_session.get(image_url, stream=True) as resp:
+                resp.raise_for_status()
+                key = self.put_stream(resp.iter_content(CHUNK_SIZE), resp.headers.get('Content-Type'))
+            return (True, self.url_for(key))
+        except Exception as e:
+            return (False, f"upload_picture error: {str(e)}")
+
+    def put_bytes(self, data, content_type=None, target_dir=None):
+        try:
+            return (True, self.url_for(self.put_stream([data], content_type)))
+        except Exception as e:
+            return (False, f"put_bytes error: {str(e)}")
+
+    def read(self, url):
+        key = self.key_for_url(url)
+        if not key:
+            return None
+        with open(self.path_for(key), 'rb') as f:
+            return f.read()
+
+
+class GitHubBlobStore(BlobStore):
+    """
+    通过 GitHub contents API 把图片提交到仓库（原有的存储方式，每张图片需要一次下载、一次查询和一次提交）
+    """
+
+    def __init__(self, repo_owner, repo_name, token, branch='main'):
+        self.repo_owner = repo_owner
+        self.repo_name = repo_name
+        self.token = token
+        self.branch = branch
+
+    def put_url(self, image_url, target_dir=None, file_name=None, branch=None):
+        try:
+            if not self.repo_owner or not self.repo_name or not self.token:
+                return (False, "Missing required env: GITHUB_REPO_OWNER/GITHUB_REPO_NAME/GITHUB_TOKEN")
+
+            # 1) 下载图片
+            resp = http_session.get(image_url)
+            resp.raise_for_status()
+            return self._upload(resp.content, target_dir, file_name, branch)
+
+        except Exception as e:
+            return (False, f"upload_picture error: {str(e)}")
+
+    def put_bytes(self, data, content_type=None, target_dir=None):
+        try:
+            if not self.repo_owner or not self.repo_name or not self.token:
+                return (False, "Missing required env: GITHUB_REPO_OWNER/GITHUB_REPO_NAME/GITHUB_TOKEN")
+            return self._upload(data, target_dir, None, None)
+        except Exception as e:
+            return (False, f"put_bytes error: {str(e)}")
+
+    def _upload(self, file_data, target_dir=None, file_name=None, branch=None):
+        """
+        通过 contents API 提交文件，返回 (True, 下载地址) 或 (False, 错误信息)；网络异常由调用方处理
+        """
+        branch = branch or self.branch
+        # 2) 生成唯一文件名（固定使用 .png 扩展名）
+        if not file_name:
+            file_name = f"{int(time.time()*1000)}_{uuid.uuid4().hex}.png"
+
+        # 3) 目标路径拼接
+        target_dir = target_dir.strip("/") if target_dir else None
+        remote_path = f"{target_dir}/{file_name}" if target_dir else file_name
+
+        # 4) GitHub API URL
+        api_base = "https://api.github.com"
+        contents_url = f"{api_base}/repos/{self.repo_owner}/{self.repo_name}/contents/{remote_path}"
+
+        headers = {
+            "Authorization": f"token {self.token}",
+            "Accept": "application/vnd.github+json",
+        }
+
+        # 5) 读取现有文件（若存在则需要 sha）
+        sha = None
+        get_params = {"ref": branch}
+        get_resp = http_session.get(contents_url, headers=headers, params=get_params)
+        if get_resp.status_code == 200:
+            sha = get_resp.json().get("sha")
+
+        # 6) 组装上传数据
+        content_b64 = base64.b64encode(file_data).decode("utf-8")
+        payload = {
+            "message": f"upload {remote_path}",
+            "content": content_b64,
+            "branch": branch,
+        }
+        if sha:
+            payload["sha"] = sha
+
+        put_resp = http_session.put(contents_url, headers=headers, json=payload)
+        if put_resp.status_code not in (200, 201):
+            return (False, f"GitHub upload failed: {put_resp.status_code} {put_resp.text}")
+
+        content_obj = put_resp.json().get("content") or {}
+        download_url = content_obj.get("download_url")
+        if not download_url:
+            # 兜底用 raw 链接
+            download_url = f"https://raw.githubusercontent.com/{self.repo_owner}/{self.repo_name}/{branch}/{remote_path}"
+
+        return (True, download_url)
+
+
+def _create_local_blob_store():
+    return LocalBlobStore(
+        root=os.environ.get('BLOB_STORE_DIR', './data/blobs'),
+        url_prefix=os.environ.get('BLOB_PUBLIC_URL', '/api/blob')
+    )
+
+
+def _create_blob_store():
+    backend = os.environ.get('BLOB_STORE', 'local').lower()
+    if backend == 'github':
+        return GitHubBlobStore(
+            repo_owner=os.getenv("GITHUB_REPO_OWNER"),
+            repo_name=os.getenv("GITHUB_REPO_NAME"),
+            token=os.getenv("GITHUB_TOKEN"),
+            branch=os.getenv("GITHUB_BRANCH", "main")
+        )
+    return _create_local_blob_store()
+
+
+# 新图片写入的存储后端，由环境变量 BLOB_STORE 选择（local / github）
+blob_store = _create_blob_store()
+
+# 本地存储实例：即使当前写入 GitHub，之前写入本地的图片也仍可读取和访问
+local_blob_store = blob_store if isinstance(blob_store, LocalBlobStore) else _create_local_blob_store()
+
+
+def load_image_bytes(url):
+    """
+    读取图片内容：本地存储中的图片直接读文件，其他 URL 通过共享连接池下载
+
+    返回:
+        图片的 bytes（失败时抛出异常）
+    """
+    data = local_blob_store.read(url)
+    if data is not None:
+        return data
+    resp = http_session.get(url)
+    resp.raise_for_status()
+    return resp.content
+
+
+def load_image_cached(url):
+    """
+    读取图片内容：本地存储中的图片直接读文件，远程图片经过内存 + 磁盘两级缓存，重复访问不再下载
+
+    返回:
+        图片的 bytes（失败时抛出异常）
+    """
+    data = local_blob_store.read(url)
+    if data is not None:
+        return data
+    return image_cache.get_or_load(url, load_image_bytes)
+
+
+# 列表接口并发读取图片使用的线程池
+image_fetch_executor = ThreadPoolExecutor(
+    max_workers=int(os.environ.get('IMAGE_FETCH_WORKERS', 8)),
+    thread_name_prefix='image-fetch'
+)
+
+
+def load_images_base64(urls):
+    """
+    并发读取多张图片并转为 base64（远程图片经过缓存），总耗时取决于最慢的一张而不是图片数量
+
+    参数:
+        urls: 图片 URL 列表（可以包含 None）
+
+    返回:
+        与 urls 顺序一致的 base64 字符串列表，读取失败的位置为 None
+    """
+    def load(url):
+        if not url:
+            return None
+        try:
+            return base64.b64encode(load_image_cached(url)).decode('utf-8')
+        except Exception:
+            return None
+
+    return list(image_fetch_executor.map(load, urls))
@@ -0,0 +1,106 @@
+import os
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util.retry import Retry
+
+# 每个主机保持的空闲连接数（可通过 HTTP_HOST_POOL_SIZES 为个别主机单独设置，如 "api.github.com=4,cdn.example.com=32"）
+DEFAULT_POOL_SIZE = int(os.environ.get('HTTP_POOL_SIZE', 10))
+HOST_POOL_SIZES = {
+    host.strip(): int(size)
+    for host, _, size in (item.partition('=') for item in os.environ.get('HTTP_HOST_POOL_SIZES', '').split(','))
+    if host.strip() and size.strip()
+}
+CONNECT_TIMEOUT = float(os.environ.get('HTTP_CONNECT_TIMEOUT', 5))
+READ_TIMEOUT = float(os.environ.get('HTTP_READ_TIMEOUT', 30))
+# 连接失败和 429 / 5xx 响应的重试次数（只重试 GET / HEAD 等幂等请求），间隔按 backoff 指数增长
+RETRY_TOTAL = int(os.environ.get('HTTP_RETRIES', 3))
+RETRY_BACKOFF = float(os.environ.get('HTTP_RETRY_BACKOFF', 0.5))
+
+_stats_lock = threading.Lock()
+# 按主机统计：requests 为发出的请求数，connections 为新建的连接数，两者之差即复用连接的次数
+_host_stats = {}
+
+
+def _record(host, field):
+    with _stats_lock:
+        stat = _host_stats.setdefault(host, {'requests': 0, 'connections': 0})
+        stat[field] += 1
+
+
+class _CountingHTTPConnectionPool(HTTPConnectionPool):
+    def _new_conn(self):
+        _record(self.host, 'connections')
+        return super()._new_conn()
+
+
+class _CountingHTTPSConnectionPool(HTTPSConnectionPool):
+    def _new_conn(self):
+        _record(self.host, 'connections')
+        return super()._new_conn()
+
+
+class _CountingAdapter(HTTPAdapter):
+    """
+    记录新建连接次数的连接池适配器
+    """
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': _CountingHTTPConnectionPool,
+            'https': _CountingHTTPSConnectionPool,
+        }
+
+
+class PooledSession(requests.Session):
+    """
+    进程内共享的 HTTP 会话：复用 TCP / TLS 连接，带默认超时和失败重试
+    """
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', (CONNECT_TIMEOUT, READ_TIMEOUT))
+        _record(requests.utils.urlparse(url).hostname or '', 'requests')
+        return super().request(method, url, **kwargs)
+
+
+def _create_adapter(pool_size):
+    retry = Retry(
+        total=RETRY_TOTAL,
+        backoff_factor=RETRY_BACKOFF,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset(['GET', 'HEAD']),
+        raise_on_status=False
+    )
+    return _CountingAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+
+
+def _create_session():
+    session = PooledSession()
+    session.mount('http://', _create_adapter(DEFAULT_POOL_SIZE))
+    session.mount('https://', _create_adapter(DEFAULT_POOL_SIZE))
+    for host, size in HOST_POOL_SIZES.items():
+        adapter = _create_adapter(size)
+        session.mount(f'http://{host}', adapter)
+        session.mount(f'https://{host}', adapter)
+    return session
+
+
+# 图片下载、GitHub 上传等出站请求共用的会话
+http_session = _create_session()
+
+
+def pool_stats():
+    """
+    各主机的连接复用情况
+
+    返回:
+        {主机: {'requests', 'connections', 'reused', 'reuse_ratio'}}
+    """
+    with _stats_lock:
+        stats = {}
+        for host, stat in _host_stats.items():
+            reused = max(stat['requests'] - stat['connections'], 0)
+            stats[host] = dict(stat, reused=reused, reuse_ratio=reused / stat['requests'] if stat['requests'] else 0)
+        return stats
@@ -0,0 +1,199 @@
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from utils.metrics import metrics
+
+
+class ImageCache(object):
+    """
+    按图片 URL 缓存图片内容的内存 LRU 缓存，总字节数超过上限时淘汰最久未使用的图片
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._items = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, url):
+        with self._lock:
+            data = self._items.get(url)
+            if data is not None:
+                self._items.move_to_end(url)
+            return data
+
+    def put(self, url, data):
+        # 单张超过上限的图片不缓存
+        if data is None or len(data) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(url, None)
+            if old is not None:
+                self._size -= len(old)
+            self._items[url] = data
+            self._size += len(data)
+            while self._size > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self._size -= len(evicted)
+
+
+class DiskImageCache(object):
+    """
+    按图片 URL 缓存图片内容的磁盘 LRU 缓存
+
+    文件名为 URL 的 SHA-256，写入先落到临时文件再原子替换，进程异常退出也不会留下半张图片。
+    启动时按文件修改时间重建 LRU 顺序，命中时更新修改时间，因此重启后淘汰顺序仍然有效。
+    """
+
+    def __init__(self, root, max_bytes):
+        self.root = os.path.abspath(root)
+        self.max_bytes = max_bytes
+        self._items = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self._loaded = False
+
+    def _path_for(self, url):
+        digest = hashlib.sha256(url.encode('utf-8')).hexdigest()
+        return os.path.join(self.root, digest[:2], digest)
+
+    def _load_index(self):
+        """
+        首次使用时扫描缓存目录，按修改时间从旧到新建立 LRU 顺序（需持有锁）
+        """
+        if self._loaded:
+            return
+        self._loaded = True
+        entries = []
+        if os.path.isdir(self.root):
+            for dir_path, _, file_names in os.walk(self.root):
+                for file_name in file_names:
+                    path = os.path.join(dir_path, file_name)
+                    if file_name.startswith('.'):
+                        # 上次异常退出遗留的临时文件
+                        try:
+                            os.remove(path)
+                        except OSError:
+                            pass
+                        continue
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    entries.append((stat.st_mtime, path, stat.st_size))
+        for _, path, size in sorted(entries):
+            self._items[path] = size
+            self._size += size
+        self._evict()
+
+    def _evict(self):
+        while self._size > self.max_bytes and self._items:
+            path, size = self._items.popitem(last=False)
+            self._size -= size
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def get(self, url):
+        path = self._path_for(url)
+        with self._lock:
+            self._load_index()
+            if path not in self._items:
+                return None
+            self._items.move_to_end(path)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)
+            return data
+        except OSError:
+            # 文件已被外部删除
+            with self._lock:
+                size = self._items.pop(path, None)
+                if size is not None:
+                    self._size -= size
+            return None
+
+    def put(self, url, data):
+        if data is None or len(data) > self.max_bytes:
+            return
+        path = self._path_for(url)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+            with os.fdopen(fd, 'wb') as tmp:
+                tmp.write(data)
+            os.replace(tmp_path, path)
+        except OSError:
+            # 磁盘缓存写入失败不影响请求本身
+            return
+        with self._lock:
+            self._load_index()
+            old = self._items.pop(path, None)
+            if old is not None:
+                self._size -= old
+            self._items[path] = len(data)
+            self._size += len(data)
+            self._evict()
+
+
+class TieredImageCache(object):
+    """
+    两级图片缓存：先查内存，再查磁盘，都未命中时才下载
+
+    命中与未命中次数记录在 metrics 中（image_cache.memory_hit / image_cache.disk_hit / image_cache.miss），
+    可通过 /api/metrics 查看。
+    """
+
+    def __init__(self, memory, disk=None):
+        self.memory = memory
+        self.disk = disk
+
+    def get_or_load(self, url, loader):
+        """
+        命中缓存时直接返回，否则调用 loader(url) 获取并写入两级缓存
+
+        参数:
+            url: 图片 URL（缓存键）
+            loader: 未命中时获取图片内容的函数，失败时应抛出异常（失败结果不缓存）
+
+        返回:
+            图片的 bytes
+        """
+        data = self.memory.get(url)
+        if data is not None:
+            metrics.incr('image_cache.memory_hit')
+            return data
+
+        if self.disk is not None:
+            data = self.disk.get(url)
+            if data is not None:
+                metrics.incr('image_cache.disk_hit')
+                self.memory.put(url, data)
+                return data
+
+        metrics.incr('image_cache.miss')
+        data = loader(url)
+        self.memory.put(url, data)
+        if self.disk is not None:
+            self.disk.put(url, data)
+        return data
+
+
+def _create_image_cache():
+    memory = ImageCache(max_bytes=int(os.environ.get('IMAGE_CACHE_MEMORY_MB', 64)) * 1024 * 1024)
+    disk_mb = int(os.environ.get('IMAGE_CACHE_DISK_MB', 1024))
+    disk = None
+    if disk_mb > 0:
+        disk = DiskImageCache(
+            root=os.environ.get('IMAGE_CACHE_DIR', './data/image_cache'),
+            max_bytes=disk_mb * 1024 * 1024
+        )
+    return TieredImageCache(memory, disk)
+
+
+# 远程图片的进程级缓存（本地存储中的图片直接读文件，不经过此缓存）
+image_cache = _create_image_cache()
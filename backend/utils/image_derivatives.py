@@ -0,0 +1,108 @@
+import hashlib
+import io
+import mimetypes
+import os
+from utils.blob_store import local_blob_store, load_image_cached, image_fetch_executor
+
+# Pillow 为可选依赖：未安装时不生成派生图片，各接口直接返回原图
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+# 派生图片的尺寸（最长边像素）
+DERIVATIVE_SIZES = tuple(sorted({
+    int(size) for size in os.environ.get('IMAGE_DERIVATIVE_SIZES', '128,256,512').split(',') if size.strip()
+}))
+# 派生图片的格式：webp（默认）或 avif（需要 Pillow 支持 AVIF 编码）
+DERIVATIVE_FORMAT = os.environ.get('IMAGE_DERIVATIVE_FORMAT', 'webp').lower()
+DERIVATIVE_QUALITY = int(os.environ.get('IMAGE_DERIVATIVE_QUALITY', 80))
+
+mimetypes.add_type('image/webp', '.webp')
+mimetypes.add_type('image/avif', '.avif')
+
+
+def derivatives_enabled():
+    return Image is not None and bool(DERIVATIVE_SIZES)
+
+
+def pick_size(requested):
+    """
+    选择不小于请求尺寸的最小派生尺寸（请求尺寸大于所有派生尺寸时返回 None，表示使用原图）
+    """
+    if not requested or not derivatives_enabled():
+        return None
+    for size in DERIVATIVE_SIZES:
+        if size >= requested:
+            return size
+    return None
+
+
+def derivative_key(url, size):
+    """
+    派生图片在本地存储中的对象键
+
+    本地存储中的原图直接在原图键的基础上加尺寸后缀，其他 URL（如 GitHub 上的旧图片）使用 URL 的 SHA-256。
+    """
+    key = local_blob_store.key_for_url(url)
+    stem = key.split('/')[-1].split('.')[0] if key else hashlib.sha256(url.encode('utf-8')).hexdigest()
+    return f"{stem[:2]}/{stem}.w{size}.{DERIVATIVE_FORMAT}"
+
+
+def _render(data, size):
+    with Image.open(io.BytesIO(data)) as image:
+        image = image.convert('RGBA' if image.mode in ('RGBA', 'LA', 'P') else 'RGB')
+        image.thumbnail((size, size))
+        out = io.BytesIO()
+        image.save(out, format=DERIVATIVE_FORMAT.upper(), quality=DERIVATIVE_QUALITY)
+        return out.getvalue()
+
+
+def generate_derivatives(url, sizes=None):
+    """
+    为一张图片生成所有（或指定）尺寸的派生图片，已存在的尺寸跳过；图片上传成功后在后台调用
+
+    返回:
+        生成或已存在的对象键列表（未安装 Pillow 时为空列表）
+    """
+    if not url or not derivatives_enabled():
+        return []
+
+    url = url.strip()
+    keys = []
+    data = None
+    for size in sizes or DERIVATIVE_SIZES:
+        key = derivative_key(url, size)
+        if not local_blob_store.exists(key):
+            if data is None:
+                data = load_image_cached(url)
+            local_blob_store.put_key(key, _render(data, size))
+        keys.append(key)
+    return keys
+
+
+def derivative_for(url, requested_size):
+    """
+    获取适合请求尺寸的派生图片对象键，尚未生成时立即生成
+
+    返回:
+        对象键；不需要或无法生成派生图片时返回 None（调用方使用原图）
+    """
+    size = pick_size(requested_size)
+    if size is None or not url:
+        return None
+    return generate_derivatives(url, [size])[0]
+
+
+def thumbnail_urls(urls, requested_size):
+    """
+    并发获取多张图片的派生图片 URL（缺失的尺寸即时生成），无法生成时对应位置返回原图 URL
+    """
+    def resolve(url):
+        try:
+            key = derivative_for(url, requested_size)
+        except Exception:
+            key = None
+        return local_blob_store.url_for(key) if key else url
+
+    return list(image_fetch_executor.map(resolve, urls))
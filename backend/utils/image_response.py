@@ -0,0 +1,89 @@
+import base64
+import hashlib
+import io
+from flask import send_file
+from utils.blob_store import local_blob_store, load_image_cached
+from utils.image_derivatives import derivative_for
+
+# 需要登录才能访问的图片：允许浏览器缓存，但每次使用前用 ETag 向服务器确认（未变化时只返回 304）
+PRIVATE_CACHE_CONTROL = 'private, no-cache'
+
+
+def sniff_image_type(data):
+    """
+    根据文件头判断图片的 Content-Type，无法识别时返回 application/octet-stream
+    """
+    if data.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'image/png'
+    if data.startswith(b'\xff\xd8\xff'):
+        return 'image/jpeg'
+    if data.startswith((b'GIF87a', b'GIF89a')):
+        return 'image/gif'
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'image/webp'
+    if data[4:12] in (b'ftypavif', b'ftypavis'):
+        return 'image/avif'
+    return 'application/octet-stream'
+
+
+def image_bytes_from_column(value):
+    """
+    将数据库中的图片字段统一转为 bytes
+
+    早期接口允许直接写入 base64 字符串（可能带 dataURL 前缀），这里兼容两种形式；无法解析时返回 None
+    """
+    if value is None:
+        return None
+    if isinstance(value, memoryview):
+        return value.tobytes()
+    if isinstance(value, bytes):
+        return value
+    if isinstance(value, str):
+        if value.strip().startswith('data:') and ',' in value:
+            value = value.split(',', 1)[1]
+        try:
+            return base64.b64decode(value)
+        except Exception:
+            return None
+    return None
+
+
+def send_image_bytes(data, content_type=None):
+    """
+    以二进制流返回内存中的图片
+
+    ETag 为内容的 SHA-256（强校验），支持 If-None-Match 返回 304 以及 Range 分段请求，
+    响应体由 send_file 按块写出。
+    """
+    response = send_file(
+        io.BytesIO(data),
+        mimetype=content_type or sniff_image_type(data),
+        etag=hashlib.sha256(data).hexdigest(),
+        conditional=True,
+        max_age=0
+    )
+    response.headers['Cache-Control'] = PRIVATE_CACHE_CONTROL
+    return response
+
+
+def send_image_url(url, size=None):
+    """
+    以二进制流返回图片 URL 对应的图片
+
+    本地存储中的图片直接从文件流式返回（对象键中已包含内容哈希，无需再次计算 ETag），
+    其他 URL 经过图片缓存读取后返回。读取失败时抛出异常。
+
+    参数:
+        url: 图片 URL
+        size: 需要的尺寸（最长边像素，可选）；有合适的派生尺寸时返回 WebP 等格式的缩略图
+    """
+    key = derivative_for(url, size) if size else None
+    if key is None:
+        key = local_blob_store.key_for_url(url)
+    if key:
+        # 去掉扩展名的文件名：原图为内容哈希，派生图片再带上尺寸后缀
+        etag = key.split('/')[-1].rsplit('.', 1)[0]
+        response = send_file(local_blob_store.path_for(key), etag=etag, conditional=True, max_age=0)
+        response.headers['Cache-Control'] = PRIVATE_CACHE_CONTROL
+        return response
+    return send_image_bytes(load_image_cached(url))
@@ -0,0 +1,203 @@
+import functools
+import os
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from flask import current_app
+from utils.metrics import metrics
+from utils.singleflight import single_flight
+
+# 重复提交检查只针对这么多秒内创建的未结束任务
+JOB_DEDUP_WINDOW_SECONDS = int(os.environ.get('JOB_DEDUP_WINDOW_SECONDS', 600))
+
+# 任务类型 -> 处理函数，处理函数签名为 handler(user_id, params) -> (响应体字典, 状态码)
+_job_handlers = {}
+# 任务类型 -> 去重键函数 dedup_key(params)
+_dedup_keys = {}
+
+
+def dedup_id(value):
+    """
+    去重键中的 ID 统一为整数，使 "5" 与 5 视为同一调用；无法转换时原样返回，由处理函数给出参数错误
+
+    参数:
+        value: 请求参数中的 ID
+
+    返回:
+        整数 ID 或原值
+    """
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return value
+
+
+def job_handler(job_type, dedup_key=None):
+    """
+    注册任务处理函数的装饰器
+
+        @job_handler('character.generate_characters',
+                     dedup_key=lambda params: (dedup_id(params.get('storyline_id')), bool(params.get('no_cache'))))
+        def generate_characters_job(user_id, params):
+            ...
+            return {'success': True, ...}, 200
+
+    指定 dedup_key 时，同一用户、同一任务类型且去重键相同的调用视为重复：
+    执行中的相同调用（同步接口或后台任务）合并为一次并共享结果，重复提交的后台任务返回已有的任务。
+    """
+    def decorator(func):
+        if dedup_key is None:
+            _job_handlers[job_type] = func
+            return func
+
+        @functools.wraps(func)
+        def handler(user_id, params):
+            key = (job_type, user_id, dedup_key(params))
+            return single_flight.do(key, lambda: func(user_id, params))
+        _dedup_keys[job_type] = dedup_key
+        _job_handlers[job_type] = handler
+        return handler
+    return decorator
+
+
+class JobQueue(object):
+    """
+    后台任务队列
+
+    提交任务时只写入一条 Job 记录并立即返回 job_id，由执行者调用已注册的处理函数（即原有的生成逻辑），
+    客户端通过 /api/job/<job_id> 轮询状态和结果。
+
+    执行方式由环境变量 JOB_RUN_IN_WEB 控制：
+        1（默认）: 在 Web 进程内的线程池中执行，线程数由 JOB_WORKERS 配置
+        0: Web 进程只负责入队，由独立的 worker.py 进程轮询执行，从而分别扩缩 Web 与生成能力
+    """
+
+    def __init__(self, max_workers=4, run_in_web=True):
+        self.max_workers = max_workers
+        self.run_in_web = run_in_web
+        self._executor = None
+
+    def _get_executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='job-worker')
+        return self._executor
+
+    def submit(self, user_id, job_type, params):
+        """
+        提交任务
+
+        返回:
+            成功: 新创建的任务对象（状态为 pending）；重复提交时为已有的未结束任务
+            失败: (错误信息, 状态码)
+        """
+        from sql.job_db import Job
+
+        if job_type not in _job_handlers:
+            return (f"Unknown job type: {job_type}", 400)
+
+        dedup_key = _dedup_keys.get(job_type)
+        if dedup_key is not None:
+            key = dedup_key(params or {})
+            # 只认最近创建的任务，避免执行者异常退出后遗留的 running 任务一直挡住重新提交
+            since = datetime.utcnow() - timedelta(seconds=JOB_DEDUP_WINDOW_SECONDS)
+            for active_job in Job.get_active_jobs(user_id, job_type, since):
+                if dedup_key(active_job.params or {}) == key:
+                    metrics.incr('job.deduplicated')
+                    return active_job
+
+        job = Job.create_job_core(user_id, job_type, params)
+        if isinstance(job, tuple):
+            return job
+
+        if self.run_in_web:
+            app = current_app._get_current_object()
+            self._get_executor().submit(self._run_job, app, job.job_id)
+        return job
+
+    def submit_background(self, func, *args, **kwargs):
+        """
+        在任务线程池中执行一个不需要记录状态的后台函数（带应用上下文）
+        """
+        app = current_app._get_current_object()
+
+        def run():
+            with app.app_context():
+                try:
+                    func(*args, **kwargs)
+                except Exception:
+                    app.logger.error('Background task failed:\n%s', traceback.format_exc())
+
+        return self._get_executor().submit(run)
+
+    def _run_job(self, app, job_id):
+        with app.app_context():
+            from sql.job_db import Job
+            if Job.claim_job(job_id):
+                self._execute_claimed(job_id)
+
+    def _run_claimed_job(self, app, job_id):
+        with app.app_context():
+            self._execute_claimed(job_id)
+
+    def _execute_claimed(self, job_id):
+        """
+        执行一个已认领（running）的任务，并记录结果
+        """
+        from sql import db
+        from sql.job_db import Job
+        from agent.resilience import ModelUnavailableError
+        from agent.rate_limit import RateLimitExceeded
+
+        job = Job.query.get(job_id)
+        handler = _job_handlers.get(job.job_type)
+        try:
+            if handler is None:
+                raise ValueError(f"Unknown job type: {job.job_type}")
+            result, status_code = handler(job.user_id, job.params or {})
+            Job.finish_job(job_id, result=result, status_code=status_code)
+        except ModelUnavailableError as e:
+            db.session.rollback()
+            Job.finish_job(job_id, status_code=503, error=str(e))
+        except RateLimitExceeded as e:
+            db.session.rollback()
+            Job.finish_job(job_id, status_code=429, error=str(e))
+        except Exception as e:
+            db.session.rollback()
+            current_app.logger.error('Job %s failed:\n%s', job_id, traceback.format_exc())
+            Job.finish_job(job_id, status_code=500, error=str(e))
+
+    def run_worker(self, poll_interval=1.0):
+        """
+        独立 worker 进程的主循环：轮询 pending 任务，认领后交给线程池执行（需要在应用上下文中调用）
+        """
+        from sql import db
+        from sql.job_db import Job
+
+        app = current_app._get_current_object()
+        executor = self._get_executor()
+        in_flight = set()
+        app.logger.info('Job worker started with %d threads', self.max_workers)
+        while True:
+            in_flight = {future for future in in_flight if not future.done()}
+            free_slots = self.max_workers - len(in_flight)
+            job_ids = []
+            if free_slots > 0:
+                pending = Job.query.filter_by(status=Job.PENDING) \
+                    .order_by(Job.created_at.asc()).limit(free_slots).all()
+                job_ids = [job.job_id for job in pending]
+                # 结束只读事务，避免长时间持有快照读不到新任务
+                db.session.rollback()
+
+            for job_id in job_ids:
+                if Job.claim_job(job_id):
+                    in_flight.add(executor.submit(self._run_claimed_job, app, job_id))
+
+            if not job_ids:
+                time.sleep(poll_interval)
+
+
+job_queue = JobQueue(
+    max_workers=int(os.environ.get('JOB_WORKERS', 4)),
+    run_in_web=os.environ.get('JOB_RUN_IN_WEB', '1') == '1'
+)
@@ -0,0 +1,47 @@
+import threading
+
+
+class Metrics(object):
+    """
+    进程内的简单指标统计
+
+    计数器: incr(name) 累加次数
+    观测值: observe(name, value) 记录次数、总和、最大值与最近一次的值，用于查看平均值和峰值
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._observations = {}
+
+    def incr(self, name, value=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def observe(self, name, value):
+        with self._lock:
+            stat = self._observations.get(name)
+            if stat is None:
+                stat = self._observations[name] = {'count': 0, 'sum': 0, 'max': value, 'last': value}
+            stat['count'] += 1
+            stat['sum'] += value
+            stat['max'] = max(stat['max'], value)
+            stat['last'] = value
+
+    def snapshot(self):
+        """
+        返回当前所有指标的副本（观测值附带平均值）
+        """
+        with self._lock:
+            observations = {}
+            for name, stat in self._observations.items():
+                observations[name] = dict(stat, avg=stat['sum'] / stat['count'] if stat['count'] else 0)
+            return {'counters': dict(self._counters), 'observations': observations}
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._observations.clear()
+
+
+metrics = Metrics()
@@ -0,0 +1,62 @@
+import threading
+from utils.metrics import metrics
+
+
+class _Call(object):
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """
+    合并相同的并发调用：同一个键同时只执行一次，执行期间到达的相同调用等待并共享同一个结果（或异常）
+
+    用于重复点击、多个标签页同时触发同一生成等情况，避免重复调用模型和重复写入。
+    只在进程内生效；调用结束后立即移除，之后的调用会重新执行。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, func):
+        """
+        执行 func()，或等待正在执行的相同调用
+
+        参数:
+            key: 调用的键（可哈希）
+            func: 无参数的调用函数
+
+        返回:
+            func 的返回值；执行失败时所有等待者都收到同一个异常
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                leader = False
+            else:
+                call = self._calls[key] = _Call()
+                leader = True
+
+        if not leader:
+            metrics.incr('singleflight.shared')
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+
+single_flight = SingleFlight()
@@ -0,0 +1,8 @@
+from launch import app
+from utils.job_queue import job_queue
+
+# 独立的生成任务执行进程（配合 JOB_RUN_IN_WEB=0 使用）：
+#   python worker.py
+if __name__ == '__main__':
+    with app.app_context():
+        job_queue.run_worker()